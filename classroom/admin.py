@@ -6,7 +6,12 @@ admin.site.register(Course)
 admin.site.register(MyFile)
 admin.site.register(Lesson)
 admin.site.register(Question)
+admin.site.register(QuestionBank)
+admin.site.register(QuestionTag)
 admin.site.register(Quiz)
+admin.site.register(QuizAttempt)
+admin.site.register(QueuedEmail)
+admin.site.register(Recommendation)
 admin.site.register(StudentAnswer)
 admin.site.register(Student)
 admin.site.register(Subject)
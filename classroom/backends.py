@@ -0,0 +1,19 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+UserModel = get_user_model()
+
+
+class ProfileModelBackend(ModelBackend):
+    """Loads the logged in user together with its student/teacher profile
+    in one joined query. AuthenticationMiddleware resolves request.user
+    through get_user() once per request, so the *_required decorators,
+    the views and base.html get request.user.student and
+    request.user.teacher without extra queries."""
+
+    def get_user(self, user_id):
+        try:
+            user = UserModel._default_manager.select_related('student', 'teacher').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,157 @@
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import FileBlob, StoredFile
+import hashlib
+import os
+import tempfile
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Media storage that keeps one copy of every distinct uploaded file.
+    For the directories of CONTENT_ADDRESSED_DIRS, the content is stored in
+    .blobs/<sha256[:2]>/<sha256> and the usual name (e.g.
+    class_resources/notes.pdf) is a hard link to it, so the same PDF uploaded
+    to several courses uses the disk once, while sorl-thumbnail, the file
+    views and the web server still open plain file names. FileBlob counts
+    the names of every blob, the gc_file_blobs command deletes the unused
+    ones. Other directories (e.g. the thumbnails) are stored as usual."""
+    blobs_dir = '.blobs'
+
+    def is_content_addressed(self, name):
+        return name.startswith(tuple(settings.CONTENT_ADDRESSED_DIRS))
+
+    def get_blob_path(self, sha256):
+        return self.path(f'{self.blobs_dir}/{sha256[:2]}/{sha256}')
+
+    def write_temporary_file(self, content):
+        """Copies the content next to the blobs (same file system, so it can be
+        linked) and hashes it on the way. Returns (path, sha256, size)."""
+        temp_dir = self.path(f'{self.blobs_dir}/tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        sha256 = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in content.chunks():
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                sha256.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        return temp_path, sha256.hexdigest(), size
+
+    def publish_blob(self, temp_path, sha256):
+        """Makes the temporary file the blob of its hash, unless it exists already."""
+        blob_path = self.get_blob_path(sha256)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        try:
+            os.link(temp_path, blob_path)
+        except FileExistsError:
+            pass
+        return blob_path
+
+    def link_name(self, blob_path, name):
+        """Links name to the blob, with a new name (like the default storage)
+        if it is taken. Returns the name."""
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+        while True:
+            try:
+                os.link(blob_path, self.path(name))
+                return name
+            except FileExistsError:
+                name = self.get_available_name(name)
+
+    def _save(self, name, content):
+        if not self.is_content_addressed(name):
+            return super()._save(name, content)
+
+        temp_path, sha256, size = self.write_temporary_file(content)
+        try:
+            try:
+                blob_path = self.publish_blob(temp_path, sha256)
+            except OSError:
+                # The file system has no hard links, the file is stored as usual:
+                with open(temp_path, 'rb') as f:
+                    return super()._save(name, File(f))
+
+            add_blob_reference(sha256, size)
+            try:
+                name = self.link_name(blob_path, name)
+            except FileNotFoundError:
+                # gc_file_blobs deleted the blob in the meantime, put it back:
+                blob_path = self.publish_blob(temp_path, sha256)
+                name = self.link_name(blob_path, name)
+            StoredFile.objects.create(name=name, blob_id=sha256)
+        finally:
+            os.remove(temp_path)
+
+        return name
+
+    def adopt(self, name):
+        """Moves a file stored before this storage was used to its blob: the
+        file becomes a hard link to the blob of its content (the existing
+        one if the content is already stored). Returns the SHA-256."""
+        path = self.path(name)
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                sha256.update(chunk)
+        sha256 = sha256.hexdigest()
+
+        blob_path = self.publish_blob(path, sha256)
+        if not os.path.samefile(path, blob_path):
+            temp_path = f'{path}.{sha256[:8]}.tmp'
+            os.link(blob_path, temp_path)
+            os.replace(temp_path, path)
+        add_blob_reference(sha256, os.path.getsize(path))
+        StoredFile.objects.create(name=name, blob_id=sha256)
+        return sha256
+
+    def delete(self, name):
+        super().delete(name)
+        if self.is_content_addressed(name):
+            sha256 = get_content_hash(name)
+            if sha256 is not None:
+                StoredFile.objects.filter(name=name).delete()
+                FileBlob.objects.filter(pk=sha256) \
+                    .update(ref_count=F('ref_count') - 1, last_referenced_at=timezone.now())
+
+
+def add_blob_reference(sha256, size):
+    """Counts one more name for the blob, creating its row for new content.
+    The UPDATE comes first, so a blob that gc_file_blobs is deleting at the
+    same time is created again instead of being counted while gone."""
+    while not FileBlob.objects.filter(pk=sha256) \
+            .update(ref_count=F('ref_count') + 1, last_referenced_at=timezone.now()):
+        try:
+            with transaction.atomic():
+                FileBlob.objects.create(sha256=sha256, size=size, ref_count=1)
+            return
+        except IntegrityError:
+            continue
+
+
+def get_content_hash(name):
+    """The SHA-256 of a content-addressed media file, or None."""
+    return StoredFile.objects.filter(name=name).values_list('blob_id', flat=True).first()
+
+
+def collect_garbage(storage, min_age):
+    """Deletes the blobs that no name has used for min_age seconds.
+    Returns the number of deleted blobs."""
+    cutoff = timezone.now() - timezone.timedelta(seconds=min_age)
+    deleted = 0
+    for sha256 in FileBlob.objects.filter(ref_count__lte=0, last_referenced_at__lt=cutoff) \
+            .values_list('sha256', flat=True):
+        # Only if it was not referenced again since the SELECT:
+        if FileBlob.objects.filter(pk=sha256, ref_count__lte=0).delete()[0]:
+            try:
+                os.remove(storage.get_blob_path(sha256))
+            except FileNotFoundError:
+                pass
+            deleted += 1
+    return deleted
@@ -0,0 +1,131 @@
+from django.conf import settings
+from django.contrib.staticfiles import finders
+import os
+import posixpath
+import re
+
+try:
+    from rjsmin import jsmin
+except ImportError:  # rjsmin is optional, the scripts are only concatenated without it
+    jsmin = None
+
+BUNDLES_DIR = 'bundles'
+
+CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+CSS_IMPORT_RE = re.compile(r'@import\s+[^;]+;')
+CSS_CHARSET_RE = re.compile(r'@charset\s+[^;]+;')
+CSS_URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+def read_static_file(path):
+    absolute_path = finders.find(path)
+    if absolute_path is None:
+        raise FileNotFoundError(f'The static file {path} of a bundle could not be found.')
+    with open(absolute_path, encoding='utf-8') as f:
+        return f.read()
+
+
+def rebase_css_urls(css, source_path):
+    """Rewrites the relative url()s of a stylesheet so that they still
+    point to the same files from the bundles directory."""
+    source_dir = posixpath.dirname(source_path)
+
+    def rebase(match):
+        quote, url = match.groups()
+        if url.startswith(('/', 'data:', 'http:', 'https:', '#')):
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        target = posixpath.normpath(posixpath.join(source_dir, path))
+        return f'url({quote}{posixpath.relpath(target, BUNDLES_DIR)}{suffix}{quote})'
+
+    return CSS_URL_RE.sub(rebase, css)
+
+
+def minify_css(css):
+    css = CSS_COMMENT_RE.sub('', css)
+    css = re.sub(r'\s+', ' ', css)
+    # The spaces before ':' are kept, they matter in selectors (e.g. "a :hover"):
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+
+def build_css(paths):
+    imports = []
+    parts = []
+    for path in paths:
+        css = CSS_COMMENT_RE.sub('', read_static_file(path))
+        css = CSS_CHARSET_RE.sub('', css)
+        # @import is only allowed at the top of a stylesheet:
+        imports.extend(CSS_IMPORT_RE.findall(css))
+        css = CSS_IMPORT_RE.sub('', css)
+        parts.append(rebase_css_urls(css, path))
+    return minify_css('\n'.join(imports + parts))
+
+
+def build_js(paths):
+    scripts = [read_static_file(path) for path in paths]
+    if jsmin is not None:
+        scripts = [jsmin(script) for script in scripts]
+    # The semicolons protect files that do not end their last statement:
+    return '\n;'.join(scripts)
+
+
+def split_css_rules(css):
+    """Splits a minified stylesheet into its top-level rules (at-rules included)."""
+    rules = []
+    depth = 0
+    start = 0
+    for i, char in enumerate(css):
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                rules.append(css[start:i + 1])
+                start = i + 1
+        elif char == ';' and depth == 0:
+            rules.append(css[start:i + 1])
+            start = i + 1
+    return rules
+
+
+def extract_critical_css(css, selectors):
+    """Keeps the rules that style the given above-the-fold selectors.
+    @media blocks are filtered the same way, @import, @font-face and
+    @keyframes are left to the full stylesheet."""
+    critical = []
+    for rule in split_css_rules(css):
+        if rule.startswith('@media'):
+            query, body = rule.split('{', 1)
+            inner = extract_critical_css(body[:-1], selectors)
+            if inner:
+                critical.append(f'{query}{{{inner}}}')
+        elif not rule.startswith('@'):
+            rule_selectors = rule.split('{', 1)[0].split(',')
+            if any(s.strip().startswith(selectors) for s in rule_selectors):
+                critical.append(rule)
+    return ''.join(critical)
+
+
+def build_bundles():
+    """Writes every bundle of settings.STATIC_BUNDLES to static/bundles/,
+    plus a .critical.css file for the stylesheets listed in CRITICAL_CSS.
+    Returns the written file names."""
+    output_dir = os.path.join(settings.BASE_DIR, 'static', BUNDLES_DIR)
+    os.makedirs(output_dir, exist_ok=True)
+    written = {}
+
+    for name, paths in settings.STATIC_BUNDLES.items():
+        content = build_css(paths) if name.endswith('.css') else build_js(paths)
+        written[name] = content
+
+        if name in settings.CRITICAL_CSS:
+            critical_name = name.replace('.css', '.critical.css')
+            written[critical_name] = extract_critical_css(content, tuple(settings.CRITICAL_CSS[name]))
+
+    for name, content in written.items():
+        with open(os.path.join(output_dir, name), 'w', encoding='utf-8') as f:
+            f.write(content)
+
+    return list(written)
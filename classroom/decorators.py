@@ -17,9 +17,10 @@ def staff_required(function=None, redirect_field_name=REDIRECT_FIELD_NAME, login
 
 def student_required(function=None, redirect_field_name=REDIRECT_FIELD_NAME, login_url='login'):
     """Decorator for views that checks that the logged in user is a student,
-    redirects to the log-in page if necessary."""
+    redirects to the log-in page if necessary.
+    The student profile is already loaded with the user (see backends.py)."""
     actual_decorator = user_passes_test(
-        lambda u: u.is_active and u.is_student,
+        lambda u: u.is_active and u.is_student and hasattr(u, 'student'),
         login_url=login_url,
         redirect_field_name=redirect_field_name
     )
@@ -43,9 +44,10 @@ def superuser_required(function=None, redirect_field_name=REDIRECT_FIELD_NAME, l
 
 def teacher_required(function=None, redirect_field_name=REDIRECT_FIELD_NAME, login_url='login'):
     """Decorator for views that checks that the logged in user is a teacher,
-    redirects to the log-in page if necessary."""
+    redirects to the log-in page if necessary.
+    The teacher profile is already loaded with the user (see backends.py)."""
     actual_decorator = user_passes_test(
-        lambda u: u.is_active and u.is_teacher,
+        lambda u: u.is_active and u.is_teacher and hasattr(u, 'teacher'),
         login_url=login_url,
         redirect_field_name=redirect_field_name
     )
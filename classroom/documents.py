@@ -0,0 +1,140 @@
+"""Extraction of the page count, the text and a first-page image of the
+course files. This runs in the worker processes of classroom/previews.py,
+so it does not use Django (a worker may be started without it).
+
+.docx/.pptx are read directly from their XML. Rendering the first page,
+and reading .pdf/.doc/.ppt, uses LibreOffice (soffice) and poppler-utils
+(pdfinfo, pdftotext, pdftoppm) when they are installed."""
+from io import BytesIO
+from PIL import Image
+from xml.etree import ElementTree
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import zipfile
+
+TOOL_TIMEOUT = 120  # seconds per command, a broken file must not block a worker
+PDF_TEXT_PAGES = 3
+
+WORDPROCESSING_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+DRAWING_NS = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+APP_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/extended-properties}'
+
+SLIDE_RE = re.compile(r'^ppt/slides/slide(\d+)\.xml$')
+PDF_PAGE_RE = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+PDF_PAGES_RE = re.compile(r'^Pages:\s+(\d+)', re.MULTILINE)
+
+
+def run(*args):
+    return subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          timeout=TOOL_TIMEOUT, check=True).stdout
+
+
+def resize_image(f, width):
+    """Returns the image as a PNG of at most width pixels wide."""
+    image = Image.open(f)
+    image.thumbnail((width, width * 2), Image.LANCZOS)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def get_paragraphs(xml, tag, paragraph_tag):
+    root = ElementTree.fromstring(xml)
+    for paragraph in root.iter(paragraph_tag):
+        text = ''.join(node.text or '' for node in paragraph.iter(tag))
+        if text.strip():
+            yield text
+
+
+def read_ooxml(path, extension, image_width, max_size):
+    """Page (slide) count from docProps/app.xml, text from the document XML
+    and the thumbnail that Office saves in docProps (if any). The parts are
+    read into memory, so the ones bigger than max_size when uncompressed
+    (e.g. a zip bomb) are skipped."""
+    result = {}
+    with zipfile.ZipFile(path) as archive:
+        sizes = {info.filename: info.file_size for info in archive.infolist()}
+
+        if sizes.get('docProps/app.xml', max_size + 1) <= max_size:
+            app = ElementTree.fromstring(archive.read('docProps/app.xml'))
+            count = app.findtext(APP_NS + ('Slides' if extension == '.pptx' else 'Pages'))
+            if count and count.isdigit():
+                result['page_count'] = int(count)
+
+        if extension == '.pptx':
+            slides = sorted((int(m.group(1)), name) for name in sizes for m in [SLIDE_RE.match(name)] if m)
+            if sum(sizes[name] for _, name in slides) <= max_size:
+                result['text'] = '\n'.join(paragraph for _, name in slides
+                                           for paragraph in get_paragraphs(archive.read(name), DRAWING_NS + 't',
+                                                                           DRAWING_NS + 'p'))
+            result.setdefault('page_count', len(slides))
+        elif sizes.get('word/document.xml', max_size + 1) <= max_size:
+            result['text'] = '\n'.join(get_paragraphs(archive.read('word/document.xml'), WORDPROCESSING_NS + 't',
+                                                      WORDPROCESSING_NS + 'p'))
+
+        for name in ('docProps/thumbnail.jpeg', 'docProps/thumbnail.png'):
+            if name in sizes:
+                if sizes[name] <= max_size:
+                    with archive.open(name) as f:
+                        result['image'] = resize_image(BytesIO(f.read()), image_width)
+                break
+    return result
+
+
+def convert_to_pdf(path, out_dir):
+    """Converts an office document with LibreOffice, returns None without it."""
+    soffice = shutil.which('soffice') or shutil.which('libreoffice')
+    if soffice is None:
+        return None
+    # Its own profile, so that several workers can convert at the same time:
+    run(soffice, f'-env:UserInstallation=file://{out_dir}/profile', '--headless',
+        '--convert-to', 'pdf', '--outdir', out_dir, path)
+    pdf_path = os.path.join(out_dir, os.path.splitext(os.path.basename(path))[0] + '.pdf')
+    return pdf_path if os.path.exists(pdf_path) else None
+
+
+def read_pdf(path, out_dir, image_width, max_size):
+    result = {}
+    if shutil.which('pdfinfo'):
+        match = PDF_PAGES_RE.search(run('pdfinfo', path).decode(errors='replace'))
+        if match:
+            result['page_count'] = int(match.group(1))
+    elif os.path.getsize(path) <= max_size:
+        # Counts the page objects, right for most files that are not compressed object streams:
+        with open(path, 'rb') as f:
+            result['page_count'] = len(PDF_PAGE_RE.findall(f.read())) or None
+
+    if shutil.which('pdftotext'):
+        result['text'] = run('pdftotext', '-l', str(PDF_TEXT_PAGES), '-enc', 'UTF-8',
+                             path, '-').decode(errors='replace')
+
+    if shutil.which('pdftoppm'):
+        prefix = os.path.join(out_dir, 'page')
+        run('pdftoppm', '-png', '-f', '1', '-l', '1', '-singlefile',
+            '-scale-to', str(image_width * 2), path, prefix)
+        result['image'] = resize_image(prefix + '.png', image_width)
+    return result
+
+
+def extract(path, extension, max_text=2000, image_width=300, max_size=50 * 1024 * 1024):
+    """Returns the page_count (or None), the text (at most max_text
+    characters) and the PNG image of the first page (or None) of a file.
+    No more than max_size bytes of the file are read into memory at once."""
+    result = {'page_count': None, 'text': '', 'image': None}
+    with tempfile.TemporaryDirectory() as out_dir:
+        if extension in ('.docx', '.pptx'):
+            result.update(read_ooxml(path, extension, image_width, max_size))
+
+        pdf_path = path if extension == '.pdf' else convert_to_pdf(path, out_dir)
+        if pdf_path is not None:
+            # The rendered PDF is more exact than the properties saved by Office:
+            result.update((key, value) for key, value in read_pdf(pdf_path, out_dir, image_width, max_size).items()
+                          if value)
+
+    result['text'] = re.sub(r'[ \t]+', ' ', re.sub(r'\s*\n\s*', '\n', result['text'])).strip()[:max_text]
+    return result
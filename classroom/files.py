@@ -0,0 +1,218 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.db.models import Exists, OuterRef, Q
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from urllib.parse import quote
+from .blobs import get_content_hash
+from .models import Course, MyFile, TakenCourse
+import base64
+import hashlib
+import mimetypes
+import os
+import re
+import time
+
+# The course material formats, so they do not depend on the mime.types of the server:
+CONTENT_TYPES = {
+    '.pdf': 'application/pdf',
+    '.doc': 'application/msword',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.ppt': 'application/vnd.ms-powerpoint',
+    '.pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+}
+
+# Enrollment statuses that give access to the files of a course:
+ACCESS_STATUSES = ('enrolled', 'finished')
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def get_accessible_file(user, pk):
+    """Returns the MyFile if the user owns its course, is enrolled in it
+    (or finished it) or is staff, else None. The enrollment is checked with
+    an EXISTS subquery, so this is a single query."""
+    files = MyFile.objects.filter(pk=pk).only('id', 'file', 'course_id')
+    if not user.is_staff:
+        enrollment = TakenCourse.objects.filter(course_id=OuterRef('course_id'),
+                                                student_id=user.pk,
+                                                status__in=ACCESS_STATUSES)
+        files = files.annotate(enrolled=Exists(enrollment)) \
+            .filter(Q(course__owner_id=user.pk) | Q(enrolled=True))
+    return files.first()
+
+
+def has_course_access(user, course_pk):
+    """Same rules as get_accessible_file, for everything of a course."""
+    if user.is_staff:
+        return True
+    return Course.objects.filter(pk=course_pk) \
+        .filter(Q(owner_id=user.pk) | Q(taken_courses__student_id=user.pk,
+                                        taken_courses__status__in=ACCESS_STATUSES)) \
+        .exists()
+
+
+def get_url_signature(uri, expires):
+    """The signature of nginx's secure_link module, configured with
+    secure_link_md5 "$secure_link_expires$uri <FILE_SIGNED_URL_SECRET>";
+    (see README), so nginx can check the URLs without asking Django."""
+    if not settings.FILE_SIGNED_URL_SECRET:
+        raise ImproperlyConfigured('FILE_SIGNED_URL_SECRET is required to sign the file URLs.')
+    digest = hashlib.md5(f'{expires}{uri} {settings.FILE_SIGNED_URL_SECRET}'.encode()).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+
+def get_signed_url(name, max_age=None):
+    """Returns a URL of the media file that works for max_age seconds
+    (FILE_SIGNED_URL_MAX_AGE by default), for anyone who has it."""
+    expires = int(time.time()) + (max_age or settings.FILE_SIGNED_URL_MAX_AGE)
+    uri = settings.FILE_SIGNED_URL_PREFIX + name
+    return f'{quote(uri)}?md5={get_url_signature(uri, expires)}&expires={expires}'
+
+
+def is_valid_signature(uri, signature, expires):
+    # Without a secret no URL was ever signed (and the view must not fail with a 500):
+    if not settings.FILE_SIGNED_URL_SECRET:
+        return False
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    return expires >= time.time() and constant_time_compare(signature, get_url_signature(uri, expires))
+
+
+def get_content_type(name):
+    extension = os.path.splitext(name)[1].lower()
+    if extension in CONTENT_TYPES:
+        return CONTENT_TYPES[extension]
+    content_type, encoding = mimetypes.guess_type(name)
+    # A compressed file is sent as is, the browser must not decompress it:
+    if encoding or not content_type:
+        return 'application/octet-stream'
+    return content_type
+
+
+def get_content_disposition(filename, as_attachment=False):
+    disposition = 'attachment' if as_attachment else 'inline'
+    try:
+        filename.encode('ascii')
+        return f'{disposition}; filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"{disposition}; filename*=utf-8''{quote(filename)}"
+
+
+def get_etag(name, stat):
+    """The SHA-256 of the content when the storage knows it, so the same
+    content has the same ETag under every name, else one that changes
+    whenever the file is replaced or modified."""
+    sha256 = get_content_hash(name)
+    if sha256 is not None:
+        return quote_etag(sha256)
+    return quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+
+
+def parse_range(header, size):
+    """Returns the (first, last) byte positions of a single 'bytes=' range,
+    None when the whole file should be sent (no header, several ranges or an
+    unknown unit), and False when the range cannot be satisfied."""
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if not first:
+        if not last or int(last) == 0:
+            return False
+        # bytes=-500 is the last 500 bytes:
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        return False
+    return first, last
+
+
+def if_range_passes(request, etag, last_modified):
+    """A Range is only honoured if the file did not change since the client
+    got the first part (If-Range holds either an ETag or a date)."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return parse_etags(if_range) == [etag]
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def read_range(path, first, last):
+    with open(path, 'rb') as f:
+        f.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, name, filename=None, as_attachment=False):
+    """Sends the media file stored under name (e.g. 'class_resources/notes.pdf').
+    Handles conditional GETs (ETag/Last-Modified) and single byte ranges, so
+    browsers can resume downloads and PDF viewers can fetch pages on demand.
+    With FILE_DELIVERY set to 'x-accel-redirect' (nginx) or 'x-sendfile'
+    (Apache), only the headers are returned and the web server sends the
+    file itself. The caller is responsible for checking the permissions."""
+    path = default_storage.path(name)
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404()
+
+    filename = filename or os.path.basename(name)
+    content_type = get_content_type(filename)
+    etag = get_etag(name, stat)
+    last_modified = int(stat.st_mtime)
+
+    if settings.FILE_DELIVERY in ('x-accel-redirect', 'x-sendfile'):
+        # The web server handles the ranges and the conditional requests:
+        response = HttpResponse(content_type=content_type)
+        if settings.FILE_DELIVERY == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = quote(settings.FILE_DELIVERY_ACCEL_PREFIX + name)
+        else:
+            response['X-Sendfile'] = path
+        response['Content-Disposition'] = get_content_disposition(filename, as_attachment)
+        return response
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    byte_range = None
+    if 'HTTP_RANGE' in request.META and if_range_passes(request, etag, last_modified):
+        byte_range = parse_range(request.META['HTTP_RANGE'], stat.st_size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+    elif byte_range is not None:
+        first, last = byte_range
+        response = StreamingHttpResponse(read_range(path, first, last), status=206,
+                                         content_type=content_type)
+        response['Content-Range'] = f'bytes {first}-{last}/{stat.st_size}'
+        response['Content-Length'] = last - first + 1
+    else:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response.block_size = CHUNK_SIZE
+        response['Content-Length'] = stat.st_size
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Content-Disposition'] = get_content_disposition(filename, as_attachment)
+    # The course materials are not public, shared caches must not keep them:
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -1,5 +1,5 @@
-from classroom.models import (Answer, Course, MyFile, Lesson, Question, Quiz, Student,
-                              StudentAnswer, Subject, Teacher, User)
+from classroom.models import (Answer, Course, MyFile, Lesson, Question, QuestionBank, QuestionTag, Quiz,
+                              Student, StudentAnswer, Subject, Teacher, User)
 from django import forms
 from django.contrib.auth import authenticate
 from django.contrib.auth.forms import UserCreationForm
@@ -63,6 +63,23 @@ class CourseAddForm(forms.ModelForm):
             .all().order_by('name')
 
 
+class CourseCloneForm(forms.ModelForm):
+    title = forms.CharField(max_length=100)
+    code = forms.CharField(max_length=20, label='Course Code',
+                           help_text='The new course gets copies of the lessons, quizzes and files, '
+                                     'but no students. It has to be approved again.')
+
+    class Meta:
+        model = Course
+        fields = ('title', 'code')
+
+
+class CourseImportForm(forms.Form):
+    package = forms.FileField(label='Course package',
+                              help_text='A .zip or .json file exported from a course. '
+                                        'Its lessons, quizzes, questions and answers are added to this course.')
+
+
 class FileAddForm(forms.ModelForm):
     file = forms.FileField(widget=forms.ClearableFileInput(attrs={'multiple': True}),
                            help_text='Allowed file formats: .pdf, .doc, .docx, .ppt, and .pptx.')
@@ -142,10 +159,62 @@ class QuizAddForm(forms.ModelForm):
 class QuizEditForm(forms.ModelForm):
     title = forms.CharField(max_length=255,
                             widget=forms.TextInput(attrs={'autocomplete': 'off'}))
+    draw_count = forms.IntegerField(min_value=0, max_value=500, label='Questions per attempt',
+                                    help_text='Each student gets this number of random questions of the quiz '
+                                              'and of the question bank. 0 gives every question.')
+    time_limit = forms.IntegerField(min_value=0, max_value=600, label='Time limit (minutes)',
+                                    help_text='The unanswered questions count as wrong when the time is up. '
+                                              '0 means no limit.')
+    max_attempts = forms.IntegerField(min_value=0, max_value=100, label='Attempts per student',
+                                      help_text='0 means no limit.')
 
     class Meta:
         model = Quiz
-        fields = ('title', )
+        fields = ('title', 'bank', 'bank_tag', 'draw_count', 'time_limit', 'max_attempts', 'score_policy')
+        labels = {
+            'bank': 'Question bank',
+            'bank_tag': 'Only the bank questions tagged',
+            'score_policy': 'Grade',
+        }
+
+    def __init__(self, current_user, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Only the teacher's banks of the subject of the course:
+        self.fields['bank'].queryset = QuestionBank.objects \
+            .filter(owner=current_user, subject_id=self.instance.course.subject_id) \
+            .order_by('name')
+        # The tags of the teacher's banks, only the ones of the selected bank when it is known:
+        bank_id = self.data.get('bank') if self.is_bound else self.instance.bank_id
+        tag_filter = {'questions__bank__owner': current_user}
+        if bank_id and str(bank_id).isdigit():
+            tag_filter['questions__bank_id'] = bank_id
+        self.fields['bank_tag'].queryset = QuestionTag.objects \
+            .filter(**tag_filter) \
+            .distinct() \
+            .order_by('name')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        bank = cleaned_data.get('bank')
+        bank_tag = cleaned_data.get('bank_tag')
+        if bank_tag and not bank:
+            self.add_error('bank_tag', 'Select the question bank of the tag.')
+        elif bank_tag and not Question.objects.filter(bank=bank, tags=bank_tag).exists():
+            # The quiz would draw no questions of the bank:
+            self.add_error('bank_tag', 'No question of the selected bank has this tag.')
+        return cleaned_data
+
+
+class QuestionBankForm(forms.ModelForm):
+    name = forms.CharField(max_length=100, widget=forms.TextInput(attrs={'autocomplete': 'off'}))
+
+    class Meta:
+        model = QuestionBank
+        fields = ('name', 'subject')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['subject'].queryset = self.fields['subject'].queryset.order_by('name')
 
 
 class QuestionForm(forms.ModelForm):
@@ -156,6 +225,32 @@ class QuestionForm(forms.ModelForm):
         fields = ('text', )
 
 
+class BankQuestionForm(QuestionForm):
+    tags = forms.CharField(max_length=255, required=False,
+                           widget=forms.TextInput(attrs={'autocomplete': 'off'}),
+                           help_text='Separated by commas, e.g. fractions, word problems. '
+                                     'A quiz can draw only the questions with a tag.')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.initial['tags'] = ', '.join(tag.name for tag in self.instance.tags.order_by('name'))
+
+    def clean_tags(self):
+        names = {name.strip().lower() for name in self.cleaned_data['tags'].split(',')} - {''}
+        max_length = QuestionTag._meta.get_field('name').max_length
+        if any(len(name) > max_length for name in names):
+            raise ValidationError(f'A tag can have at most {max_length} characters.')
+        return sorted(names)
+
+    def save_tags(self, question):
+        tags = []
+        for name in self.cleaned_data['tags']:
+            tag, _ = QuestionTag.objects.get_or_create(name=name)
+            tags.append(tag)
+        question.tags.set(tags)
+
+
 class SearchCourses(forms.ModelForm):
     search = forms.CharField(widget=forms.TextInput(attrs={'placeholder': 'Enter your keywords here...'}), label='')
 
@@ -259,17 +354,26 @@ class UserLoginForm(forms.Form):
     username = forms.CharField()
     password = forms.CharField(widget=forms.PasswordInput)
 
+    def __init__(self, *args, request=None, **kwargs):
+        self.request = request
+        self.user_cache = None
+        super(UserLoginForm, self).__init__(*args, **kwargs)
+
     def clean(self, *args, **kwargs):
         username = self.cleaned_data.get('username')
         password = self.cleaned_data.get('password')
 
         if username and password:
-            user = authenticate(username=username, password=password)
-            if user is None:
+            # The password is hashed only here, the view reuses the user through get_user():
+            self.user_cache = authenticate(self.request, username=username, password=password)
+            if self.user_cache is None:
                 raise forms.ValidationError('You entered an invalid username and/or password. Please try again.')
 
         return super(UserLoginForm, self).clean()
 
+    def get_user(self):
+        return self.user_cache
+
 
 class UserUpdateForm(forms.ModelForm):
     email = forms.EmailField()
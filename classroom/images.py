@@ -0,0 +1,143 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from hashlib import md5
+from io import BytesIO
+from PIL import Image, ImageOps, features
+import logging
+import posixpath
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'variants'
+WEBP_SUPPORTED = features.check('webp')
+
+# Variants are only generated here, in the background, never while rendering a page:
+executor = ThreadPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS, thread_name_prefix='image-variants')
+
+
+def get_fallback_extension(name):
+    """PNGs keep their transparency, everything else is served as JPEG."""
+    return '.png' if name.lower().endswith('.png') else '.jpg'
+
+
+def get_variant_name(name, width, height, extension):
+    root = posixpath.splitext(name)[0]
+    return f'{VARIANTS_DIR}/{root}-{width}x{height}{extension}'
+
+
+def get_variant_extensions(name):
+    extensions = [get_fallback_extension(name)]
+    if WEBP_SUPPORTED:
+        extensions.append('.webp')
+    return extensions
+
+
+def get_cache_key(variant_name):
+    # Hashed so that any file name makes a valid cache key:
+    return f'image-variant:{md5(variant_name.encode()).hexdigest()}'
+
+
+def get_existing_variants(variant_names):
+    """The names of the variants that exist, with one cache lookup. The
+    storage is only asked about the ones missing from the cache. A variant
+    name contains the name of its original file, and a new upload always
+    gets a new name, so a variant that exists never goes stale; a missing
+    one is only remembered briefly (IMAGE_VARIANT_MISSING_TIMEOUT), until
+    generate_variants saves it."""
+    found = cache.get_many([get_cache_key(variant_name) for variant_name in variant_names])
+    existing = set()
+    exists, missing = {}, {}
+    for variant_name in variant_names:
+        key = get_cache_key(variant_name)
+        if key in found:
+            if found[key]:
+                existing.add(variant_name)
+        elif default_storage.exists(variant_name):
+            existing.add(variant_name)
+            exists[key] = True
+        else:
+            missing[key] = False
+
+    if exists:
+        cache.set_many(exists, settings.IMAGE_VARIANT_CACHE_TIMEOUT)
+    if missing:
+        cache.set_many(missing, settings.IMAGE_VARIANT_MISSING_TIMEOUT)
+    return existing
+
+
+def get_variants(name, kind, extension):
+    """Returns the (url, width) of the variants of an image that were already
+    generated. The missing ones are left out, nothing is generated here."""
+    sizes = [(width, get_variant_name(name, width, height, extension))
+             for width, height in settings.IMAGE_VARIANTS[kind]]
+    existing = get_existing_variants([variant_name for _, variant_name in sizes])
+    return [(default_storage.url(variant_name), width) for width, variant_name in sizes if variant_name in existing]
+
+
+def save_variant(image, variant_name, extension):
+    buffer = BytesIO()
+    if extension == '.webp':
+        image.save(buffer, 'WEBP', quality=80, method=4)
+    elif extension == '.png':
+        image.save(buffer, 'PNG', optimize=True)
+    else:
+        image.convert('RGB').save(buffer, 'JPEG', quality=82, optimize=True, progressive=True)
+
+    if default_storage.exists(variant_name):
+        default_storage.delete(variant_name)
+    default_storage.save(variant_name, ContentFile(buffer.getvalue()))
+    # Replaces a cached "missing":
+    cache.set(get_cache_key(variant_name), True, settings.IMAGE_VARIANT_CACHE_TIMEOUT)
+
+
+def generate_variants(name, kind, force=False):
+    """Generates the fixed sizes of settings.IMAGE_VARIANTS[kind] for the
+    image stored under name, as JPEG/PNG and WebP. Each size is cropped
+    around the center, and sizes wider than the original are skipped
+    (except the smallest one). Returns the number of files written."""
+    sizes = settings.IMAGE_VARIANTS[kind]
+    extensions = get_variant_extensions(name)
+    # The smallest size is always generated, and last, so it marks a finished image:
+    smallest_width, smallest_height = sizes[0]
+    smallest = [get_variant_name(name, smallest_width, smallest_height, extension) for extension in extensions]
+    if not force and get_existing_variants(smallest) == set(smallest):
+        return 0
+
+    with default_storage.open(name) as f:
+        original = Image.open(f)
+        # Photos from phones are often stored sideways with an EXIF orientation (Pillow 6+):
+        if hasattr(ImageOps, 'exif_transpose'):
+            original = ImageOps.exif_transpose(original)
+        original.load()
+
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+
+    written = 0
+    for width, height in reversed(sizes):
+        if width > original.width and (width, height) != sizes[0]:
+            continue
+        resized = ImageOps.fit(original, (width, height), Image.LANCZOS)
+        for extension in extensions:
+            save_variant(resized, get_variant_name(name, width, height, extension), extension)
+            written += 1
+    return written
+
+
+def generate_variants_safely(name, kind):
+    try:
+        generate_variants(name, kind)
+    except Exception:
+        logger.exception('Could not generate the %s variants of %s', kind, name)
+
+
+def generate_variants_later(image, kind):
+    """Queues the generation of the variants of an uploaded image on the
+    background pool, once the current transaction is committed."""
+    if image:
+        name = image.name
+        transaction.on_commit(lambda: executor.submit(generate_variants_safely, name, kind))
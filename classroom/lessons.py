@@ -0,0 +1,194 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.html import escape
+from django.utils.text import Truncator
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+import re
+
+EXCERPT_LENGTH = 300  # characters
+
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'caption', 'cite', 'code', 'col', 'colgroup', 'dd', 'del', 'div',
+    'dl', 'dt', 'em', 'figcaption', 'figure', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'ins',
+    'kbd', 'li', 'ol', 'p', 'pre', 'q', 's', 'small', 'span', 'strike', 'strong', 'sub', 'sup', 'table',
+    'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'u', 'ul',
+}
+VOID_TAGS = {'br', 'col', 'hr', 'img'}
+# Tags removed together with their content:
+DROPPED_TAGS = {'script', 'style', 'template', 'iframe', 'object', 'embed', 'noscript', 'textarea',
+                'select', 'svg', 'math', 'head', 'title'}
+# Tags that separate words in the excerpt:
+BLOCK_TAGS = {'blockquote', 'br', 'dd', 'div', 'dt', 'figcaption', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+              'hr', 'li', 'p', 'pre', 'td', 'th', 'tr'}
+# Tags that a new one of the same kind closes (<li>a<li>b):
+SIBLING_TAGS = {'dd', 'dt', 'li', 'p', 'td', 'th', 'tr'}
+
+GLOBAL_ATTRIBUTES = {'class', 'dir', 'lang', 'style', 'title'}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'name', 'target'},
+    'col': {'span', 'width'},
+    'img': {'alt', 'height', 'src', 'width'},
+    'ol': {'start', 'type'},
+    'table': {'align', 'border', 'cellpadding', 'cellspacing', 'summary', 'width'},
+    'td': {'colspan', 'rowspan', 'width'},
+    'th': {'colspan', 'rowspan', 'scope', 'width'},
+    'ul': {'type'},
+}
+URL_ATTRIBUTES = {'href', 'src'}
+ALLOWED_SCHEMES = {'', 'http', 'https', 'mailto'}
+
+UNSAFE_STYLE_RE = re.compile(r'expression|javascript|url\s*\(|behavior|@import|\\', re.IGNORECASE)
+CONTROL_CHARACTERS_RE = re.compile(r'[\x00-\x20\x7f]+')
+# The embeds of CKEditor's youtube plugin (also with the privacy-enhanced mode):
+YOUTUBE_EMBED_RE = re.compile(r'^(?:https?:)?//(?:www\.)?youtube(?:-nocookie)?\.com/embed/([\w-]{11})')
+
+VIDEO_FACADE = ('<div class="video-facade" data-video-id="{id}">'
+                '<a href="https://www.youtube.com/watch?v={id}" target="_blank" rel="noopener noreferrer">'
+                '<img src="https://i.ytimg.com/vi/{id}/hqdefault.jpg" alt="Play the video" '
+                'width="480" height="360" loading="lazy">'
+                '<span class="video-facade-play"></span></a></div>')
+
+
+def is_safe_url(url, tag):
+    url = CONTROL_CHARACTERS_RE.sub('', url)
+    if tag == 'img' and url.lower().startswith(('data:image/png', 'data:image/jpeg', 'data:image/gif')):
+        return True
+    try:
+        return urlsplit(url).scheme.lower() in ALLOWED_SCHEMES
+    except ValueError:
+        return False
+
+
+def clean_attributes(tag, attrs):
+    allowed = GLOBAL_ATTRIBUTES | ALLOWED_ATTRIBUTES.get(tag, set())
+    cleaned = {}
+    for name, value in attrs:
+        if name not in allowed or value is None:
+            continue
+        if name in URL_ATTRIBUTES and not is_safe_url(value, tag):
+            continue
+        if name == 'style' and UNSAFE_STYLE_RE.search(value):
+            continue
+        cleaned[name] = value
+
+    if tag == 'img':
+        cleaned['loading'] = 'lazy'
+    if tag == 'a' and 'target' in cleaned:
+        cleaned['rel'] = 'noopener noreferrer'
+    return ''.join(f' {name}="{escape(value)}"' for name, value in cleaned.items())
+
+
+class LessonHTMLParser(HTMLParser):
+    """Rebuilds the HTML from an allowlist of tags and attributes (anything
+    else, e.g. scripts and event handlers, is removed), replaces the YouTube
+    iframes with facades and collects the text."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.html = []
+        self.text = []
+        self.open_tags = []
+        self.dropped_tag = None
+        self.dropped_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self.dropped_tag is not None:
+            if tag == self.dropped_tag:
+                self.dropped_depth += 1
+            return
+
+        if tag == 'iframe':
+            match = YOUTUBE_EMBED_RE.match(dict(attrs).get('src') or '')
+            if match:
+                self.html.append(VIDEO_FACADE.format(id=match.group(1)))
+        if tag in DROPPED_TAGS:
+            if tag not in VOID_TAGS:
+                self.dropped_tag = tag
+                self.dropped_depth = 1
+            return
+        if tag not in ALLOWED_TAGS:
+            return
+
+        if tag in SIBLING_TAGS and self.open_tags and self.open_tags[-1] == tag:
+            self.handle_endtag(tag)
+        self.html.append(f'<{tag}{clean_attributes(tag, attrs)}>')
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+        if tag in BLOCK_TAGS:
+            self.text.append('\n')
+
+    def handle_endtag(self, tag):
+        if self.dropped_tag is not None:
+            if tag == self.dropped_tag:
+                self.dropped_depth -= 1
+                if self.dropped_depth == 0:
+                    self.dropped_tag = None
+            return
+
+        if tag in VOID_TAGS or tag not in self.open_tags:
+            return
+        # Also closes the tags that were left open inside of it:
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.html.append(f'</{open_tag}>')
+            if open_tag == tag:
+                break
+        if tag in BLOCK_TAGS:
+            self.text.append('\n')
+
+    def handle_data(self, data):
+        if self.dropped_tag is None:
+            self.html.append(escape(data))
+            self.text.append(data)
+
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self.html.append(f'</{self.open_tags.pop()}>')
+
+
+def render_content(content):
+    """Returns the sanitized HTML and the plain-text excerpt of the
+    CKEditor content of a lesson."""
+    parser = LessonHTMLParser()
+    parser.feed(content or '')
+    parser.close()
+    text = ' '.join(''.join(parser.text).split())
+    return ''.join(parser.html), Truncator(text).chars(EXCERPT_LENGTH)
+
+
+def get_lesson_ids(course_pk):
+    """The ids of the lessons of a course in their order, cached until a
+    lesson of the course is added, edited or deleted, so moving between
+    the lessons needs neither a COUNT nor an OFFSET query."""
+    key = f'lesson-ids:{course_pk}'
+    lesson_ids = cache.get(key)
+    if lesson_ids is None:
+        from .models import Lesson
+        lesson_ids = list(Lesson.objects.filter(course_id=course_pk)
+                          .order_by('number', 'id')
+                          .values_list('id', flat=True))
+        cache.set(key, lesson_ids, settings.LESSON_CACHE_TIMEOUT)
+    return lesson_ids
+
+
+def invalidate_lesson_ids(course_pk):
+    cache.delete(f'lesson-ids:{course_pk}')
+
+
+def get_cache_key(lesson_pk, version):
+    return f'lesson-html:{lesson_pk}:{version}'
+
+
+def get_lesson_html(lesson):
+    """The processed content of a lesson, from the cache. The key contains
+    the version of the lesson, so an edit never serves the old content and
+    the old entry simply expires. The lesson may be fetched without
+    content_html, it is only read from the database on a cache miss."""
+    key = get_cache_key(lesson.pk, lesson.content_version)
+    html = cache.get(key)
+    if html is None:
+        html = lesson.content_html
+        cache.set(key, html, settings.LESSON_CACHE_TIMEOUT)
+    return html
@@ -0,0 +1,96 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+from .models import QueuedEmail
+import uuid
+
+
+def queue_email(subject, body, to, from_email=None):
+    """Stores an email in the outbox instead of sending it inside the request.
+    The send_queued_mail command delivers it later."""
+    return QueuedEmail.objects.create(subject=subject,
+                                      body=body,
+                                      from_email=from_email or '',
+                                      to=','.join(to))
+
+
+def get_retry_delay(attempts):
+    """Exponential backoff: MAIL_QUEUE_RETRY_DELAY, then twice that, and so on."""
+    return timedelta(seconds=settings.MAIL_QUEUE_RETRY_DELAY * (2 ** (attempts - 1)))
+
+
+def claim_emails(batch_size, now):
+    """Claims a batch of due emails for this worker and returns them. The
+    conditional UPDATE only takes the rows that no other worker claimed in
+    the meantime, so two workers (or overlapping cron runs) never send the
+    same email. The claim expires after MAIL_QUEUE_CLAIM_TIMEOUT, in case
+    the worker dies before it is done."""
+    due = QueuedEmail.objects.filter(status__in=['queued', 'sending'], next_attempt_at__lte=now)
+    email_ids = list(due.order_by('next_attempt_at', 'id').values_list('id', flat=True)[:batch_size])
+    if not email_ids:
+        return []
+
+    token = uuid.uuid4().hex
+    due.filter(id__in=email_ids).update(status='sending', claimed_by=token,
+                                        next_attempt_at=now + timedelta(seconds=settings.MAIL_QUEUE_CLAIM_TIMEOUT))
+    return list(QueuedEmail.objects.filter(id__in=email_ids, claimed_by=token).order_by('id'))
+
+
+def send_queued_emails(batch_size=None):
+    """Sends one batch of due emails over a single backend connection.
+    Failed emails are rescheduled with backoff until MAIL_QUEUE_MAX_ATTEMPTS
+    is reached, then they are moved to the 'failed' (dead-letter) status.
+    Returns a (sent, failed) tuple of counts."""
+    batch_size = batch_size or settings.MAIL_QUEUE_BATCH_SIZE
+    now = timezone.now()
+    emails = claim_emails(batch_size, now)
+    if not emails:
+        return 0, 0
+
+    sent_ids = []
+    failed = []
+    connection = get_connection()
+
+    try:
+        # Open the connection once and reuse it for the whole batch:
+        connection.open()
+    except Exception as error:
+        for email in emails:
+            mark_failed(email, error, now)
+        QueuedEmail.objects.bulk_update(emails, ['status', 'claimed_by', 'attempts', 'last_error',
+                                                 'next_attempt_at'])
+        return 0, len(emails)
+
+    try:
+        for email in emails:
+            message = EmailMessage(email.subject, email.body,
+                                   email.from_email or None,
+                                   email.to.split(','),
+                                   connection=connection)
+            try:
+                message.send()
+                sent_ids.append(email.pk)
+            except Exception as error:
+                mark_failed(email, error, now)
+                failed.append(email)
+    finally:
+        connection.close()
+
+    QueuedEmail.objects.filter(pk__in=sent_ids).update(status='sent', claimed_by='', sent_at=timezone.now())
+    if failed:
+        QueuedEmail.objects.bulk_update(failed, ['status', 'claimed_by', 'attempts', 'last_error',
+                                                 'next_attempt_at'])
+
+    return len(sent_ids), len(failed)
+
+
+def mark_failed(email, error, now):
+    email.attempts += 1
+    email.last_error = str(error)
+    email.claimed_by = ''
+    if email.attempts >= settings.MAIL_QUEUE_MAX_ATTEMPTS:
+        email.status = 'failed'
+    else:
+        email.status = 'queued'
+        email.next_attempt_at = now + get_retry_delay(email.attempts)
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from time import perf_counter
+from ...models import User
+
+
+class Command(BaseCommand):
+    help = 'Measures the login throughput with a temporary user. Nothing is kept in the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Number of logins to perform.')
+
+    def handle(self, *args, **options):
+        total = options['requests']
+        if total < 1:
+            raise CommandError('--requests must be at least 1.')
+        username = 'benchmark-login-user'
+        password = 'benchmark-password'
+
+        # The login throttle would reject the repeated logins of the same user (and
+        # count them against the IP of the real clients in a shared cache):
+        no_login_throttle = override_settings(THROTTLE_RATES={**settings.THROTTLE_RATES, 'login': None})
+
+        with no_login_throttle, transaction.atomic():
+            User.objects.create_user(username=username, email='benchmark@digiwiz.local',
+                                     password=password, is_student=True)
+            client = Client(HTTP_HOST='localhost')
+            url = reverse('login')
+
+            completed = 0
+            error = None
+            start = perf_counter()
+            for _ in range(total):
+                response = client.post(url, {'username': username, 'password': password})
+                if response.status_code != 302:
+                    error = f'Login failed with status {response.status_code} after {completed} logins.'
+                    break
+                completed += 1
+                client.logout()
+            elapsed = perf_counter() - start
+
+            # Never keep the temporary user and its sessions:
+            transaction.set_rollback(True)
+
+        # A failed run would look faster than it is:
+        if error:
+            raise CommandError(error)
+        self.stdout.write(f'{completed} logins in {elapsed:.2f}s: '
+                          f'{completed / elapsed:.1f} logins/s, {elapsed / completed * 1000:.1f} ms/login')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from ...bundles import build_bundles
+
+
+class Command(BaseCommand):
+    help = ('Concatenates and minifies the CSS/JS of base.html and staff_base.html into static/bundles/. '
+            'Run it before collectstatic.')
+
+    def handle(self, *args, **options):
+        for name in build_bundles():
+            self.stdout.write(f'Built bundles/{name}')
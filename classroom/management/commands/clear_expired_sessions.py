@@ -0,0 +1,30 @@
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from time import sleep
+
+
+class Command(BaseCommand):
+    help = ('Deletes the expired sessions in small batches instead of one big DELETE, '
+            'so the database is not locked for long. Run it periodically (e.g. cron).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of sessions deleted per statement.')
+        parser.add_argument('--pause', type=float, default=0.1,
+                            help='Seconds to wait between batches.')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        total = 0
+
+        while True:
+            session_keys = list(Session.objects.filter(expire_date__lt=now)
+                                .values_list('session_key', flat=True)[:options['batch_size']])
+            if not session_keys:
+                break
+
+            total += Session.objects.filter(session_key__in=session_keys).delete()[0]
+            sleep(options['pause'])
+
+        self.stdout.write(f'Deleted {total} expired sessions.')
@@ -0,0 +1,21 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ...models import ChunkedUpload
+from ...uploads import delete_chunks
+
+
+class Command(BaseCommand):
+    help = ('Deletes the chunked uploads that were not completed within CHUNKED_UPLOAD_EXPIRY, '
+            'and their partial files. Run it periodically (e.g. cron).')
+
+    def handle(self, *args, **options):
+        expired = timezone.now() - timedelta(seconds=settings.CHUNKED_UPLOAD_EXPIRY)
+        uploads = list(ChunkedUpload.objects.filter(created_at__lt=expired))
+
+        for upload in uploads:
+            delete_chunks(upload)
+        ChunkedUpload.objects.filter(pk__in=[upload.pk for upload in uploads]).delete()
+
+        self.stdout.write(f'Deleted {len(uploads)} stale uploads.')
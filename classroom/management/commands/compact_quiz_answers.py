@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from ...quizzes import compact_answers
+
+
+class Command(BaseCommand):
+    help = ('Moves the StudentAnswer rows of the taken quizzes into the answer_ids of their TakenQuiz rows, '
+            'in batches. Run it once after enabling QUIZ_COMPACT_ANSWERS.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of taken quizzes compacted per transaction.')
+
+    def handle(self, *args, **options):
+        total = compact_answers(options['batch_size'])
+
+        self.stdout.write(f'Compacted the answers of {total} taken quizzes.')
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from ...models import StoredFile
+import os
+
+
+class Command(BaseCommand):
+    help = ('Stores the media files uploaded before the content-addressed storage once '
+            'per content. Files with the same content then share the disk space.')
+
+    def handle(self, *args, **options):
+        known = set(StoredFile.objects.values_list('name', flat=True))
+        adopted = 0
+        saved = 0
+        seen = set()
+        for directory in settings.CONTENT_ADDRESSED_DIRS:
+            root = default_storage.path(directory)
+            for path, _, file_names in os.walk(root):
+                for file_name in sorted(file_names):
+                    name = os.path.relpath(os.path.join(path, file_name), settings.MEDIA_ROOT) \
+                        .replace(os.sep, '/')
+                    if name in known:
+                        continue
+                    size = os.path.getsize(os.path.join(path, file_name))
+                    sha256 = default_storage.adopt(name)
+                    if sha256 in seen:
+                        saved += size
+                    seen.add(sha256)
+                    adopted += 1
+
+        self.stdout.write(f'Stored {adopted} files, {saved} bytes were duplicates.')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from ...quizzes import finalize_expired_attempts
+
+
+class Command(BaseCommand):
+    help = ('Grades the timed quiz attempts whose deadline has passed (the unanswered questions count '
+            'as wrong) and writes their taken quizzes in batches. Run it periodically (e.g. cron).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of attempts finalized per transaction.')
+
+    def handle(self, *args, **options):
+        total = finalize_expired_attempts(options['batch_size'])
+
+        self.stdout.write(f'Finalized {total} expired quiz attempts.')
@@ -0,0 +1,16 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from ...blobs import collect_garbage
+
+
+class Command(BaseCommand):
+    help = ('Deletes the stored content (MEDIA_ROOT/.blobs) that no media file uses anymore. '
+            'Run it periodically (e.g. cron).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=60 * 60,
+                            help='Seconds the content must be unused before it is deleted.')
+
+    def handle(self, *args, **options):
+        deleted = collect_garbage(default_storage, options['min_age'])
+        self.stdout.write(f'Deleted {deleted} unused blobs.')
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from ...images import generate_variants
+from ...models import Course, Student, Teacher
+
+
+class Command(BaseCommand):
+    help = ('Generates the missing thumbnail and WebP variants of the course images and '
+            'profile pictures, e.g. for the images uploaded before the variants existed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate the variants that already exist.')
+
+    def handle(self, *args, **options):
+        images = [(name, 'course') for name in
+                  Course.objects.exclude(image='').values_list('image', flat=True).distinct()]
+        # Many profiles share the default picture, each file is only processed once:
+        avatars = set(Teacher.objects.exclude(image='').values_list('image', flat=True))
+        avatars.update(Student.objects.exclude(image='').values_list('image', flat=True))
+        images.extend((name, 'avatar') for name in sorted(avatars))
+
+        written = 0
+        for name, kind in images:
+            try:
+                written += generate_variants(name, kind, force=options['force'])
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'{name}: {error}')
+
+        self.stdout.write(f'Wrote {written} variants of {len(images)} images.')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from ...models import FilePreview
+from ...previews import get_missing_previews, submit_previews, wait_for_previews
+
+
+class Command(BaseCommand):
+    help = ('Extracts the page count, text and first-page image of the course files '
+            'that have no preview yet (e.g. the ones uploaded before the previews).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Also retry the files whose extraction failed.')
+
+    def handle(self, *args, **options):
+        files = list(get_missing_previews(options['retry_failed']))
+        for file_pk, _ in files:
+            FilePreview.objects.get_or_create(pk=file_pk)
+
+        submit_previews(files)
+        wait_for_previews()
+        failed = FilePreview.objects.filter(pk__in=[file_pk for file_pk, _ in files], status='failed').count()
+        self.stdout.write(f'Generated the previews of {len(files) - failed} files, {failed} failed.')
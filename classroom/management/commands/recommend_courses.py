@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from ...recommendations import update_recommendations
+
+
+class Command(BaseCommand):
+    help = ('Computes the suggested courses of every course and student from the enrollments, the ratings '
+            'and the interests of the students. Schedule it, e.g. nightly.')
+
+    def handle(self, *args, **options):
+        total = update_recommendations()
+
+        self.stdout.write(f'Stored {total} course suggestions.')
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from time import sleep
+from ...mail import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = 'Delivers the queued emails (registration, activation, contact us) in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Number of emails sent per connection. Defaults to MAIL_QUEUE_BATCH_SIZE.')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling the queue instead of exiting when it is empty.')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait between polls when --loop is used.')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send_queued_emails(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f'Sent: {sent}, failed: {failed}')
+
+            if not (sent or failed):
+                if not options['loop']:
+                    break
+                sleep(options['interval'])
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from ...thumbnails import sweep_orphaned_thumbnails
+
+
+class Command(BaseCommand):
+    help = ('Deletes the thumbnails in media/cache that are no longer referenced, '
+            'e.g. the ones of replaced profile pictures. Run it periodically (e.g. cron).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=60 * 60,
+                            help='Seconds a file must exist before it can be deleted.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only list the files that would be deleted.')
+
+    def handle(self, *args, **options):
+        deleted = sweep_orphaned_thumbnails(options['min_age'], dry_run=options['dry_run'])
+        for name in deleted:
+            self.stdout.write(name)
+
+        action = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(f'{action} {len(deleted)} orphaned thumbnails.')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from ...models import Student, Teacher
+from ...thumbnails import warm_thumbnails
+
+
+class Command(BaseCommand):
+    help = ('Creates the missing profile picture thumbnails of THUMBNAIL_WARM_UP, '
+            'so that no page has to create them while it is rendered.')
+
+    def handle(self, *args, **options):
+        names = set(Teacher.objects.exclude(image='').values_list('image', flat=True))
+        names.update(Student.objects.exclude(image='').values_list('image', flat=True))
+
+        for name in sorted(names):
+            try:
+                warm_thumbnails(name)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'{name}: {error}')
+
+        self.stdout.write(f'Checked the thumbnails of {len(names)} pictures.')
@@ -0,0 +1,14 @@
+from django.contrib.sessions.middleware import SessionMiddleware as BaseSessionMiddleware
+
+
+class SessionMiddleware(BaseSessionMiddleware):
+    """Session middleware that does not write the session back to the cache
+    and the database when its data did not actually change, e.g. when the
+    same value is set again or an empty message list is stored."""
+
+    def process_response(self, request, response):
+        session = getattr(request, 'session', None)
+        if session is not None and session.modified and hasattr(session, 'has_changed'):
+            if not session.has_changed():
+                session.modified = False
+        return super().process_response(request, response)
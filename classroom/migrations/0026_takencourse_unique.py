@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:01
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_enrollments(apps, schema_editor):
+    """Keeps the oldest row of every (student, course) pair so the
+    unique constraint can be created."""
+    TakenCourse = apps.get_model('classroom', 'TakenCourse')
+    keep_ids = TakenCourse.objects.values('student_id', 'course_id') \
+        .annotate(keep_id=Min('id')) \
+        .values_list('keep_id', flat=True)
+    TakenCourse.objects.exclude(id__in=list(keep_ids)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classroom', '0025_myfile_file'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_enrollments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='takencourse',
+            constraint=models.UniqueConstraint(fields=('student', 'course'), name='unique_taken_course'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+import sorl.thumbnail.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classroom', '0029_fileblob_storedfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilePreview',
+            fields=[
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='preview', serialize=False, to='classroom.MyFile')),
+                ('status', models.CharField(default='pending', max_length=10)),
+                ('page_count', models.PositiveIntegerField(blank=True, null=True)),
+                ('text', models.TextField(blank=True)),
+                ('image', sorl.thumbnail.fields.ImageField(blank=True, upload_to='previews')),
+                ('error', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:26
+
+from django.db import migrations, models
+from classroom.lessons import render_content
+
+
+def render_lessons(apps, schema_editor):
+    """Processes the content of the existing lessons."""
+    Lesson = apps.get_model('classroom', 'Lesson')
+    for lesson in Lesson.objects.only('id', 'content').iterator():
+        content_html, excerpt = render_content(lesson.content)
+        Lesson.objects.filter(pk=lesson.pk).update(content_html=content_html, excerpt=excerpt, content_version=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classroom', '0030_filepreview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='content_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=300),
+        ),
+        migrations.RunPython(render_lessons, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_answer_quizzes(apps, schema_editor):
+    """Stores the quiz of the existing answers, which was the quiz of their question."""
+    Answer = apps.get_model('classroom', 'Answer')
+    StudentAnswer = apps.get_model('classroom', 'StudentAnswer')
+    StudentAnswer.objects.update(quiz_id=models.Subquery(Answer.objects.filter(pk=models.OuterRef('answer_id'))
+                                                         .values('question__quiz_id')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classroom', '0031_lesson_content_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionBank',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QuestionTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QuizAttempt',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_ids', models.TextField()),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='draw_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='studentanswer',
+            name='quiz',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='classroom.Quiz'),
+        ),
+        migrations.AddField(
+            model_name='takenquiz',
+            name='question_ids',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='question',
+            name='quiz',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='questions', to='classroom.Quiz'),
+        ),
+        migrations.AddIndex(
+            model_name='studentanswer',
+            index=models.Index(fields=['student', 'quiz'], name='studentanswer_quiz_idx'),
+        ),
+        migrations.AddField(
+            model_name='quizattempt',
+            name='course',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quiz_attempts', to='classroom.Course'),
+        ),
+        migrations.AddField(
+            model_name='quizattempt',
+            name='quiz',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attempts', to='classroom.Quiz'),
+        ),
+        migrations.AddField(
+            model_name='quizattempt',
+            name='student',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quiz_attempts', to='classroom.Student'),
+        ),
+        migrations.AddField(
+            model_name='questionbank',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='question_banks', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='questionbank',
+            name='subject',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='question_banks', to='classroom.Subject'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='bank',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='questions', to='classroom.QuestionBank'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='tags',
+            field=models.ManyToManyField(blank=True, related_name='questions', to='classroom.QuestionTag'),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='bank',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='quizzes', to='classroom.QuestionBank'),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='bank_tag',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='classroom.QuestionTag'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='quizattempt',
+            unique_together={('student', 'quiz')},
+        ),
+        migrations.RunPython(set_answer_quizzes, migrations.RunPython.noop),
+    ]
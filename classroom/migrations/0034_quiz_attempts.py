@@ -0,0 +1,48 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_answer_attempts(apps, schema_editor):
+    """Links the existing answers to the only attempt a student could take of a quiz."""
+    StudentAnswer = apps.get_model('classroom', 'StudentAnswer')
+    TakenQuiz = apps.get_model('classroom', 'TakenQuiz')
+    StudentAnswer.objects.update(taken_quiz_id=models.Subquery(
+        TakenQuiz.objects.filter(student_id=models.OuterRef('student_id'), quiz_id=models.OuterRef('quiz_id'))
+        .order_by('id').values('id')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classroom', '0033_quiz_time_limit'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='studentanswer',
+            name='studentanswer_quiz_idx',
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='max_attempts',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='score_policy',
+            field=models.CharField(choices=[('best', 'Best attempt'), ('last', 'Last attempt'), ('average', 'Average of the attempts')], default='best', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='studentanswer',
+            name='taken_quiz',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='classroom.TakenQuiz'),
+        ),
+        migrations.AddIndex(
+            model_name='studentanswer',
+            index=models.Index(fields=['student', 'quiz', 'taken_quiz'], name='studentanswer_attempt_idx'),
+        ),
+        migrations.RunPython(set_answer_attempts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classroom', '0034_quiz_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='takenquiz',
+            name='answer_ids',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classroom', '0036_recommendation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedemail',
+            name='claimed_by',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
@@ -2,9 +2,11 @@ from ckeditor_uploader.fields import RichTextUploadingField
 from django.contrib.auth.models import AbstractUser
 from django.contrib.contenttypes.fields import GenericRelation
 from django.db import models
+from django.utils import timezone
 from django.utils.html import escape, mark_safe
 from sorl.thumbnail import ImageField
 from star_ratings.models import Rating
+from .lessons import invalidate_lesson_ids, render_content
 
 
 class User(AbstractUser):
@@ -32,6 +34,51 @@ class UserLog(models.Model):
         return f'{self.user.username}: {self.action}'
 
 
+class QueuedEmail(models.Model):
+    """Outgoing email waiting to be delivered by the send_queued_mail command."""
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    to = models.TextField(help_text='Comma-separated list of recipients')
+    status = models.CharField(max_length=10, default='queued')
+    # The worker that is sending it ('sending' status), see classroom/mail.py:
+    claimed_by = models.CharField(max_length=32, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='queuedemail_due_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.to}: {self.subject} ({self.status})'
+
+
+class FileBlob(models.Model):
+    """Content of the uploaded files, stored once per SHA-256 (see
+    classroom.blobs.ContentAddressedStorage)."""
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    last_referenced_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.sha256} ({self.ref_count} references)'
+
+
+class StoredFile(models.Model):
+    """A media file name (e.g. class_resources/notes.pdf) and its content."""
+    name = models.CharField(max_length=255, unique=True)
+    blob = models.ForeignKey(FileBlob, on_delete=models.PROTECT, related_name='stored_files')
+
+    def __str__(self):
+        return self.name
+
+
 class Subject(models.Model):
     name = models.CharField(max_length=30)
     color = models.CharField(max_length=9, default='#007bff')
@@ -79,6 +126,10 @@ class Lesson(models.Model):
         '/static/classroom/vendor/ckeditor_plugins/youtube/youtube/',
         'plugin.js',
     )])
+    # The sanitized content served to the students, see classroom/lessons.py:
+    content_html = models.TextField(blank=True, editable=False)
+    excerpt = models.CharField(max_length=300, blank=True, editable=False)
+    content_version = models.PositiveIntegerField(default=0, editable=False)
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='lessons')
 
     def __str__(self):
@@ -86,13 +137,48 @@ class Lesson(models.Model):
 
     def save(self, *args, **kwargs):
         setattr(self, 'title', getattr(self, 'title', False).title())
+        self.content_html, self.excerpt = render_content(self.content)
+        self.content_version += 1
         super(Lesson, self).save(*args, **kwargs)
+        invalidate_lesson_ids(self.course_id)
+
+
+class QuestionBank(models.Model):
+    """Questions of a teacher that the quizzes of a subject draw from."""
+    name = models.CharField(max_length=100)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='question_banks')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='question_banks')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class QuestionTag(models.Model):
+    name = models.CharField(max_length=30, unique=True)
+
+    def __str__(self):
+        return self.name
 
 
 class Quiz(models.Model):
     title = models.CharField(max_length=100)
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='quizzes')
     lesson = models.OneToOneField(Lesson, on_delete=models.CASCADE, related_name='quizzes')
+    # Each attempt gets draw_count random questions of the quiz and its bank (0 = all of them):
+    bank = models.ForeignKey(QuestionBank, on_delete=models.SET_NULL, null=True, blank=True,
+                             related_name='quizzes')
+    bank_tag = models.ForeignKey(QuestionTag, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='+')
+    draw_count = models.PositiveSmallIntegerField(default=0)
+    time_limit = models.PositiveSmallIntegerField(default=0)  # minutes, 0 = no limit
+    max_attempts = models.PositiveSmallIntegerField(default=1)  # 0 = no limit
+    # Which attempts make the grade of a student (see classroom.quizzes.get_grade):
+    score_policy = models.CharField(max_length=10, default='best', choices=[
+        ('best', 'Best attempt'),
+        ('last', 'Last attempt'),
+        ('average', 'Average of the attempts'),
+    ])
 
     def __str__(self):
         return self.title
@@ -103,8 +189,12 @@ class Quiz(models.Model):
 
 
 class Question(models.Model):
-    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='questions')
+    # A question belongs either to a quiz or to a question bank:
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, null=True, blank=True, related_name='questions')
+    bank = models.ForeignKey(QuestionBank, on_delete=models.CASCADE, null=True, blank=True,
+                             related_name='questions')
     text = models.CharField('Question', max_length=500)
+    tags = models.ManyToManyField(QuestionTag, blank=True, related_name='questions')
 
     def __str__(self):
         return self.text
@@ -134,12 +224,13 @@ class Student(models.Model):
     quizzes = models.ManyToManyField(Quiz, through='TakenQuiz')
     interests = models.ManyToManyField(Subject, related_name='interested_students')
 
-    def get_unanswered_questions(self, quiz):
-        answered_questions = self.quiz_answers \
-            .filter(answer__question__quiz=quiz) \
-            .values_list('answer__question__pk', flat=True)
-        questions = quiz.questions.exclude(pk__in=answered_questions).order_by('id')
-        return questions
+    def get_unanswered_questions(self, quiz, question_ids):
+        """The ids of the questions (of the ones drawn for the open attempt
+        of the quiz) that the student has not answered yet, in their order."""
+        answered_questions = set(self.quiz_answers
+                                 .filter(quiz=quiz, taken_quiz=None)
+                                 .values_list('answer__question_id', flat=True))
+        return [pk for pk in question_ids if pk not in answered_questions]
 
     def __str__(self):
         return f'{self.user.username} - student'
@@ -151,25 +242,82 @@ class TakenCourse(models.Model):
     status = models.CharField(max_length=12, default='pending')
     date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'course'], name='unique_taken_course')
+        ]
+
     def __str__(self):
         return f'{self.student.user.username}: {self.course.title}'
 
 
+class Recommendation(models.Model):
+    """The suggested courses of a course or of a student, in their order,
+    precomputed by the recommend_courses command (see classroom/recommendations.py)."""
+    kind = models.CharField(max_length=10)  # 'course' or 'student'
+    object_id = models.PositiveIntegerField()
+    course_ids = models.TextField(blank=True)  # e.g. "4,17,9"
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='unique_recommendation')
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}: {self.course_ids}'
+
+
 class TakenQuiz(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='taken_quizzes')
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='taken_quizzes')
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='taken_quizzes')
     score = models.FloatField()
     date = models.DateTimeField(auto_now_add=True)
+    # The ids of the questions that the student got, e.g. "4,17,9" (see classroom/quizzes.py).
+    # Empty for the quizzes taken before the question banks: all of the questions of the quiz.
+    question_ids = models.TextField(blank=True)
+    # With QUIZ_COMPACT_ANSWERS, the chosen answer of each of these questions (0 if none) instead
+    # of StudentAnswer rows, e.g. "31,0,12".
+    answer_ids = models.TextField(blank=True)
 
     def __str__(self):
         return f'{self.student.user.username}: {self.quiz.title}'
 
 
+class QuizAttempt(models.Model):
+    """A quiz that a student started, with the questions drawn for it. It is
+    replaced by a TakenQuiz when the last question is answered."""
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='quiz_attempts')
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='attempts')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='quiz_attempts')
+    question_ids = models.TextField()
+    started_at = models.DateTimeField(auto_now_add=True)
+    # Set once when the attempt starts, the finalize_quiz_attempts command grades the expired ones:
+    deadline = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        unique_together = ('student', 'quiz')
+
+    def __str__(self):
+        return f'{self.student.user.username}: {self.quiz.title} (started)'
+
+
 class StudentAnswer(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='quiz_answers')
+    # The questions of a bank are shared by quizzes, so the quiz is stored with the answer:
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, null=True, related_name='+')
+    # The attempt, set when it is graded. The answers of the open attempt (a student has at most
+    # one per quiz, see QuizAttempt) are the ones without it:
+    taken_quiz = models.ForeignKey(TakenQuiz, on_delete=models.CASCADE, null=True, blank=True,
+                                   related_name='answers')
     answer = models.ForeignKey(Answer, on_delete=models.CASCADE, related_name='+')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['student', 'quiz', 'taken_quiz'], name='studentanswer_attempt_idx')
+        ]
+
 
 class MyFile(models.Model):
     file = models.CharField(max_length=100, blank=True)
@@ -180,3 +328,31 @@ class MyFile(models.Model):
 
     def __str__(self):
         return f'{self.file_link}'
+
+
+class ChunkedUpload(models.Model):
+    """Course file being uploaded in chunks, see classroom/uploads.py."""
+    file_name = models.CharField(max_length=80)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='chunked_uploads')
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chunked_uploads')
+
+    def __str__(self):
+        return f'{self.file_name} ({self.offset}/{self.size})'
+
+
+class FilePreview(models.Model):
+    """Page count, text and first-page image of a course file, extracted in
+    the background (see classroom/previews.py)."""
+    file = models.OneToOneField(MyFile, on_delete=models.CASCADE, primary_key=True, related_name='preview')
+    status = models.CharField(max_length=10, default='pending')
+    page_count = models.PositiveIntegerField(null=True, blank=True)
+    text = models.TextField(blank=True)
+    image = ImageField(upload_to='previews', blank=True)
+    error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.file.file} ({self.status})'
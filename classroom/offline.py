@@ -0,0 +1,120 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from html import unescape
+from .files import get_content_type
+from .models import Course, Lesson
+import base64
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import tempfile
+
+IMG_SRC_RE = re.compile(r'(<img\b[^>]*?\ssrc=")([^"]*)(")')
+
+
+def get_course_version(course_pk):
+    """A hash of everything the bundle of a course contains. The content of a
+    lesson is represented by its content_version, so this needs no more than
+    the lesson rows without their content. Returns None if there is no course."""
+    course = Course.objects.filter(pk=course_pk) \
+        .values_list('title', 'description', 'code', 'subject__name', 'owner__first_name', 'owner__last_name') \
+        .first()
+    if course is None:
+        return None
+    lessons = Lesson.objects.filter(course_id=course_pk) \
+        .order_by('number', 'id') \
+        .values_list('id', 'number', 'title', 'description', 'content_version')
+    data = json.dumps([settings.OFFLINE_BUNDLE_FORMAT, course, list(lessons)])
+    return hashlib.sha256(data.encode()).hexdigest()[:20]
+
+
+def get_bundle_path(course_pk, version):
+    return os.path.join(settings.OFFLINE_BUNDLE_DIR, f'{course_pk}-{version}.json.gz')
+
+
+def get_image_data_uri(src):
+    """The data: URI of a CKEditor image (MEDIA_URL/uploads/lessons/...), or
+    None for other images, images that are too big and missing files."""
+    prefix = settings.MEDIA_URL + settings.CKEDITOR_UPLOAD_PATH
+    src = unescape(src)
+    if not src.startswith(prefix):
+        return None
+    name = posixpath.normpath(src[len(settings.MEDIA_URL):].split('?')[0])
+    if not name.startswith(settings.CKEDITOR_UPLOAD_PATH):
+        return None
+
+    try:
+        if default_storage.size(name) > settings.OFFLINE_BUNDLE_MAX_IMAGE_SIZE:
+            return None
+        with default_storage.open(name) as f:
+            data = f.read()
+    except OSError:
+        return None
+    return f'data:{get_content_type(name)};base64,{base64.b64encode(data).decode()}'
+
+
+def inline_images(html):
+    def replace(match):
+        data_uri = get_image_data_uri(match.group(2))
+        return match.group(1) + (data_uri or match.group(2)) + match.group(3)
+
+    return IMG_SRC_RE.sub(replace, html)
+
+
+def build_bundle(course_pk, version):
+    course = Course.objects.select_related('subject', 'owner').get(pk=course_pk)
+    lessons = Lesson.objects.filter(course_id=course_pk) \
+        .order_by('number', 'id') \
+        .values('id', 'number', 'title', 'description', 'content_html')
+    return {
+        'format': settings.OFFLINE_BUNDLE_FORMAT,
+        'version': version,
+        'generated_at': timezone.now().isoformat(),
+        'course': {
+            'id': course.pk,
+            'title': course.title,
+            'code': course.code,
+            'description': course.description,
+            'subject': course.subject.name,
+            'owner': f'{course.owner.first_name} {course.owner.last_name}',
+        },
+        'lessons': [{
+            'id': lesson['id'],
+            'number': lesson['number'],
+            'title': lesson['title'],
+            'description': lesson['description'],
+            'html': inline_images(lesson['content_html']),
+        } for lesson in lessons],
+    }
+
+
+def get_offline_bundle(course_pk):
+    """Returns the (version, path) of the gzipped JSON bundle of a course, or
+    None if there is no such course. The bundle is built on the first
+    request of each course version and kept in OFFLINE_BUNDLE_DIR, the
+    bundles of the previous versions are deleted."""
+    version = get_course_version(course_pk)
+    if version is None:
+        return None
+
+    path = get_bundle_path(course_pk, version)
+    if not os.path.exists(path):
+        os.makedirs(settings.OFFLINE_BUNDLE_DIR, exist_ok=True)
+        data = json.dumps(build_bundle(course_pk, version), separators=(',', ':')).encode()
+        # Written under a temporary name, so a request never reads half a bundle:
+        fd, temp_path = tempfile.mkstemp(dir=settings.OFFLINE_BUNDLE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        os.replace(temp_path, path)
+
+        for file_name in os.listdir(settings.OFFLINE_BUNDLE_DIR):
+            if file_name.startswith(f'{course_pk}-') and file_name != os.path.basename(path):
+                try:
+                    os.remove(os.path.join(settings.OFFLINE_BUNDLE_DIR, file_name))
+                except FileNotFoundError:
+                    pass
+    return version, path
@@ -0,0 +1,397 @@
+"""Course packages: the lessons of a course with their quizzes, questions
+and answers in one JSON document (course.json), optionally zipped with the
+lesson images. Used to export a course and to import it in one go. Also
+the copy of a whole course (copy_course).
+
+A quiz keeps its settings in a package. The questions that it draws from a
+question bank are stored with its own questions, so the imported quiz draws
+from the same questions without the bank."""
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Prefetch
+from .lessons import invalidate_lesson_ids, render_content
+from .models import Answer, Course, FilePreview, Lesson, MyFile, Question, Quiz
+import json
+import posixpath
+import re
+import zipfile
+
+PACKAGE_FORMAT = 'digiwiz-course'
+PACKAGE_VERSION = 1
+PACKAGE_JSON = 'course.json'
+# The lesson images are stored in the ZIP under their MEDIA_ROOT name:
+PACKAGE_MEDIA_DIR = 'media/'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+
+# The limits of the lesson, quiz, question and answer forms:
+MIN_ANSWERS = 2
+MAX_ANSWERS = 10
+QUIZ_SETTING_LIMITS = {'draw_count': 500, 'time_limit': 600, 'max_attempts': 100}
+SCORE_POLICIES = [policy for policy, _ in Quiz._meta.get_field('score_policy').choices]
+
+
+def get_image_names(content):
+    """The names of the CKEditor images (uploads/lessons/...) of a lesson."""
+    prefix = re.escape(settings.MEDIA_URL + settings.CKEDITOR_UPLOAD_PATH)
+    return re.findall(rf'src="{prefix}([^"?]+)', content)
+
+
+def get_question_data(question):
+    return {
+        'text': question.text,
+        'answers': [{'text': answer.text, 'is_correct': answer.is_correct}
+                    for answer in question.answers.all()],
+    }
+
+
+def get_bank_questions(course):
+    """{bank_id: questions} of the question banks that the quizzes of a
+    course draw from, with their answers and tags, in three queries."""
+    bank_questions = {}
+    questions = Question.objects.filter(bank__quizzes__course=course) \
+        .distinct() \
+        .prefetch_related(Prefetch('answers', queryset=Answer.objects.order_by('id')), 'tags') \
+        .order_by('id')
+    for question in questions:
+        bank_questions.setdefault(question.bank_id, []).append(question)
+    return bank_questions
+
+
+def get_lesson_data(lesson, bank_questions):
+    data = {
+        'number': lesson.number,
+        'title': lesson.title,
+        'description': lesson.description,
+        'content': lesson.content,
+        'quiz': None,
+    }
+    quiz = getattr(lesson, 'quizzes', None)
+    if quiz is not None:
+        questions = list(quiz.questions.all())
+        # The questions that the quiz draws from its bank are copied into the package, the
+        # banks of a teacher are not part of a course:
+        questions += [question for question in bank_questions.get(quiz.bank_id, ())
+                      if quiz.bank_tag_id is None or quiz.bank_tag_id in {tag.pk for tag in question.tags.all()}]
+        data['quiz'] = {
+            'title': quiz.title,
+            'draw_count': quiz.draw_count,
+            'time_limit': quiz.time_limit,
+            'max_attempts': quiz.max_attempts,
+            'score_policy': quiz.score_policy,
+            'questions': [get_question_data(question) for question in questions],
+        }
+    return data
+
+
+def iter_course_json(course, image_names=None):
+    """Yields the course.json of a course piece by piece, lesson by lesson.
+    The names of the lesson images are added to image_names."""
+    lessons = Lesson.objects.filter(course=course) \
+        .select_related('quizzes') \
+        .prefetch_related(Prefetch('quizzes__questions', queryset=Question.objects.order_by('id')),
+                          Prefetch('quizzes__questions__answers', queryset=Answer.objects.order_by('id'))) \
+        .order_by('number', 'id')
+    bank_questions = get_bank_questions(course)
+
+    header = json.dumps({
+        'format': PACKAGE_FORMAT,
+        'version': PACKAGE_VERSION,
+        'course': {'title': course.title, 'code': course.code, 'description': course.description},
+    })
+    yield header[:-1] + ', "lessons": ['
+    for i, lesson in enumerate(lessons):
+        if image_names is not None:
+            image_names.update(get_image_names(lesson.content))
+        yield (', ' if i else '') + json.dumps(get_lesson_data(lesson, bank_questions))
+    yield ']}'
+
+
+class StreamBuffer:
+    """File-like object that collects what zipfile writes, so the ZIP can be
+    sent while it is being written."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_course_zip(course):
+    """Yields the ZIP package of a course: course.json and the lesson images."""
+    image_names = set()
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(PACKAGE_JSON, 'w') as f:
+            for chunk in iter_course_json(course, image_names):
+                f.write(chunk.encode())
+                yield buffer.pop()
+
+        for name in sorted(image_names):
+            name = settings.CKEDITOR_UPLOAD_PATH + name
+            if default_storage.exists(name):
+                # Already compressed:
+                archive.write(default_storage.path(name), PACKAGE_MEDIA_DIR + name, zipfile.ZIP_STORED)
+                yield buffer.pop()
+    yield buffer.pop()
+
+
+def check_text(errors, path, data, field, max_length):
+    value = data.get(field)
+    if not isinstance(value, str) or not value.strip():
+        errors.append(f'{path}: "{field}" is required.')
+    elif len(value) > max_length:
+        errors.append(f'{path}: "{field}" has more than {max_length} characters.')
+
+
+def check_number(errors, path, data, field, max_value):
+    value = data.get(field, 0)
+    if not isinstance(value, int) or isinstance(value, bool) or not 0 <= value <= max_value:
+        errors.append(f'{path}: "{field}" must be a number from 0 to {max_value}.')
+
+
+def validate_package(package):
+    """Checks the whole package before anything is saved and raises a
+    ValidationError with every problem found."""
+    if not isinstance(package, dict) or package.get('format') != PACKAGE_FORMAT:
+        raise ValidationError('This is not a course package.')
+    if package.get('version') != PACKAGE_VERSION:
+        raise ValidationError(f'Unsupported course package version: {package.get("version")}.')
+    if not isinstance(package.get('lessons'), list) or not package['lessons']:
+        raise ValidationError('The course package has no lessons.')
+
+    errors = []
+    for i, lesson in enumerate(package['lessons'], 1):
+        path = f'Lesson {i}'
+        if not isinstance(lesson, dict):
+            errors.append(f'{path}: invalid lesson.')
+            continue
+        check_text(errors, path, lesson, 'title', Lesson._meta.get_field('title').max_length)
+        check_text(errors, path, lesson, 'description', Lesson._meta.get_field('description').max_length)
+        if not isinstance(lesson.get('content', ''), str):
+            errors.append(f'{path}: "content" must be HTML.')
+        if not isinstance(lesson.get('number'), int) or isinstance(lesson.get('number'), bool):
+            errors.append(f'{path}: "number" must be an integer.')
+
+        quiz = lesson.get('quiz')
+        if quiz is None:
+            continue
+        if not isinstance(quiz, dict) or not isinstance(quiz.get('questions'), list):
+            errors.append(f'{path}: invalid quiz.')
+            continue
+        check_text(errors, f'{path}, quiz', quiz, 'title', Quiz._meta.get_field('title').max_length)
+        # Optional, with the defaults of a new quiz (the packages exported before the settings):
+        for field, max_value in QUIZ_SETTING_LIMITS.items():
+            check_number(errors, f'{path}, quiz', quiz, field, max_value)
+        if quiz.get('score_policy', 'best') not in SCORE_POLICIES:
+            errors.append(f'{path}, quiz: "score_policy" must be one of {", ".join(SCORE_POLICIES)}.')
+
+        for j, question in enumerate(quiz['questions'], 1):
+            question_path = f'{path}, question {j}'
+            if not isinstance(question, dict) or not isinstance(question.get('answers'), list):
+                errors.append(f'{question_path}: invalid question.')
+                continue
+            check_text(errors, question_path, question, 'text', Question._meta.get_field('text').max_length)
+
+            answers = question['answers']
+            if not MIN_ANSWERS <= len(answers) <= MAX_ANSWERS:
+                errors.append(f'{question_path}: a question needs {MIN_ANSWERS} to {MAX_ANSWERS} answers.')
+            for k, answer in enumerate(answers, 1):
+                if not isinstance(answer, dict):
+                    errors.append(f'{question_path}, answer {k}: invalid answer.')
+                    continue
+                check_text(errors, f'{question_path}, answer {k}', answer, 'text',
+                           Answer._meta.get_field('text').max_length)
+                if not isinstance(answer.get('is_correct', False), bool):
+                    errors.append(f'{question_path}, answer {k}: "is_correct" must be true or false.')
+            # Same rule as BaseAnswerInlineFormSet:
+            if not any(isinstance(answer, dict) and answer.get('is_correct') is True for answer in answers):
+                errors.append(f'{question_path}: mark at least one answer as correct.')
+
+    if errors:
+        raise ValidationError(errors)
+
+
+def bulk_create_with_ids(model, objects, **filters):
+    """bulk_create that also sets the primary keys on the databases that do
+    not return them (SQLite, MySQL): the new rows are the last len(objects)
+    rows matching filters, in the order of objects. The filters select the
+    rows of a course that is locked (or new), so no other request adds rows
+    in between."""
+    model.objects.bulk_create(objects)
+    if objects and objects[0].pk is None:
+        ids = model.objects.filter(**filters).order_by('-id').values_list('id', flat=True)[:len(objects)]
+        for obj, pk in zip(objects, reversed(list(ids))):
+            obj.pk = pk
+    return objects
+
+
+def read_package(f):
+    """Returns the course.json of an uploaded .json or .zip package, and the
+    {name: data} of its lesson images."""
+    f.seek(0)
+    if not zipfile.is_zipfile(f):
+        f.seek(0)
+        try:
+            return json.loads(f.read().decode()), {}
+        except (UnicodeDecodeError, ValueError):
+            raise ValidationError('The course package must be a .zip or a .json file.')
+
+    f.seek(0)
+    images = {}
+    with zipfile.ZipFile(f) as archive:
+        members = archive.infolist()
+        # A small ZIP can expand to gigabytes:
+        if sum(member.file_size for member in members) > settings.COURSE_PACKAGE_MAX_SIZE:
+            raise ValidationError('The course package is too big.')
+        try:
+            package = json.loads(archive.read(PACKAGE_JSON).decode())
+        except KeyError:
+            raise ValidationError(f'The course package has no {PACKAGE_JSON}.')
+        except (UnicodeDecodeError, ValueError):
+            raise ValidationError(f'{PACKAGE_JSON} is not valid JSON.')
+
+        for member in members:
+            name = posixpath.normpath(member.filename[len(PACKAGE_MEDIA_DIR):])
+            if member.filename.startswith(PACKAGE_MEDIA_DIR) \
+                    and name.startswith(settings.CKEDITOR_UPLOAD_PATH) \
+                    and name.lower().endswith(IMAGE_EXTENSIONS):
+                images[name] = archive.read(member)
+    return package, images
+
+
+def store_images(images):
+    """Stores the lesson images of a package. An image is reused when the
+    same file already exists under its name, otherwise it is saved (maybe
+    under another name). Returns the {old name: new name} of the renamed."""
+    renamed = {}
+    for name, data in images.items():
+        if default_storage.exists(name):
+            with default_storage.open(name) as f:
+                if f.read() == data:
+                    continue
+        new_name = default_storage.save(name, ContentFile(data))
+        if new_name != name:
+            renamed[name] = new_name
+    return renamed
+
+
+def import_package(course, package, images=None):
+    """Adds the lessons (with their quizzes, questions and answers) of a
+    validated package to a course, in one transaction and with one INSERT
+    per table. Returns the number of lessons and questions added."""
+    renamed = store_images(images or {})
+
+    with transaction.atomic():
+        Course.objects.select_for_update().filter(pk=course.pk).first()
+
+        lessons = []
+        for data in package['lessons']:
+            content = data.get('content', '')
+            for name, new_name in renamed.items():
+                content = content.replace(f'src="{settings.MEDIA_URL}{name}"', f'src="{settings.MEDIA_URL}{new_name}"')
+            # What Lesson.save() does, bulk_create does not call it:
+            content_html, excerpt = render_content(content)
+            lessons.append(Lesson(course=course, number=data['number'], title=data['title'].title(),
+                                  description=data['description'], content=content,
+                                  content_html=content_html, excerpt=excerpt, content_version=1))
+        bulk_create_with_ids(Lesson, lessons, course=course)
+
+        quizzes = []
+        quiz_data = []
+        for lesson, data in zip(lessons, package['lessons']):
+            if data.get('quiz') is not None:
+                quizzes.append(Quiz(course=course, lesson_id=lesson.pk, title=data['quiz']['title'].title(),
+                                    draw_count=data['quiz'].get('draw_count', 0),
+                                    time_limit=data['quiz'].get('time_limit', 0),
+                                    max_attempts=data['quiz'].get('max_attempts', 1),
+                                    score_policy=data['quiz'].get('score_policy', 'best')))
+                quiz_data.append(data['quiz'])
+        bulk_create_with_ids(Quiz, quizzes, course=course)
+
+        questions = []
+        question_data = []
+        for quiz, data in zip(quizzes, quiz_data):
+            for question in data['questions']:
+                questions.append(Question(quiz_id=quiz.pk, text=question['text']))
+                question_data.append(question)
+        bulk_create_with_ids(Question, questions, quiz__course=course)
+
+        Answer.objects.bulk_create([Answer(question_id=question.pk, text=answer['text'],
+                                           is_correct=answer.get('is_correct') is True)
+                                    for question, data in zip(questions, question_data)
+                                    for answer in data['answers']])
+
+    invalidate_lesson_ids(course.pk)
+    return len(lessons), len(questions)
+
+
+def copy_course(course, title, code):
+    """Copies a course with its lessons, quizzes, questions, answers and
+    files (the copies use the same stored files) as a new pending course.
+    The number of queries does not depend on the size of the course: one
+    SELECT and one INSERT per table. Enrollments, ratings and quiz results
+    are not copied. Returns the new course."""
+    with transaction.atomic():
+        clone = Course.objects.create(title=title, code=code, description=course.description,
+                                      image=course.image.name, owner=course.owner, subject=course.subject)
+
+        lessons = list(Lesson.objects.filter(course=course).order_by('id'))
+        new_lessons = bulk_create_with_ids(Lesson, [
+            Lesson(course=clone, number=lesson.number, title=lesson.title, description=lesson.description,
+                   content=lesson.content, content_html=lesson.content_html, excerpt=lesson.excerpt,
+                   content_version=1)
+            for lesson in lessons
+        ], course=clone)
+        lesson_ids = {lesson.pk: new_lesson.pk for lesson, new_lesson in zip(lessons, new_lessons)}
+
+        quizzes = list(Quiz.objects.filter(course=course).order_by('id')
+                       .values_list('id', 'title', 'lesson_id', 'bank_id', 'bank_tag_id', 'draw_count', 'time_limit',
+                                    'max_attempts', 'score_policy'))
+        # The copies draw from the same question banks:
+        new_quizzes = bulk_create_with_ids(Quiz, [
+            Quiz(course=clone, title=title, lesson_id=lesson_ids[lesson_id], bank_id=bank_id, bank_tag_id=bank_tag_id,
+                 draw_count=draw_count, time_limit=time_limit, max_attempts=max_attempts, score_policy=score_policy)
+            for _, title, lesson_id, bank_id, bank_tag_id, draw_count, time_limit, max_attempts, score_policy
+            in quizzes
+        ], course=clone)
+        quiz_ids = {quiz[0]: new_quiz.pk for quiz, new_quiz in zip(quizzes, new_quizzes)}
+
+        questions = list(Question.objects.filter(quiz__course=course).order_by('id')
+                         .values_list('id', 'text', 'quiz_id'))
+        new_questions = bulk_create_with_ids(Question, [
+            Question(quiz_id=quiz_ids[quiz_id], text=text) for _, text, quiz_id in questions
+        ], quiz__course=clone)
+        question_ids = {question[0]: new_question.pk for question, new_question in zip(questions, new_questions)}
+
+        Answer.objects.bulk_create([
+            Answer(question_id=question_ids[question_id], text=text, is_correct=is_correct)
+            for question_id, text, is_correct in Answer.objects.filter(question__quiz__course=course)
+            .order_by('id').values_list('question_id', 'text', 'is_correct')
+        ])
+
+        files = list(MyFile.objects.filter(course=course).order_by('id'))
+        new_files = bulk_create_with_ids(MyFile, [
+            MyFile(course=clone, owner=my_file.owner, file=my_file.file, file_link=my_file.file_link)
+            for my_file in files
+        ], course=clone)
+        file_ids = {my_file.pk: new_file.pk for my_file, new_file in zip(files, new_files)}
+        FilePreview.objects.bulk_create([
+            FilePreview(file_id=file_ids[preview.file_id], status=preview.status, page_count=preview.page_count,
+                        text=preview.text, image=preview.image.name, error=preview.error)
+            for preview in FilePreview.objects.filter(file__course=course)
+        ])
+
+    return clone
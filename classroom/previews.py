@@ -0,0 +1,125 @@
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from functools import partial
+from .documents import extract
+from .models import FilePreview, MyFile
+from .uploads import get_extension
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Created on first use, so that only the processes that upload files start workers:
+executor = None
+
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=settings.DOCUMENT_PREVIEW_WORKERS)
+    return executor
+
+
+def wait_for_previews():
+    """Blocks until the submitted files are extracted and their previews saved."""
+    global executor
+    if executor is not None:
+        executor.shutdown(wait=True)
+        executor = None
+
+
+def get_extract_arguments(name):
+    """The arguments of documents.extract() for a stored file. Only plain
+    values are sent to the workers, so they never need Django."""
+    return (default_storage.path(name), get_extension(name), settings.DOCUMENT_PREVIEW_TEXT_LENGTH,
+            settings.DOCUMENT_PREVIEW_WIDTH, settings.DOCUMENT_PREVIEW_MAX_READ_SIZE)
+
+
+def save_preview(file_pk, result):
+    """Stores what extract() returned for a course file. Nothing is stored if
+    the file was deleted in the meantime."""
+    preview = FilePreview.objects.filter(pk=file_pk).first()
+    if preview is None:
+        return
+    delete_preview_image(preview)
+
+    image = ''
+    if result['image']:
+        image = default_storage.save(f'previews/{file_pk}.png', ContentFile(result['image']))
+    if not FilePreview.objects.filter(pk=file_pk).update(status='done', page_count=result['page_count'],
+                                                        text=result['text'], image=image, error=''):
+        default_storage.delete(image)
+
+
+def save_failure(file_pk, error):
+    logger.error('Could not generate the preview of the file %s: %s', file_pk, error)
+    FilePreview.objects.filter(pk=file_pk).update(status='failed', error=str(error))
+
+
+def on_extracted(file_pk, future):
+    """Runs in the result thread of the pool, after a worker is done."""
+    close_old_connections()
+    try:
+        error = future.exception()
+        if error is None:
+            save_preview(file_pk, future.result())
+        else:
+            save_failure(file_pk, error)
+    except Exception:
+        logger.exception('Could not save the preview of the file %s', file_pk)
+    finally:
+        close_old_connections()
+
+
+def generate_preview(file_pk, name):
+    """Extracts and stores the preview of a course file in this process."""
+    try:
+        result = extract(*get_extract_arguments(name))
+    except Exception as e:
+        save_failure(file_pk, e)
+    else:
+        save_preview(file_pk, result)
+
+
+def submit_previews(files):
+    if settings.DOCUMENT_PREVIEW_WORKERS == 0:
+        for file_pk, name in files:
+            generate_preview(file_pk, name)
+        return
+
+    for file_pk, name in files:
+        future = get_executor().submit(extract, *get_extract_arguments(name))
+        future.add_done_callback(partial(on_extracted, file_pk))
+
+
+def generate_previews_later(files):
+    """Marks the previews of new course files (MyFile objects) as pending
+    and extracts them on the worker processes once the transaction is
+    committed. With DOCUMENT_PREVIEW_WORKERS = 0 they are extracted before
+    the response is sent, which needs no workers (e.g. in development)."""
+    files = [(my_file.pk, my_file.file) for my_file in files]
+    FilePreview.objects.bulk_create([FilePreview(file_id=file_pk) for file_pk, _ in files])
+    transaction.on_commit(lambda: submit_previews(files))
+
+
+def delete_preview_image(preview):
+    """Deletes the image of a preview, unless the preview of a copied file
+    (see packages.copy_course) uses it too."""
+    if preview.image and not FilePreview.objects.filter(image=preview.image.name).exclude(pk=preview.pk).exists():
+        preview.image.delete(save=False)
+
+
+def delete_preview(file_pk):
+    preview = FilePreview.objects.filter(pk=file_pk).exclude(image='').first()
+    if preview is not None:
+        delete_preview_image(preview)
+
+
+def get_missing_previews(retry_failed=False):
+    """(pk, name) of the course files without a finished preview, e.g. the
+    ones uploaded before the previews or while the workers were down."""
+    statuses = ['done'] if retry_failed else ['done', 'failed']
+    return MyFile.objects.exclude(preview__status__in=statuses).exclude(file='') \
+        .values_list('pk', 'file')
@@ -0,0 +1,337 @@
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Subquery
+from django.utils import timezone
+from .models import Answer, Question, Quiz, QuizAttempt, StudentAnswer, TakenCourse, TakenQuiz, UserLog
+import random
+import time
+
+ANSWER_BATCH_SIZE = 500  # ids per statement
+
+
+def join_ids(ids):
+    """The compact form of a list of ids stored on the attempts: "4,17,9"."""
+    return ','.join(str(pk) for pk in ids)
+
+
+def split_ids(text):
+    return [int(pk) for pk in text.split(',')] if text else []
+
+
+def get_bank_question_ids(bank_pk, tag_pk=None):
+    """The ids of the questions of a bank (with the tag, if given). All of
+    the lists of a bank are read in one query and cached until a question of
+    the bank is added, edited or deleted."""
+    key = f'question-bank-ids:{bank_pk}'
+    ids_by_tag = cache.get(key)
+    if ids_by_tag is None:
+        ids_by_tag = {0: []}
+        rows = Question.objects.filter(bank_id=bank_pk).order_by('id').values_list('id', 'tags')
+        for question_pk, question_tag_pk in rows:
+            # One row per tag of the question:
+            if not ids_by_tag[0] or ids_by_tag[0][-1] != question_pk:
+                ids_by_tag[0].append(question_pk)
+            if question_tag_pk is not None:
+                ids_by_tag.setdefault(question_tag_pk, []).append(question_pk)
+        cache.set(key, ids_by_tag, settings.QUESTION_BANK_CACHE_TIMEOUT)
+    return ids_by_tag.get(tag_pk or 0, [])
+
+
+def invalidate_bank_question_ids(bank_pk):
+    cache.delete(f'question-bank-ids:{bank_pk}')
+
+
+def draw_questions(quiz):
+    """The ids of the questions of a new attempt: draw_count random ones of
+    the questions of the quiz and of its bank, or all of them in their order.
+    The bank is sampled from its cached id list, the database never sorts
+    it randomly."""
+    question_ids = list(Question.objects.filter(quiz=quiz).order_by('id').values_list('id', flat=True))
+    if quiz.bank_id is not None:
+        question_ids += get_bank_question_ids(quiz.bank_id, quiz.bank_tag_id)
+    if 0 < quiz.draw_count < len(question_ids):
+        return random.sample(question_ids, quiz.draw_count)
+    return question_ids
+
+
+def get_quiz_result(taken_quiz):
+    """The questions of a taken quiz, in the order the student got them, as
+    (question, answers) with answer.is_chosen set on the student's answers.
+    Everything comes from one query (none for the choices of a compact
+    attempt, they are on its row)."""
+    question_ids = split_ids(taken_quiz.question_ids)
+    if question_ids:
+        answers = Answer.objects.filter(question_id__in=question_ids)
+    else:
+        answers = Answer.objects.filter(question__quiz_id=taken_quiz.quiz_id)
+    answers = answers.select_related('question').order_by('question_id', 'id')
+    if taken_quiz.answer_ids:
+        chosen_answers = set(split_ids(taken_quiz.answer_ids))
+        for answer in answers:
+            answer.is_chosen = answer.pk in chosen_answers
+    else:
+        answers = answers.annotate(is_chosen=Exists(StudentAnswer.objects.filter(taken_quiz_id=taken_quiz.pk,
+                                                                                 answer=OuterRef('pk'))))
+
+    questions = {}
+    for answer in answers:
+        questions.setdefault(answer.question_id, (answer.question, []))[1].append(answer)
+    order = {pk: i for i, pk in enumerate(question_ids)}
+    return sorted(questions.values(), key=lambda question: order.get(question[0].pk, question[0].pk))
+
+
+def get_quiz_statistics(quiz_pk):
+    """Per-question statistics of the taken quizzes of a quiz: how many
+    times each question was asked and answered, and how many times each
+    answer was chosen. Reads the compact attempts and the StudentAnswer rows
+    of the others, so it works during and after compact_quiz_answers."""
+    asked = Counter()
+    chosen = Counter()
+    quiz_question_ids = None
+    for question_ids, answer_ids in TakenQuiz.objects.filter(quiz_id=quiz_pk) \
+            .values_list('question_ids', 'answer_ids').iterator():
+        if not question_ids:
+            # Taken before the question banks, it had all of the questions of the quiz:
+            if quiz_question_ids is None:
+                quiz_question_ids = list(Question.objects.filter(quiz_id=quiz_pk).values_list('id', flat=True))
+            asked.update(quiz_question_ids)
+        else:
+            asked.update(split_ids(question_ids))
+        chosen.update(pk for pk in split_ids(answer_ids) if pk)
+    chosen.update(dict(StudentAnswer.objects.filter(quiz_id=quiz_pk).exclude(taken_quiz=None)
+                       .values('answer_id').annotate(count=Count('id')).values_list('answer_id', 'count')))
+
+    statistics = {}
+    for answer in Answer.objects.filter(question_id__in=list(asked)).select_related('question').order_by('id'):
+        question = statistics.setdefault(answer.question_id, {
+            'id': answer.question_id,
+            'text': answer.question.text,
+            'asked': asked[answer.question_id],
+            'answered': 0,
+            'correct': 0,
+            'answers': [],
+        })
+        question['answered'] += chosen[answer.pk]
+        if answer.is_correct:
+            question['correct'] += chosen[answer.pk]
+        question['answers'].append({'id': answer.pk, 'text': answer.text, 'is_correct': answer.is_correct,
+                                    'chosen': chosen[answer.pk]})
+    return sorted(statistics.values(), key=lambda question: question['id'])
+
+
+def get_deadline_key(quiz_pk):
+    return f'quiz-deadline:{quiz_pk}'
+
+
+def get_session_deadline(session, quiz_pk):
+    """The (attempt pk, deadline timestamp) in the session, if any."""
+    value = session.get(get_deadline_key(quiz_pk))
+    if value is None:
+        return None
+    try:
+        attempt_pk, deadline = signing.loads(value, salt='quiz-deadline')
+    except signing.BadSignature:
+        return None
+    return attempt_pk, deadline
+
+
+def set_deadline(session, attempt):
+    """Keeps the deadline of a timed attempt in the session, signed, so that
+    the answers sent too late are rejected before any query."""
+    deadline = (attempt.pk, attempt.deadline.timestamp())
+    if get_session_deadline(session, attempt.quiz_id) != deadline:
+        session[get_deadline_key(attempt.quiz_id)] = signing.dumps(deadline, salt='quiz-deadline')
+
+
+def clear_deadline(session, quiz_pk):
+    session.pop(get_deadline_key(quiz_pk), None)
+
+
+def is_past_deadline(session, quiz_pk):
+    """True if the deadline in the session (plus QUIZ_DEADLINE_GRACE for
+    the requests on their way) has passed."""
+    deadline = get_session_deadline(session, quiz_pk)
+    return deadline is not None and time.time() > deadline[1] + settings.QUIZ_DEADLINE_GRACE
+
+
+def is_expired(attempt):
+    return attempt.deadline is not None and \
+        timezone.now() > attempt.deadline + timedelta(seconds=settings.QUIZ_DEADLINE_GRACE)
+
+
+def grade_attempts(attempts):
+    """The TakenQuiz objects (not saved) of open attempts and the ids of
+    their answers, with one query for the answers of all of them. The
+    unanswered questions count as wrong, the ones that the teacher deleted
+    during the attempt are left out. With QUIZ_COMPACT_ANSWERS the chosen
+    answers are set on the TakenQuiz objects too."""
+    drawn_ids = list({pk for attempt in attempts for pk in split_ids(attempt.question_ids)})
+    existing_ids = set()
+    for i in range(0, len(drawn_ids), ANSWER_BATCH_SIZE):
+        existing_ids.update(Question.objects.filter(pk__in=drawn_ids[i:i + ANSWER_BATCH_SIZE])
+                            .values_list('id', flat=True))
+
+    answers = StudentAnswer.objects \
+        .filter(student_id__in={attempt.student_id for attempt in attempts},
+                quiz_id__in={attempt.quiz_id for attempt in attempts},
+                taken_quiz=None) \
+        .values_list('id', 'student_id', 'quiz_id', 'answer_id', 'answer__question_id', 'answer__is_correct')
+    chosen_answers = {}
+    correct_answers = set()
+    answer_ids = []
+    for answer_pk, student_id, quiz_id, chosen_pk, question_pk, is_correct in answers:
+        answer_ids.append(answer_pk)
+        chosen_answers[student_id, quiz_id, question_pk] = chosen_pk
+        if is_correct:
+            correct_answers.add((student_id, quiz_id, question_pk))
+
+    taken_quizzes = []
+    for attempt in attempts:
+        question_ids = [pk for pk in split_ids(attempt.question_ids) if pk in existing_ids]
+        correct = sum((attempt.student_id, attempt.quiz_id, pk) in correct_answers for pk in question_ids)
+        taken_quiz = TakenQuiz(student_id=attempt.student_id, quiz_id=attempt.quiz_id, course_id=attempt.course_id,
+                               question_ids=join_ids(question_ids),
+                               score=round((correct / len(question_ids)) * 100.0, 2) if question_ids else 0)
+        if settings.QUIZ_COMPACT_ANSWERS:
+            taken_quiz.answer_ids = join_ids(chosen_answers.get((attempt.student_id, attempt.quiz_id, pk), 0)
+                                             for pk in question_ids)
+        taken_quizzes.append(taken_quiz)
+    return taken_quizzes, answer_ids
+
+
+def save_answers(answer_ids):
+    """Once the TakenQuiz rows of graded attempts are saved, deletes their
+    answers (QUIZ_COMPACT_ANSWERS, they are stored on the rows) or links
+    them to the rows."""
+    for i in range(0, len(answer_ids), ANSWER_BATCH_SIZE):
+        if settings.QUIZ_COMPACT_ANSWERS:
+            StudentAnswer.objects.filter(pk__in=answer_ids[i:i + ANSWER_BATCH_SIZE]).delete()
+        else:
+            link_answers(answer_ids[i:i + ANSWER_BATCH_SIZE])
+
+
+def link_answers(answer_ids):
+    """Sets the attempt of graded answers in one UPDATE: the last TakenQuiz
+    of their student and quiz, i.e. the one that was just saved."""
+    last_taken_quiz = TakenQuiz.objects.filter(student_id=OuterRef('student_id'), quiz_id=OuterRef('quiz_id')) \
+        .order_by('-id').values('id')[:1]
+    StudentAnswer.objects.filter(pk__in=answer_ids).update(taken_quiz_id=Subquery(last_taken_quiz))
+
+
+def compact_answers(batch_size=500):
+    """Moves the StudentAnswer rows of the taken quizzes into their
+    answer_ids, batch by batch. Returns the number of compacted attempts."""
+    total = 0
+    quiz_question_ids = {}
+    while True:
+        with transaction.atomic():
+            taken_quizzes = list(TakenQuiz.objects.filter(answer_ids='', answers__isnull=False).distinct()
+                                 .order_by('id').only('id', 'quiz_id', 'question_ids')[:batch_size])
+            if not taken_quizzes:
+                break
+            chosen_answers = {}
+            for taken_quiz_pk, chosen_pk, question_pk in StudentAnswer.objects \
+                    .filter(taken_quiz__in=taken_quizzes) \
+                    .values_list('taken_quiz_id', 'answer_id', 'answer__question_id'):
+                chosen_answers[taken_quiz_pk, question_pk] = chosen_pk
+
+            for taken_quiz in taken_quizzes:
+                if not taken_quiz.question_ids:
+                    # Taken before the question banks: all of the questions of the quiz, in their order:
+                    if taken_quiz.quiz_id not in quiz_question_ids:
+                        quiz_question_ids[taken_quiz.quiz_id] = join_ids(
+                            Question.objects.filter(quiz_id=taken_quiz.quiz_id).order_by('id')
+                            .values_list('id', flat=True))
+                    taken_quiz.question_ids = quiz_question_ids[taken_quiz.quiz_id]
+                taken_quiz.answer_ids = join_ids(chosen_answers.get((taken_quiz.pk, pk), 0)
+                                                 for pk in split_ids(taken_quiz.question_ids))
+            TakenQuiz.objects.bulk_update(taken_quizzes, ['question_ids', 'answer_ids'])
+            StudentAnswer.objects.filter(taken_quiz__in=taken_quizzes).delete()
+        total += len(taken_quizzes)
+    return total
+
+
+def get_grade(policy, scores):
+    """The grade of a student in a quiz from the scores of the attempts, in
+    the order they were taken."""
+    if policy == 'last':
+        return scores[-1]
+    if policy == 'average':
+        return round(sum(scores) / len(scores), 2)
+    return max(scores)
+
+
+def get_grades(taken_quizzes):
+    """{(student_id, quiz_id): grade} of the rows (student_id, quiz_id,
+    score, score_policy) of taken quizzes, in the order they were taken."""
+    scores = {}
+    policies = {}
+    for student_id, quiz_id, score, policy in taken_quizzes:
+        scores.setdefault((student_id, quiz_id), []).append(score)
+        policies[quiz_id] = policy
+    return {key: get_grade(policies[key[1]], key_scores) for key, key_scores in scores.items()}
+
+
+def get_average_grade(taken_quizzes):
+    """The average of the grades of a queryset of taken quizzes, or None."""
+    grades = get_grades(taken_quizzes.order_by('id')
+                        .values_list('student_id', 'quiz_id', 'score', 'quiz__score_policy'))
+    return round(sum(grades.values()) / len(grades), 2) if grades else None
+
+
+def update_finished_courses(enrollments):
+    """Marks the (student_id, course_id) enrollments whose every quiz is
+    taken as finished."""
+    student_ids = {student_id for student_id, _ in enrollments}
+    course_ids = {course_id for _, course_id in enrollments}
+    quiz_counts = dict(Quiz.objects.filter(course_id__in=course_ids)
+                       .values('course_id').annotate(count=Count('id')).values_list('course_id', 'count'))
+    taken_counts = TakenQuiz.objects.filter(student_id__in=student_ids, course_id__in=course_ids) \
+        .values('student_id', 'course_id').annotate(count=Count('quiz', distinct=True)) \
+        .values_list('student_id', 'course_id', 'count')
+
+    finished = {}
+    for student_id, course_id, count in taken_counts:
+        if (student_id, course_id) in enrollments and count == quiz_counts.get(course_id):
+            finished.setdefault(course_id, []).append(student_id)
+    for course_id, finished_student_ids in finished.items():
+        TakenCourse.objects.filter(course_id=course_id, student_id__in=finished_student_ids) \
+            .update(status='finished')
+
+
+def finalize_expired_attempts(batch_size=500):
+    """Grades the timed attempts whose deadline has passed, batch by batch.
+    The locked rows are skipped: a student is finishing that attempt.
+    Returns the number of finalized attempts."""
+    expired = timezone.now() - timedelta(seconds=settings.QUIZ_DEADLINE_GRACE)
+    total = 0
+    while True:
+        with transaction.atomic():
+            attempts = list(QuizAttempt.objects.select_for_update(skip_locked=True)
+                            .filter(deadline__lt=expired)
+                            .order_by('deadline')[:batch_size])
+            if not attempts:
+                break
+            # Only the attempts that this call deletes are graded. The row lock above does nothing on
+            # SQLite, so a student may have finished one of them in the meantime (see finish_quiz):
+            attempts = [attempt for attempt in attempts if QuizAttempt.objects.filter(pk=attempt.pk).delete()[0]]
+            if not attempts:
+                continue
+            taken_quizzes, answer_ids = grade_attempts(attempts)
+            TakenQuiz.objects.bulk_create(taken_quizzes)
+            save_answers(answer_ids)
+
+            titles = dict(Quiz.objects.filter(pk__in={attempt.quiz_id for attempt in attempts})
+                          .values_list('id', 'title'))
+            UserLog.objects.bulk_create([
+                UserLog(action=f'Took the quiz: {titles[attempt.quiz_id]} (time is up)', user_type='student',
+                        user_id=attempt.student_id)
+                for attempt in attempts
+            ])
+            update_finished_courses({(attempt.student_id, attempt.course_id) for attempt in attempts})
+        total += len(attempts)
+    return total
@@ -0,0 +1,177 @@
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from star_ratings import app_settings as star_ratings_settings
+from star_ratings.models import UserRating
+from .models import Course, Recommendation, Student, TakenCourse
+from .quizzes import join_ids, split_ids
+import heapq
+import math
+
+RECOMMENDATION_BATCH_SIZE = 500  # rows per statement
+
+
+def get_cache_key(kind, object_id):
+    return f'recommendations:{kind}:{object_id}'
+
+
+def get_weights():
+    """The sparse student x course matrix, as {student_id: {course_id: weight}}.
+    An enrollment (also a finished course) counts 1, the rating of the
+    student (if any) scales it from 0.5 (the lowest) to 1.5 (the highest)."""
+    weights = defaultdict(dict)
+    for student_id, course_id in TakenCourse.objects.filter(status__in=['enrolled', 'finished'],
+                                                            course__status='approved') \
+            .values_list('student_id', 'course_id'):
+        weights[student_id][course_id] = 1.0
+
+    highest = max(star_ratings_settings.STAR_RATINGS_RANGE - 1, 1)
+    ratings = UserRating.objects.filter(rating__content_type=ContentType.objects.get_for_model(Course)) \
+        .values_list('user_id', 'rating__object_id', 'score')
+    for user_id, course_id, score in ratings:
+        # The students are stored with the pk of their user:
+        if course_id in weights.get(user_id, ()):
+            weights[user_id][course_id] = 0.5 + (score - 1) / highest
+    return weights
+
+
+def get_similarities(weights):
+    """The cosine similarity of the courses (the columns of the matrix), as
+    {course_id: {course_id: similarity}}. The product of the matrix with
+    itself is summed one student row at a time, so only the courses that
+    share students are ever paired."""
+    products = defaultdict(lambda: defaultdict(float))
+    norms = defaultdict(float)
+    for row in weights.values():
+        items = list(row.items())
+        for i, (course_id, weight) in enumerate(items):
+            norms[course_id] += weight * weight
+            for other_id, other_weight in items[i + 1:]:
+                products[course_id][other_id] += weight * other_weight
+                products[other_id][course_id] += weight * other_weight
+
+    return {course_id: {other_id: product / math.sqrt(norms[course_id] * norms[other_id])
+                        for other_id, product in row.items()}
+            for course_id, row in products.items()}
+
+
+def get_top(scores, count, popularity):
+    """The ids of the best scores, the most popular first on a tie."""
+    return heapq.nlargest(count, scores, key=lambda pk: (scores[pk], popularity[pk], pk))
+
+
+def build_recommendations():
+    """The course ids to store, as {(kind, object_id): [course_id, ...]}.
+
+    The suggestions of a course are the most similar courses, followed by
+    the most popular ones of its subject. The score of a course for a
+    student is the sum of its similarities to the courses of the student
+    (weighted like the matrix), blended with the popular courses of the
+    subjects in Student.interests (RECOMMENDATION_INTEREST_WEIGHT)."""
+    count = settings.RECOMMENDATION_COUNT
+    weights = get_weights()
+    similarities = get_similarities(weights)
+
+    courses = dict(Course.objects.filter(status='approved').values_list('id', 'subject_id'))
+    popularity = Counter(course_id for row in weights.values() for course_id in row)
+    popular_by_subject = defaultdict(list)
+    for course_id in sorted(courses, key=lambda pk: (popularity[pk], pk), reverse=True):
+        if len(popular_by_subject[courses[course_id]]) < settings.RECOMMENDATION_NEIGHBORS:
+            popular_by_subject[courses[course_id]].append(course_id)
+
+    recommendations = {}
+    neighbors = {}
+    for course_id, subject_id in courses.items():
+        similar = similarities.get(course_id, {})
+        neighbors[course_id] = [(other_id, similar[other_id])
+                                for other_id in get_top(similar, settings.RECOMMENDATION_NEIGHBORS, popularity)]
+        course_ids = [other_id for other_id, _ in neighbors[course_id][:count]]
+        course_ids += [other_id for other_id in popular_by_subject[subject_id]
+                       if other_id != course_id and other_id not in course_ids][:count - len(course_ids)]
+        recommendations[('course', course_id)] = course_ids
+
+    interests = defaultdict(list)
+    for student_id, subject_id in Student.interests.through.objects.values_list('student_id', 'subject_id'):
+        interests[student_id].append(subject_id)
+    # Also the pending requests, so a course that the student asked for is not suggested:
+    taken_courses = defaultdict(set)
+    for student_id, course_id in TakenCourse.objects.values_list('student_id', 'course_id'):
+        taken_courses[student_id].add(course_id)
+
+    interest_weight = settings.RECOMMENDATION_INTEREST_WEIGHT
+    for student_id in set(weights) | set(interests):
+        taken = taken_courses[student_id]
+        scores = defaultdict(float)
+        for course_id, weight in weights.get(student_id, {}).items():
+            for other_id, similarity in neighbors.get(course_id, ()):
+                if other_id not in taken:
+                    scores[other_id] += weight * similarity
+
+        highest = max(scores.values(), default=0)
+        blended = {course_id: (1 - interest_weight) * score / highest for course_id, score in scores.items()}
+        for subject_id in interests.get(student_id, ()):
+            for course_id in popular_by_subject.get(subject_id, ()):
+                if course_id not in taken:
+                    blended[course_id] = blended.get(course_id, 0) + interest_weight
+
+        # One more than shown, in case the student looks at one of them:
+        recommendations[('student', student_id)] = get_top(blended, count + 1, popularity)
+    return recommendations
+
+
+def update_recommendations():
+    """Replaces the stored suggestions (run periodically by the recommend_courses
+    command) and puts them in the cache. Returns the number of rows."""
+    recommendations = build_recommendations()
+    with transaction.atomic():
+        Recommendation.objects.all().delete()
+        Recommendation.objects.bulk_create([
+            Recommendation(kind=kind, object_id=object_id, course_ids=join_ids(course_ids))
+            for (kind, object_id), course_ids in recommendations.items()
+        ], batch_size=RECOMMENDATION_BATCH_SIZE)
+
+    items = list(recommendations.items())
+    for i in range(0, len(items), RECOMMENDATION_BATCH_SIZE):
+        cache.set_many({get_cache_key(kind, object_id): course_ids
+                        for (kind, object_id), course_ids in items[i:i + RECOMMENDATION_BATCH_SIZE]},
+                       settings.RECOMMENDATION_CACHE_TIMEOUT)
+    return len(items)
+
+
+def get_recommended_ids(course, student_pk=None):
+    """The ids of the courses to suggest on the page of a course, the ones
+    of the student first (if given). Read with one cache lookup; on a miss
+    the stored rows are read with one query. A course that the job has not
+    seen yet (e.g. a new one) gets the newest courses of its subject."""
+    keys = {get_cache_key('course', course.pk): ('course', course.pk)}
+    if student_pk is not None:
+        keys[get_cache_key('student', student_pk)] = ('student', student_pk)
+    found = cache.get_many(list(keys))
+
+    missing = {key: keys[key] for key in keys if key not in found}
+    if missing:
+        condition = Q()
+        for kind, object_id in missing.values():
+            condition |= Q(kind=kind, object_id=object_id)
+        rows = {(kind, object_id): split_ids(course_ids) for kind, object_id, course_ids
+                in Recommendation.objects.filter(condition).values_list('kind', 'object_id', 'course_ids')}
+
+        for key, (kind, object_id) in missing.items():
+            if (kind, object_id) in rows:
+                found[key] = rows[(kind, object_id)]
+            elif kind == 'course':
+                found[key] = list(Course.objects.filter(subject_id=course.subject_id, status='approved')
+                                  .exclude(id=course.pk)
+                                  .order_by('-id')
+                                  .values_list('id', flat=True)[:settings.RECOMMENDATION_COUNT])
+            else:
+                found[key] = []
+        cache.set_many({key: found[key] for key in missing}, settings.RECOMMENDATION_CACHE_TIMEOUT)
+
+    course_ids = []
+    for key in sorted(keys, key=lambda key: keys[key][0] != 'student'):
+        course_ids += [pk for pk in found[key] if pk != course.pk and pk not in course_ids]
+    return course_ids[:settings.RECOMMENDATION_COUNT]
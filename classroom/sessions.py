@@ -0,0 +1,23 @@
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+
+
+class SessionStore(CachedDBStore):
+    """Cached, database backed sessions that remember what was loaded,
+    so classroom.middleware.SessionMiddleware can skip saving a session
+    that was marked as modified but ended up with the same data."""
+
+    def __init__(self, session_key=None):
+        self._loaded_state = None
+        super().__init__(session_key)
+
+    def load(self):
+        data = super().load()
+        self._loaded_state = (self.session_key, self.serializer().dumps(data))
+        return data
+
+    def has_changed(self):
+        if self._loaded_state is None:
+            return True
+        session_key, data = self._loaded_state
+        # A new session key (log in, log out) must always be saved to set the cookie:
+        return session_key != self.session_key or data != self.serializer().dumps(self._session)
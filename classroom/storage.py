@@ -0,0 +1,48 @@
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+import gzip
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, only the .gz files are created without it
+    brotli = None
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Static files storage used by collectstatic in production.
+    Every file gets a content-hashed name (e.g. style.55e7cbb9ba48.css) so it
+    can be cached forever, and the text files get precompressed .gz and .br
+    variants next to them. The web server (see README) serves those directly
+    with gzip_static/brotli_static, Django never serves the static files."""
+    compressible_extensions = ('.css', '.js', '.svg', '.html', '.txt', '.json',
+                               '.xml', '.ttf', '.eot', '.otf', '.ico', '.map')
+    min_compress_size = 512  # bytes, smaller files are not worth it
+
+    def post_process(self, paths, dry_run=False, **options):
+        names = set(paths)
+        for original_path, processed_path, processed in super().post_process(paths, dry_run, **options):
+            if processed_path:
+                names.add(processed_path)
+            yield original_path, processed_path, processed
+
+        if not dry_run:
+            for name in sorted(names):
+                if name.lower().endswith(self.compressible_extensions):
+                    self.compress(name)
+
+    def compress(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            content = f.read()
+        if len(content) < self.min_compress_size:
+            return
+
+        # mtime=0 so the same file always gives the same .gz:
+        variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(content)))
+
+        for extension, compressed in variants:
+            # Only keep the variant if it is actually smaller:
+            if len(compressed) < len(content) * 0.95:
+                with open(path + extension, 'wb') as f:
+                    f.write(compressed)
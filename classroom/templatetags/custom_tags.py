@@ -1,8 +1,82 @@
 from django import template
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join, mark_safe
+from ..images import get_fallback_extension, get_variants, WEBP_SUPPORTED
 
 register = template.Library()
 
+# Critical CSS read from the collected static files, once per process:
+critical_css_cache = {}
+
 
 @register.filter(name='get_star_percentage')
 def get_star_percentage(average_value):
     return (average_value / 5) * 111  # 111 is the 100% of the stars.css
+
+
+def get_critical_css(name):
+    critical_name = f"bundles/{name.replace('.css', '.critical.css')}"
+    if critical_name not in critical_css_cache:
+        with staticfiles_storage.open(critical_name) as f:
+            critical_css_cache[critical_name] = f.read().decode('utf-8')
+    return critical_css_cache[critical_name]
+
+
+@register.simple_tag
+def bundle(name):
+    """Emits the <link>/<script> tags of a bundle in settings.STATIC_BUNDLES.
+    In DEBUG the original files are linked one by one. Otherwise a single
+    hashed bundle (see the build_bundles command) is linked, and for the
+    stylesheets with critical CSS, that CSS is inlined and the full bundle
+    is loaded without blocking the first paint."""
+    if settings.DEBUG:
+        paths = settings.STATIC_BUNDLES[name]
+    else:
+        paths = [f'bundles/{name}']
+    urls = ((static(path), ) for path in paths)
+
+    if not name.endswith('.css'):
+        return format_html_join('\n', '<script src="{}"></script>', urls)
+
+    if settings.DEBUG or name not in settings.CRITICAL_CSS:
+        return format_html_join('\n', '<link href="{}" rel="stylesheet">', urls)
+
+    url = static(paths[0])
+    return format_html(
+        '<style>{}</style>\n'
+        '<link rel="preload" href="{}" as="style" onload="this.onload=null;this.rel=\'stylesheet\'">\n'
+        '<noscript><link href="{}" rel="stylesheet"></noscript>',
+        mark_safe(get_critical_css(name)), url, url
+    )
+
+
+def format_srcset(variants):
+    return ', '.join(f'{url} {width}w' for url, width in variants)
+
+
+@register.simple_tag
+def responsive_image(image, kind, sizes='100vw', **attrs):
+    """Emits a <picture> with the pre-generated WebP and JPEG/PNG variants
+    of an image (see settings.IMAGE_VARIANTS), e.g.
+    {% responsive_image course.image 'course' sizes='350px' class='img-fluid' alt='img' %}.
+    It only links the variants that already exist and falls back to the
+    original file while they are being generated, it never resizes anything."""
+    attributes = format_html_join('', ' {}="{}"', attrs.items())
+    if not image:
+        return ''
+
+    fallback = get_variants(image.name, kind, get_fallback_extension(image.name))
+    if not fallback:
+        return format_html('<img src="{}"{}>', image.url, attributes)
+
+    sources = ''
+    if WEBP_SUPPORTED:
+        webp = get_variants(image.name, kind, '.webp')
+        if webp:
+            sources = format_html('<source type="image/webp" srcset="{}" sizes="{}">',
+                                  format_srcset(webp), sizes)
+
+    return format_html('<picture>{}<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+                       sources, fallback[-1][0], format_srcset(fallback), sizes, attributes)
@@ -1,3 +1,50 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection
+from django.test import TransactionTestCase
+from .models import Course, Student, Subject, TakenCourse, User
+from .views.students import get_or_create_enrollment
+import threading
 
-# Create your tests here.
+
+class EnrollmentConcurrencyTests(TransactionTestCase):
+    thread_count = 10
+
+    def setUp(self):
+        teacher = User.objects.create(username='teacher', email='teacher@example.com', is_teacher=True)
+        user = User.objects.create(username='student', email='student@example.com', is_student=True)
+        self.student = Student.objects.create(user=user)
+        self.course = Course.objects.create(title='Algebra', code='MATH101', description='Algebra',
+                                            image='courses/algebra.jpg', status='approved', owner=teacher,
+                                            subject=Subject.objects.create(name='Math'))
+
+    def enroll_concurrently(self):
+        """Calls get_or_create_enrollment from many threads at once, for the
+        same student and course, and returns what each call returned."""
+        barrier = threading.Barrier(self.thread_count)
+
+        def enroll():
+            try:
+                barrier.wait()
+                return get_or_create_enrollment(self.student.pk, self.course.pk)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.thread_count) as executor:
+            futures = [executor.submit(enroll) for _ in range(self.thread_count)]
+        return [future.result() for future in futures]
+
+    def test_concurrent_requests_create_one_enrollment(self):
+        statuses = self.enroll_concurrently()
+
+        self.assertEqual(TakenCourse.objects.filter(student=self.student, course=self.course).count(), 1)
+        # One call created the request, all of the others found it:
+        self.assertEqual(statuses.count(None), 1)
+        self.assertEqual(set(statuses) - {None}, {'pending'})
+
+    def test_repeated_requests_return_the_existing_status(self):
+        TakenCourse.objects.create(student=self.student, course=self.course, status='enrolled')
+
+        statuses = self.enroll_concurrently()
+
+        self.assertEqual(TakenCourse.objects.filter(student=self.student, course=self.course).count(), 1)
+        self.assertEqual(statuses, ['enrolled'] * self.thread_count)
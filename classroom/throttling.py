@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import render
+from functools import wraps
+from hashlib import md5
+from math import ceil
+from time import time
+
+
+def get_client_ip(request):
+    # Only trust X-Forwarded-For when the app runs behind our own proxy:
+    if settings.THROTTLE_TRUST_X_FORWARDED_FOR and 'HTTP_X_FORWARDED_FOR' in request.META:
+        return request.META['HTTP_X_FORWARDED_FOR'].split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def get_window_keys(key, period, now):
+    window = int(now // period)
+    return f'throttle:{key}:{window}', f'throttle:{key}:{window - 1}'
+
+
+def get_retry_after(current, previous, limit, period, now):
+    """Sliding window counter: the count of the previous fixed window is
+    weighted by how much of it still overlaps the sliding window.
+    Returns the seconds to wait before the next attempt, or 0."""
+    elapsed = (now % period) / period
+
+    if previous * (1 - elapsed) + current < limit:
+        return 0
+
+    if current < limit:
+        # Wait until the previous window's weight drops enough:
+        wait = (1 - (limit - current) / previous) - elapsed
+    else:
+        # Wait until the current window becomes the previous one and decays:
+        wait = (1 - elapsed) + (1 - limit / current)
+
+    return max(1, ceil(wait * period))
+
+
+def add_hit(current_key, period):
+    # The counter must outlive the next window, where it is used as the previous count:
+    if not cache.add(current_key, 1, timeout=period * 2):
+        try:
+            cache.incr(current_key)
+        except ValueError:
+            cache.set(current_key, 1, timeout=period * 2)
+
+
+def throttle(scope, fields=()):
+    """Decorator for views that limits the POST requests per client IP and
+    per value of the given form fields (e.g. username), using the limits
+    in settings.THROTTLE_RATES[scope] (None turns the throttling of the scope
+    off, nothing is counted). Locked out clients get a 429 response before
+    any expensive work (password hashing) is done."""
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            rates = settings.THROTTLE_RATES.get(scope)
+            if request.method != 'POST' or rates is None:
+                return view_func(request, *args, **kwargs)
+
+            now = time()
+            counters = [(f'{scope}:ip:{get_client_ip(request)}', rates['ip'])]
+            for field in fields:
+                value = request.POST.get(field, '').strip().lower()
+                if value:
+                    # Hashed so that any user input makes a valid cache key:
+                    counters.append((f'{scope}:{field}:{md5(value.encode()).hexdigest()}', rates[field]))
+
+            # (current window key, previous window key, limit, period) of every counter:
+            windows = [get_window_keys(key, period, now) + (limit, period)
+                       for key, (limit, period) in counters]
+            # A single cache round trip for all the counters:
+            counts = cache.get_many([key for window in windows for key in window[:2]])
+            retry_after = max(get_retry_after(counts.get(current_key, 0), counts.get(previous_key, 0),
+                                              limit, period, now)
+                              for current_key, previous_key, limit, period in windows)
+            if retry_after:
+                response = render(request, 'authentication/throttled.html',
+                                  {'title': 'Too Many Attempts', 'retry_after': retry_after},
+                                  status=429)
+                response['Retry-After'] = str(retry_after)
+                return response
+
+            for current_key, previous_key, limit, period in windows:
+                add_hit(current_key, period)
+
+            return view_func(request, *args, **kwargs)
+        return _wrapped_view
+    return decorator
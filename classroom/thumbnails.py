@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import F
+from sorl.thumbnail import get_thumbnail
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.default import kvstore
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+from .images import executor
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class KVStore(cached_db_kvstore.KVStore):
+    """sorl-thumbnail key-value store served from the THUMBNAIL_CACHE cache.
+    The database table is only the persistent copy: the first lookup of a
+    process loads the whole table into the cache with one query, so the
+    {% thumbnail %} tags of a page do not query the database one by one."""
+    warmed_up = False
+
+    def _get_raw(self, key):
+        if not KVStore.warmed_up:
+            self.warm_up()
+        return super()._get_raw(key)
+
+    def warm_up(self):
+        rows = KVStoreModel.objects.filter(key__startswith=thumbnail_settings.THUMBNAIL_KEY_PREFIX) \
+            .values_list('key', 'value')
+        self.cache.set_many(dict(rows), thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT)
+        KVStore.warmed_up = True
+
+
+def with_owner(queryset, path='owner'):
+    """Adds the name and the profile picture of the course owner to a queryset
+    in the same query (owner_first_name, owner_last_name and owner_image),
+    instead of fetching course.owner and course.owner.teacher per course."""
+    return queryset.annotate(owner_first_name=F(f'{path}__first_name'),
+                             owner_last_name=F(f'{path}__last_name'),
+                             owner_image=F(f'{path}__teacher__image'))
+
+
+def warm_thumbnails(name):
+    """Creates the thumbnails of settings.THUMBNAIL_WARM_UP for a profile
+    picture, so that the templates only find them in the key-value store."""
+    for geometry, options in settings.THUMBNAIL_WARM_UP:
+        get_thumbnail(name, geometry, **options)
+
+
+def warm_thumbnails_safely(name):
+    try:
+        warm_thumbnails(name)
+    except Exception:
+        logger.exception('Could not create the thumbnails of %s', name)
+
+
+def warm_thumbnails_later(image):
+    """Creates the thumbnails on the background pool of the image variants."""
+    if image:
+        executor.submit(warm_thumbnails_safely, image.name)
+
+
+def sweep_orphaned_thumbnails(min_age, dry_run=False):
+    """Deletes the files under THUMBNAIL_PREFIX (media/cache) that the
+    key-value store does not know about, e.g. the thumbnails of deleted or
+    replaced pictures. Files younger than min_age seconds are kept, they may
+    be in the middle of being created. Returns the deleted names."""
+    # Drops the references to the deleted pictures, and their thumbnails:
+    if not dry_run:
+        kvstore.cleanup()
+
+    referenced = set()
+    for key in kvstore._find_keys(identity='image'):
+        image_file = kvstore._get(key)
+        if image_file:
+            referenced.add(image_file.name)
+
+    root = default_storage.path(thumbnail_settings.THUMBNAIL_PREFIX)
+    deleted = []
+    now = time.time()
+    for directory, _, file_names in os.walk(root, topdown=False):
+        for file_name in file_names:
+            path = os.path.join(directory, file_name)
+            name = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+            if name in referenced or now - os.path.getmtime(path) < min_age:
+                continue
+            if not dry_run:
+                os.remove(path)
+            deleted.append(name)
+
+        if not dry_run and directory != root and not os.listdir(directory):
+            os.rmdir(directory)
+
+    return deleted
@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+import os
+import zipfile
+
+ALLOWED_EXTENSIONS = ('.pdf', '.doc', '.docx', '.ppt', '.pptx')
+UPLOAD_DIR = 'class_resources/'
+
+OLE2_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'  # .doc and .ppt
+ZIP_SIGNATURE = b'PK\x03\x04'  # .docx and .pptx
+# The part that every Office Open XML document of that type contains:
+OOXML_PARTS = {
+    '.docx': 'word/document.xml',
+    '.pptx': 'ppt/presentation.xml',
+}
+
+
+def get_extension(file_name):
+    return os.path.splitext(file_name)[1].lower()
+
+
+def is_allowed_file_name(file_name):
+    return get_extension(file_name) in ALLOWED_EXTENSIONS
+
+
+def matches_extension(f, extension):
+    """Checks the content of a file against its extension (the first bytes,
+    and the ZIP directory for .docx/.pptx), so that a renamed file of
+    another type is rejected. The browser's content type is not trusted."""
+    f.seek(0)
+    header = f.read(len(OLE2_SIGNATURE))
+    f.seek(0)
+
+    if extension == '.pdf':
+        return header.startswith(b'%PDF-')
+    if extension in ('.doc', '.ppt'):
+        return header == OLE2_SIGNATURE
+    if extension in OOXML_PARTS and header.startswith(ZIP_SIGNATURE):
+        try:
+            with zipfile.ZipFile(f) as archive:
+                return OOXML_PARTS[extension] in archive.namelist()
+        except zipfile.BadZipFile:
+            return False
+        finally:
+            f.seek(0)
+    return False
+
+
+def store_course_file(f, file_name):
+    """Saves a course file under MEDIA_ROOT/class_resources/ and returns the
+    stored name, which is what MyFile.file holds (a suffix is added if the
+    name is taken)."""
+    return default_storage.save(UPLOAD_DIR + os.path.basename(file_name), File(f))
+
+
+def get_chunk_path(upload):
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f'{upload.pk}.part')
+
+
+def write_chunk(upload, offset, stream):
+    """Writes the request body at offset of the partial file and returns the
+    new offset. Writing at a position (not appending) makes a retried chunk
+    harmless. Returns None if the body goes past the announced size."""
+    path = get_chunk_path(upload)
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+        f.seek(offset)
+        while True:
+            chunk = stream.read(64 * 1024)
+            if not chunk:
+                break
+            offset += len(chunk)
+            if offset > upload.size:
+                return None
+            f.write(chunk)
+        f.truncate()
+    return offset
+
+
+def delete_chunks(upload):
+    try:
+        os.remove(get_chunk_path(upload))
+    except FileNotFoundError:
+        pass
@@ -50,6 +50,9 @@ urlpatterns = [
         path('course/add/', teachers.CourseCreateView.as_view(), name='course_add'),
         path('course/<int:pk>/', teachers.CourseUpdateView.as_view(), name='course_change'),
         path('course/<int:pk>/delete/', teachers.delete_course,name='course_delete'),
+        path('course/<int:pk>/clone/', teachers.clone_course, name='course_clone'),
+        path('course/<int:pk>/export/', teachers.export_course, name='course_export'),
+        path('course/<int:pk>/import/', teachers.import_course, name='course_import'),
         path('course/<int:course_pk>/lesson/<int:lesson_pk>/',
              teachers.edit_lesson, name='lesson_edit'),
         path('course/<int:course_pk>/lesson/<int:lesson_pk>/delete/',
@@ -70,6 +73,9 @@ urlpatterns = [
              name='enrollment_reject'),
         path('files/', teachers.FilesListView.as_view(), name='file_list'),
         path('files/add/', teachers.add_files, name='file_add'),
+        path('files/uploads/', teachers.start_upload, name='upload_start'),
+        path('files/uploads/complete/', teachers.complete_uploads, name='upload_complete'),
+        path('files/uploads/<int:upload_pk>/', teachers.upload_chunk, name='upload_chunk'),
         path('files/<int:file_pk>/delete/', teachers.delete_file,
              name='delete_file'),
         path('lesson/', teachers.LessonListView.as_view(), name='lesson_list'),
@@ -77,6 +83,15 @@ urlpatterns = [
         path('lesson/<int:lesson_pk>/delete/', teachers.delete_lesson_from_list,
              name='delete_lesson_from_list'),
         path('profile/', teachers.profile, name='profile'),
+        path('question-bank/', teachers.QuestionBankListView.as_view(), name='question_bank_list'),
+        path('question-bank/add/', teachers.add_question_bank, name='question_bank_add'),
+        path('question-bank/<int:bank_pk>/', teachers.edit_question_bank, name='question_bank_change'),
+        path('question-bank/<int:bank_pk>/delete/', teachers.delete_question_bank, name='question_bank_delete'),
+        path('question-bank/<int:bank_pk>/question/add/', teachers.add_bank_question, name='bank_question_add'),
+        path('question-bank/<int:bank_pk>/question/<int:question_pk>/',
+             teachers.edit_bank_question, name='bank_question_change'),
+        path('question-bank/<int:bank_pk>/question/<int:question_pk>/delete/',
+             teachers.delete_bank_question, name='bank_question_delete'),
         path('quiz/', teachers.QuizListView.as_view(), name='quiz_list'),
         path('quiz/add/', teachers.add_quiz, name='quiz_add'),
         path('quiz/<int:quiz_pk>/delete/', teachers.delete_quiz_from_list,
@@ -84,6 +99,7 @@ urlpatterns = [
         path('quiz/<int:quiz_pk>/delete/', teachers.delete_quiz, name='quiz_delete'),
         path('quiz/<int:pk>/results/', teachers.QuizResultsView.as_view(), name='quiz_results'),
         path('quiz/<int:quiz_pk>/results/<int:student_pk>/taken/<int:taken_pk>',
-             teachers.quiz_result_detail, name='quiz_result_detail')
+             teachers.quiz_result_detail, name='quiz_result_detail'),
+        path('quiz/<int:quiz_pk>/statistics/', teachers.quiz_statistics, name='quiz_statistics')
     ], 'classroom'), namespace='teachers')),
 ]
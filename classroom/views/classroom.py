@@ -1,16 +1,18 @@
 from django.contrib import messages
-from django.contrib.auth import authenticate, login, logout
-from django.core.mail import send_mail
+from django.contrib.auth import login, logout
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.db.models import Count, Q
 from django.shortcuts import get_object_or_404, redirect, render
 from django.views.generic import DetailView
-from random import sample
 from .raw_sql import get_popular_courses
 from .teachers import get_enrollment_requests_count
 from ..forms import ContactUsForm, SearchCourses, UserLoginForm
-from ..models import (Course, Lesson, MyFile, Quiz, Student,
+from ..mail import queue_email
+from ..models import (Course, Lesson, MyFile, Quiz,
                       Subject, TakenQuiz, User, UserLog)
+from ..recommendations import get_recommended_ids
+from ..throttling import throttle
+from ..thumbnails import with_owner
 
 
 def do_paginate(data_list, page_number, results_per_page):
@@ -29,22 +31,14 @@ def do_paginate(data_list, page_number, results_per_page):
     return [ret_data_list, paginator]
 
 
-def get_suggested_courses(page_course_id, current_subject_id=None, subject_interests=None):
-    """Gets the suggested courses.
-    If a student is logged in, suggestions are based on his/her interests.
-    Else, suggestions are based on subject."""
-    course_ids = None
-    if current_subject_id is not None:
-        course_ids = tuple(Course.objects.values_list('id', flat=True)
-                           .filter(subject_id=current_subject_id, status='approved')
-                           .exclude(id=page_course_id))[:3]
-
-    if subject_interests is not None:
-        course_ids = tuple(Course.objects.values_list('id', flat=True)
-                           .filter(subject__in=subject_interests, status='approved')
-                           .exclude(id=page_course_id))[:3]
-
-    return Course.objects.filter(id__in=sample(course_ids, len(course_ids)))
+def get_suggested_courses(course, student_pk=None):
+    """Gets the suggested courses, in their order (see classroom/recommendations.py).
+    If a student is logged in, suggestions are based on his/her courses and interests.
+    Else, suggestions are based on the students who took the course."""
+    course_ids = get_recommended_ids(course, student_pk)
+    courses = with_owner(Course.objects.select_related('subject')
+                         .filter(id__in=course_ids, status='approved')) if course_ids else []
+    return sorted(courses, key=lambda related_course: course_ids.index(related_course.pk))
 
 
 def get_user_type(user):
@@ -67,11 +61,13 @@ class CourseDetailView(DetailView):
         kwargs['title'] = self.get_object()
         kwargs['lessons'] = Lesson.objects.select_related('quizzes') \
             .select_related('course') \
+            .defer('content', 'content_html') \
             .filter(course__id=self.kwargs['pk']) \
             .order_by('number')
         kwargs['quizzes'] = Quiz.objects.filter(course_id=self.kwargs['pk']) \
             .order_by('lesson__number')
-        kwargs['files'] = MyFile.objects.filter(course_id=self.kwargs['pk']) \
+        kwargs['files'] = MyFile.objects.select_related('preview') \
+            .filter(course_id=self.kwargs['pk']) \
             .order_by('file')
 
         if self.request.user.is_authenticated:
@@ -82,22 +78,20 @@ class CourseDetailView(DetailView):
                     .filter(course__id=self.kwargs['pk']).first()
 
                 kwargs['taken_quizzes'] = TakenQuiz.objects \
-                    .filter(student=self.request.user.student, course_id=self.kwargs['pk'])
+                    .filter(student_id=self.request.user.pk, course_id=self.kwargs['pk'])
 
                 taken_quiz_count = TakenQuiz.objects.filter(student_id=self.request.user.pk,
                                                             course_id=self.kwargs['pk']) \
-                    .values_list('id', flat=True).count()
+                    .values_list('quiz_id', flat=True).distinct().count()
                 quiz_count = Quiz.objects.filter(course_id=self.kwargs['pk']) \
                     .values_list('id', flat=True).count()
 
                 kwargs['progress'] = (taken_quiz_count / quiz_count) * 100 if quiz_count != 0 else 0
 
-                subject_interests = Student.objects.values_list('interests').filter(pk=self.request.user)
-                kwargs['related_courses'] = get_suggested_courses(self.kwargs['pk'],
-                                                                  subject_interests=subject_interests)
-
                 kwargs['course'] = get_object_or_404(Course.objects.filter(status='approved'),
                                                      pk=self.kwargs['pk'])
+                kwargs['related_courses'] = get_suggested_courses(kwargs['course'],
+                                                                  student_pk=self.request.user.pk)
 
             elif self.request.user.is_teacher:
                 student = None
@@ -109,17 +103,13 @@ class CourseDetailView(DetailView):
                 kwargs['course'] = get_object_or_404(Course.objects.exclude(status='deleted'),
                                                      pk=self.kwargs['pk'])
 
-                current_subject = kwargs['course'].subject_id
-                kwargs['related_courses'] = get_suggested_courses(self.kwargs['pk'],
-                                                                  current_subject_id=current_subject)
+                kwargs['related_courses'] = get_suggested_courses(kwargs['course'])
 
         else:
             kwargs['course'] = get_object_or_404(Course.objects.filter(status='approved'),
                                                  pk=self.kwargs['pk'])
 
-            current_subject = kwargs['course'].subject_id
-            kwargs['related_courses'] = get_suggested_courses(self.kwargs['pk'],
-                                                              current_subject_id=current_subject)
+            kwargs['related_courses'] = get_suggested_courses(kwargs['course'])
 
         kwargs['enrolled'] = student
         kwargs['owns'] = True if teacher else None
@@ -157,7 +147,7 @@ def browse_courses(request):
 
     query = None
     subjects = Subject.objects.all()
-    courses = Course.objects.filter(status__iexact='approved') \
+    courses = with_owner(Course.objects.filter(status__iexact='approved')) \
         .annotate(taken_count=Count('taken_courses',
                                     filter=Q(taken_courses__status='enrolled'),
                                     distinct=True)) \
@@ -173,9 +163,9 @@ def browse_courses(request):
         form = SearchCourses(request.GET)
         if form.is_valid():
             query = form.cleaned_data.get('search')
-            courses = Course.objects.filter(Q(title__icontains=query) |
-                                            Q(code__icontains=query) |
-                                            Q(description__icontains=query)) \
+            courses = with_owner(Course.objects.filter(Q(title__icontains=query) |
+                                                       Q(code__icontains=query) |
+                                                       Q(description__icontains=query))) \
                 .filter(status__iexact='approved') \
                 .annotate(taken_count=Count('taken_courses',
                                             filter=Q(taken_courses__status='enrolled'),
@@ -213,7 +203,7 @@ def browse_courses_subject(request, subject_pk):
     else:
         enrollment_requests_count = None
 
-    courses = Course.objects.filter(status__iexact='approved', subject_id=subject_pk) \
+    courses = with_owner(Course.objects.filter(status__iexact='approved', subject_id=subject_pk)) \
         .annotate(taken_count=Count('taken_courses',
                                     filter=Q(taken_courses__status='enrolled'),
                                     distinct=True)) \
@@ -232,9 +222,9 @@ def browse_courses_subject(request, subject_pk):
         form = SearchCourses(request.GET)
         if form.is_valid():
             query = form.cleaned_data.get('search')
-            courses = Course.objects.filter(Q(title__icontains=query) |
-                                            Q(code__icontains=query) |
-                                            Q(description__icontains=query)) \
+            courses = with_owner(Course.objects.filter(Q(title__icontains=query) |
+                                                       Q(code__icontains=query) |
+                                                       Q(description__icontains=query))) \
                 .filter(status__iexact='approved') \
                 .annotate(taken_count=Count('taken_courses',
                                             filter=Q(taken_courses__status='enrolled'),
@@ -266,6 +256,7 @@ def browse_courses_subject(request, subject_pk):
     return render(request, 'classroom/students/courses_list_subject.html', context)
 
 
+@throttle('contact_us', fields=('email',))
 def contact_us(request):
     form = None
     if request.user.is_authenticated:
@@ -288,17 +279,12 @@ def contact_us(request):
                 if cc_myself:
                     recipients.append(sender)
 
-                try:
-                    send_mail(subject, message, sender, recipients)
-
-                    messages.success(request, 'You successfully sent an email to us. '
-                                              'Please wait for a response in your email, thank you.')
+                queue_email(subject, message, recipients, from_email=sender)
 
-                    return redirect('contact_us')
-                except Exception:
-                    messages.error(request, 'An unexpected error has occurred. Please try again.')
+                messages.success(request, 'You successfully sent an email to us. '
+                                          'Please wait for a response in your email, thank you.')
 
-                    return redirect('contact_us')
+                return redirect('contact_us')
         else:
             form = ContactUsForm()
 
@@ -322,18 +308,16 @@ def home(request):
         return render(request, 'classroom/home.html', context)
 
 
+@throttle('login', fields=('username',))
 def login_view(request):
     next_link = request.GET.get('next')
-    form = UserLoginForm(request.POST or None)
+    form = UserLoginForm(request.POST or None, request=request)
 
     if request.user.is_authenticated:
         return redirect('home')
     else:
         if form.is_valid():
-            username = form.cleaned_data.get('username')
-            password = form.cleaned_data.get('password')
-            user = authenticate(username=username, password=password)
-            login(request, user)
+            login(request, form.get_user())
 
             if next_link:
                 return redirect(next_link)
@@ -11,6 +11,7 @@ from .raw_sql import get_popular_courses
 from ..decorators import staff_required, superuser_required
 from ..forms import AdminAddForm, SubjectUpdateForm, UserUpdateForm
 from ..models import Course, Quiz, Subject, User, UserLog
+from ..thumbnails import with_owner
 
 
 @method_decorator([login_required, superuser_required], name='dispatch')
@@ -87,7 +88,7 @@ class CourseListView(ListView):
 
     def get_queryset(self):
         """Gets all the approved courses."""
-        return Course.objects.filter(status__iexact='approved') \
+        return with_owner(Course.objects.filter(status__iexact='approved')) \
             .order_by('title')
 
 
@@ -108,7 +109,7 @@ class CourseRequestsView(ListView):
 
     def get_queryset(self):
         """Gets all the courses that have pending as their status."""
-        return Course.objects.filter(status__iexact='pending') \
+        return with_owner(Course.objects.filter(status__iexact='pending')) \
             .order_by('-updated_at')
 
 
@@ -1,28 +1,54 @@
+from datetime import timedelta
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import PasswordChangeView
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.mail import EmailMessage
-from django.db import transaction
-from django.db.models import Avg
-from django.http import FileResponse, Http404
+from django.db import IntegrityError, transaction
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.template.loader import render_to_string
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
 from django.utils.decorators import method_decorator
 from django.utils.encoding import force_bytes, force_text
-from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from django.utils.http import quote_etag, urlsafe_base64_encode, urlsafe_base64_decode
 from django.views.generic import ListView, UpdateView
-from os.path import splitext
-from .raw_sql import get_taken_quiz
 from ..decorators import student_required
+from ..files import (get_accessible_file, get_signed_url, has_course_access,
+                     is_valid_signature, serve_file)
 from ..forms import (StudentInterestsForm, StudentProfileForm,
                      StudentSignUpForm, TakeQuizForm, UserUpdateForm)
-from ..models import (Answer, Course, Lesson, MyFile, Quiz, Question,
-                      Student, StudentAnswer, TakenCourse, TakenQuiz,
-                      User, UserLog)
+from ..images import generate_variants_later
+from ..lessons import get_lesson_html, get_lesson_ids, invalidate_lesson_ids
+from ..mail import queue_email
+from ..models import (Course, Lesson, Quiz, QuizAttempt, Question,
+                      Student, TakenCourse, TakenQuiz, User, UserLog)
+from ..offline import get_offline_bundle
+from ..quizzes import (clear_deadline, draw_questions, get_average_grade, get_quiz_result, grade_attempts,
+                       is_expired, is_past_deadline, join_ids, save_answers, set_deadline, split_ids,
+                       update_finished_courses)
+from ..throttling import throttle
+from ..thumbnails import warm_thumbnails_later, with_owner
 from ..tokens import account_activation_token
+import gzip
+import os
+
+
+def get_or_create_enrollment(student_id, course_id):
+    """Inserts a pending enrollment request in a single statement.
+    Returns None if the request was created, or the status of the existing
+    enrollment if the student already has one (double-clicks, retries)."""
+    try:
+        with transaction.atomic():
+            TakenCourse.objects.create(student_id=student_id, course_id=course_id)
+        return None
+    except IntegrityError:
+        # The unique constraint on (student, course) rejected the duplicate:
+        return TakenCourse.objects.values_list('status', flat=True) \
+            .get(student_id=student_id, course_id=course_id)
 
 
 @method_decorator([login_required, student_required], name='dispatch')
@@ -47,16 +73,39 @@ class LessonListView(ListView):
     paginate_by = 1
 
     def get_queryset(self, **kwargs):
-        return Lesson.objects.select_related('quizzes') \
-            .select_related('course') \
-            .filter(course__id=self.kwargs['pk']) \
-            .order_by('number')
+        """The cached ids of the lessons, paginated in memory, only the lesson
+        of the page is fetched (see get_context_data)."""
+        return get_lesson_ids(self.kwargs['pk'])
+
+    def get_lessons(self, lesson_ids):
+        # The content is served from the cache (see get_lesson_html):
+        lessons = list(Lesson.objects.select_related('quizzes')
+                       .select_related('course')
+                       .defer('content', 'content_html')
+                       .filter(id__in=lesson_ids, course_id=self.kwargs['pk']))
+        for lesson in lessons:
+            lesson.html = get_lesson_html(lesson)
+        return lessons
 
     def get_context_data(self, **kwargs):
-        course = Course.objects.values('id', 'title').get(id=self.kwargs['pk'])
-        kwargs['title'] = f"{course['title']} Lessons"
-
-        return super().get_context_data(**kwargs)
+        context = super().get_context_data(**kwargs)
+        context['lessons'] = self.get_lessons(context['lessons'])
+
+        if not context['lessons'] and context['object_list']:
+            # The lesson was deleted without going through the views, paginate the fresh ids
+            # (a 404 only if the page is out of range now):
+            invalidate_lesson_ids(self.kwargs['pk'])
+            paginator, page, lesson_ids, is_paginated = self.paginate_queryset(get_lesson_ids(self.kwargs['pk']),
+                                                                               self.paginate_by)
+            context.update(paginator=paginator, page_obj=page, is_paginated=is_paginated, object_list=lesson_ids,
+                           lessons=self.get_lessons(lesson_ids))
+
+        if context['lessons']:
+            course_title = context['lessons'][0].course.title
+        else:
+            course_title = get_object_or_404(Course.objects.values_list('title', flat=True), id=self.kwargs['pk'])
+        context['title'] = f"{course_title} Lessons"
+        return context
 
 
 @method_decorator([login_required, student_required], name='dispatch')
@@ -70,7 +119,7 @@ class MyCoursesListView(ListView):
     template_name = 'classroom/students/mycourses_list.html'
 
     def get_queryset(self):
-        queryset = self.request.user.student.taken_courses \
+        queryset = with_owner(self.request.user.student.taken_courses, path='course__owner') \
             .select_related('course', 'course__subject') \
             .filter(status__in=['enrolled', 'pending', 'finished']) \
             .filter(course__status='approved') \
@@ -109,7 +158,8 @@ class TakenQuizListView(ListView):
     paginate_by = 10
 
     def get_context_data(self, **kwargs):
-        kwargs['grade'] = TakenQuiz.objects.filter(student_id=self.request.user.pk).aggregate(average=Avg('score'))
+        # The grade of each quiz follows its score policy when it was taken more than once:
+        kwargs['grade'] = {'average': get_average_grade(TakenQuiz.objects.filter(student_id=self.request.user.pk))}
 
         return super().get_context_data(**kwargs)
 
@@ -151,14 +201,19 @@ def activate(request, uidb64, token):
 @student_required
 def enroll(request, pk):
     course = get_object_or_404(Course, pk=pk)
-    student = request.user.student
-    take = TakenCourse.objects.create(student=student, course=course)
-    take.save()
-    UserLog.objects.create(action=f'Sent enrollment request for: {course.title}',
-                           user_type='student',
-                           user=request.user)
+    status = get_or_create_enrollment(request.user.pk, course.pk)
+
+    if status is None:
+        UserLog.objects.create(action=f'Sent enrollment request for: {course.title}',
+                               user_type='student',
+                               user=request.user)
+
+        messages.info(request, 'You have successfully sent an enrollment request to the teacher in charge.')
+    elif status == 'pending':
+        messages.info(request, 'You have already sent an enrollment request for this course.')
+    else:
+        messages.info(request, 'You are already enrolled in this course.')
 
-    messages.info(request, 'You have successfully sent an enrollment request to the teacher in charge.')
     return redirect('course_details', pk)
 
 
@@ -179,23 +234,70 @@ def unenroll(request, pk):
 
 @login_required
 def file_view(request, pk):
-    file = get_object_or_404(MyFile, pk=pk)
-    file_path = str(file.file)
-    file_type = ''
+    """Only the owner of the course and its enrolled students get the file."""
+    file = get_accessible_file(request.user, pk)
+    if file is None:
+        raise Http404()
 
-    try:
-        # Get the file extension:
-        extension = splitext(file_path[16:])[1]
-        if extension == '.pdf':
-            file_type = 'application/pdf'
+    if settings.FILE_DELIVERY == 'signed-url':
+        # The web server checks the signature and sends the file:
+        return redirect(get_signed_url(file.file))
+
+    return serve_file(request, file.file)
+
+
+def signed_file_view(request, name):
+    """Serves the signed file URLs when the web server does not (e.g. runserver)."""
+    uri = request.path
+    if not is_valid_signature(uri, request.GET.get('md5', ''), request.GET.get('expires')):
+        return HttpResponseForbidden()
+
+    return serve_file(request, name)
+
+
+@login_required
+def offline_manifest(request, pk):
+    """Tells a service worker which offline bundle of the course is current.
+    The bundle URL contains the version, so the bundle can be cached until
+    the manifest gives another one."""
+    bundle = get_offline_bundle(pk) if has_course_access(request.user, pk) else None
+    if bundle is None:
+        raise Http404()
+
+    version, path = bundle
+    response = JsonResponse({
+        'course': pk,
+        'version': version,
+        'url': reverse('offline_bundle', args=[pk, version]),
+        'size': os.path.getsize(path),
+    })
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
-        response = FileResponse(open(f'media/{file_path}', 'rb'), content_type=file_type)
-        response['Content-Disposition'] = f'filename={file_path[16:]}'
 
-        return response
-    except FileNotFoundError:
+@login_required
+def offline_bundle(request, pk, version):
+    """The lessons of a course (processed HTML with inlined images) and its
+    details in one gzipped JSON document, see classroom/offline.py."""
+    bundle = get_offline_bundle(pk) if has_course_access(request.user, pk) else None
+    if bundle is None or bundle[0] != version:
         raise Http404()
 
+    etag = quote_etag(version)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    accepts_gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    with (open if accepts_gzip else gzip.open)(bundle[1], 'rb') as f:
+        response = HttpResponse(f.read(), content_type='application/json')
+    if accepts_gzip:
+        response['Content-Encoding'] = 'gzip'
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
 
 @login_required
 @student_required
@@ -207,6 +309,9 @@ def profile(request):
         if user_update_form.is_valid() and profile_form.is_valid():
             user_update_form.save()
             profile_form.save()
+            if 'image' in profile_form.changed_data:
+                generate_variants_later(request.user.student.image, 'avatar')
+                warm_thumbnails_later(request.user.student.image)
 
             UserLog.objects.create(action='Updated Student Profile',
                                    user_type='student',
@@ -228,6 +333,7 @@ def profile(request):
     return render(request, 'classroom/profile.html', context)
 
 
+@throttle('register', fields=('username', 'email'))
 def register(request):
     if request.user.is_authenticated:
         return redirect('home')
@@ -251,22 +357,13 @@ def register(request):
                 })
 
                 to_email = form.cleaned_data.get('email')
-                email = EmailMessage(mail_subject, message, to=[to_email])
-                try:
-                    email.send()
-                    context = {
-                        'title': 'Account Activation',
-                        'result': 'One more step remaining...',
-                        'message': 'Please confirm your email address to complete the registration.',
-                        'alert': 'info'
-                    }
-                except Exception:
-                    context = {
-                        'title': 'Account Activation',
-                        'result': 'Warning!',
-                        'message': 'We\'re sorry, an error has occurred during activation. Please try again.',
-                        'alert': 'danger'
-                    }
+                queue_email(mail_subject, message, [to_email])
+                context = {
+                    'title': 'Account Activation',
+                    'result': 'One more step remaining...',
+                    'message': 'Please confirm your email address to complete the registration.',
+                    'alert': 'info'
+                }
 
                 return render(request, 'authentication/activation.html', context)
         else:
@@ -280,27 +377,83 @@ def register(request):
     return render(request, 'authentication/register_form.html', context)
 
 
+def finish_quiz(request, quiz, attempt, timed_out=False):
+    """Grades an attempt in one query and replaces it with a TakenQuiz."""
+    clear_deadline(request.session, quiz.pk)
+    with transaction.atomic():
+        # Only one of two requests (or the finalize_quiz_attempts command) gets to delete the attempt:
+        deleted, _ = QuizAttempt.objects.filter(pk=attempt.pk).delete()
+        if not deleted:
+            return redirect('course_details', attempt.course_id)
+        taken_quizzes, answer_ids = grade_attempts([attempt])
+        taken_quiz = taken_quizzes[0]
+        taken_quiz.save()
+        save_answers(answer_ids)
+
+        UserLog.objects.create(action=f'Took the quiz: {quiz.title}',
+                               user_type='student',
+                               user=request.user)
+
+    if timed_out:
+        messages.error(request, f'The time for the quiz { quiz.title } is up! The unanswered questions '
+                                f'count as wrong. Your grade is { taken_quiz.score }%.')
+    else:
+        messages.success(request, f'Congratulations! You completed the '
+                                  f'quiz { quiz.title }! Your grade is { taken_quiz.score }%.')
+
+    update_finished_courses({(attempt.student_id, attempt.course_id)})
+
+    return redirect('course_details', attempt.course_id)
+
+
 @login_required
 @student_required
 def take_quiz(request, course_pk, quiz_pk):
+    if request.method == 'POST' and is_past_deadline(request.session, quiz_pk):
+        # Rejected before any query, the redirect finishes the attempt:
+        return redirect('students:take_quiz', course_pk, quiz_pk)
+
     course = get_object_or_404(Course, pk=course_pk)
     quiz = get_object_or_404(Quiz, pk=quiz_pk)
     student = request.user.student
 
-    if student.quizzes.filter(pk=quiz_pk).exists():
-        messages.error(request, 'We\'re sorry, you already took that quiz! '
-                                'You may see the result in your quizzes page.')
-        return redirect('course_details', course_pk)
-
-    total_questions = quiz.questions.count()
-    if total_questions == 0:
-        messages.error(request, 'We\'re sorry, there are currently no questions available for that quiz.')
-        return redirect('course_details', course_pk)
-
-    unanswered_questions = student.get_unanswered_questions(quiz)
-    total_unanswered_questions = unanswered_questions.count()
-    progress = 100 - round(((total_unanswered_questions - 1) / total_questions) * 100)
-    question = unanswered_questions.first()
+    attempt = QuizAttempt.objects.filter(student=student, quiz=quiz).first()
+    if attempt is None:
+        clear_deadline(request.session, quiz_pk)
+        taken_count = TakenQuiz.objects.filter(student=student, quiz=quiz).count()
+        if quiz.max_attempts and taken_count >= quiz.max_attempts:
+            times = f' {taken_count} times' if taken_count > 1 else ''
+            messages.error(request, f'We\'re sorry, you already took that quiz{times}! '
+                                    f'You may see the result in your quizzes page.')
+            return redirect('course_details', course_pk)
+
+        question_ids = draw_questions(quiz)
+        if not question_ids:
+            messages.error(request, 'We\'re sorry, there are currently no questions available for that quiz.')
+            return redirect('course_details', course_pk)
+        deadline = timezone.now() + timedelta(minutes=quiz.time_limit) if quiz.time_limit else None
+        attempt, _ = QuizAttempt.objects.get_or_create(student=student, quiz=quiz,
+                                                       defaults={'course': course,
+                                                                 'question_ids': join_ids(question_ids),
+                                                                 'deadline': deadline})
+
+    if attempt.deadline is None:
+        clear_deadline(request.session, quiz_pk)
+    elif is_expired(attempt):
+        return finish_quiz(request, quiz, attempt, timed_out=True)
+    else:
+        set_deadline(request.session, attempt)
+
+    question_ids = split_ids(attempt.question_ids)
+    total_questions = len(question_ids)
+    unanswered_questions = student.get_unanswered_questions(quiz, question_ids)
+    questions = Question.objects.in_bulk(unanswered_questions)
+    # The questions that the teacher deleted in the meantime are skipped:
+    unanswered_questions = [pk for pk in unanswered_questions if pk in questions]
+    if not unanswered_questions:
+        return finish_quiz(request, quiz, attempt)
+    question = questions[unanswered_questions[0]]
+    progress = 100 - round(((len(unanswered_questions) - 1) / total_questions) * 100)
 
     if request.method == 'POST':
         form = TakeQuizForm(question=question, data=request.POST)
@@ -308,34 +461,12 @@ def take_quiz(request, course_pk, quiz_pk):
             with transaction.atomic():
                 student_answer = form.save(commit=False)
                 student_answer.student = student
+                student_answer.quiz = quiz
                 student_answer.save()
-                if student.get_unanswered_questions(quiz).exists():
+                if len(unanswered_questions) > 1:
                     return redirect('students:take_quiz', course_pk, quiz_pk)
                 else:
-                    correct_answers = student.quiz_answers.filter(answer__question__quiz=quiz,
-                                                                  answer__is_correct=True).count()
-                    score = round((correct_answers / total_questions) * 100.0, 2)
-                    TakenQuiz.objects.create(student=student, quiz=quiz, course=course,
-                                             score=score)
-
-                    UserLog.objects.create(action=f'Took the quiz: {quiz.title}',
-                                           user_type='student',
-                                           user=request.user)
-
-                    messages.success(request, f'Congratulations! You completed the '
-                                              f'quiz { quiz.title }! Your grade is { score }%.')
-
-                    # Count the taken quizzes and quizzes:
-                    taken_quiz_count = TakenQuiz.objects.filter(student_id=request.user.pk, course=course) \
-                        .values_list('id', flat=True).count()
-                    quiz_count = Quiz.objects.filter(course_id=course_pk) \
-                        .values_list('id', flat=True).count()
-
-                    # Check if the taken quizzes and quizzes have equal count:
-                    if taken_quiz_count == quiz_count:
-                        TakenCourse.objects.filter(course_id=course_pk, student_id=request.user.pk).update(status='finished')
-
-                    return redirect('course_details', course_pk)
+                    return finish_quiz(request, quiz, attempt)
     else:
         form = TakeQuizForm(question=question)
 
@@ -343,7 +474,9 @@ def take_quiz(request, course_pk, quiz_pk):
         'quiz': quiz,
         'question': question,
         'form': form,
-        'progress': progress
+        'progress': progress,
+        'deadline': attempt.deadline,
+        'deadline_grace': settings.QUIZ_DEADLINE_GRACE
     }
 
     return render(request, 'classroom/students/take_quiz_form.html', context)
@@ -352,25 +485,13 @@ def take_quiz(request, course_pk, quiz_pk):
 @login_required
 @student_required
 def taken_quiz_result(request, taken_pk, quiz_pk):
-    quiz = get_object_or_404(Quiz, pk=quiz_pk)
-    questions = Question.objects.filter(quiz=quiz)
-    taken_quiz = get_object_or_404(TakenQuiz, pk=taken_pk, quiz=quiz, student_id=request.user.pk)
-
-    student_answers = StudentAnswer.objects\
-        .raw(get_taken_quiz(request.user.pk, taken_quiz.pk))
-
-    taken_quiz = TakenQuiz.objects \
-        .select_related('quiz') \
-        .filter(student=request.user.student, id=taken_quiz.pk, quiz=quiz) \
-        .first()
-
-    answers = Answer.objects.filter(question__in=questions)
+    taken_quiz = get_object_or_404(TakenQuiz.objects.select_related('quiz'),
+                                   pk=taken_pk, quiz_id=quiz_pk, student_id=request.user.pk)
 
     context = {
         'title': 'Quiz Result',
-        'student_answers': student_answers,
+        'questions': get_quiz_result(taken_quiz),
         'taken_quiz': taken_quiz,
-        'answers': answers,
         'ownership': 'Your'
     }
 
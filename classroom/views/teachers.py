@@ -1,32 +1,58 @@
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import PasswordChangeView
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.mail import EmailMessage
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
 from django.db import transaction
-from django.db.models import Avg, Count, Q
+from django.db.models import Count, Q
 from django.forms import inlineformset_factory
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.template.loader import render_to_string
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.utils.decorators import method_decorator
 from django.utils.encoding import force_bytes, force_text
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from django.views.decorators.http import require_POST
 from django.views.generic import (CreateView, DetailView, ListView,
                                   UpdateView)
-from .raw_sql import get_taken_quiz
 from ..decorators import teacher_required
-from ..forms import (BaseAnswerInlineFormSet, CourseAddForm, FileAddForm,
-                     LessonAddForm, LessonEditForm, QuizAddForm, QuizEditForm,
-                     QuestionForm, TeacherProfileForm, TeacherSignUpForm,
+from ..forms import (BankQuestionForm, BaseAnswerInlineFormSet, CourseAddForm, CourseCloneForm, CourseImportForm,
+                     FileAddForm, LessonAddForm, LessonEditForm, QuizAddForm, QuizEditForm,
+                     QuestionBankForm, QuestionForm, TeacherProfileForm, TeacherSignUpForm,
                      UserUpdateForm)
-from ..models import (Answer, Course, MyFile, Lesson, Question, Quiz,
-                      StudentAnswer, TakenCourse, TakenQuiz, User, UserLog)
+from ..files import get_content_disposition
+from ..images import generate_variants_later
+from ..lessons import invalidate_lesson_ids
+from ..mail import queue_email
+from ..models import (Answer, ChunkedUpload, Course, MyFile, Lesson, Question, QuestionBank, Quiz,
+                      TakenCourse, TakenQuiz, User, UserLog)
+from ..packages import (copy_course, import_package, iter_course_json, iter_course_zip,
+                        read_package, validate_package)
+from ..previews import delete_preview, generate_previews_later
+from ..quizzes import get_average_grade, get_quiz_result, get_quiz_statistics, invalidate_bank_question_ids
+from ..throttling import throttle
+from ..thumbnails import warm_thumbnails_later
 from ..tokens import account_activation_token
+from ..uploads import (delete_chunks, get_chunk_path, get_extension, is_allowed_file_name,
+                       matches_extension, store_course_file, write_chunk)
 from star_ratings.models import Rating
 import os
 
+AnswerFormSet = inlineformset_factory(
+    Question,  # parent model
+    Answer,  # base model
+    formset=BaseAnswerInlineFormSet,
+    fields=('text', 'is_correct'),
+    min_num=2,
+    validate_min=True,
+    max_num=10,
+    validate_max=True
+)
+
 
 def get_enrollment_requests_count(user):
     owned_courses = Course.objects.values_list('id', flat=True) \
@@ -69,6 +95,7 @@ class CourseCreateView(CreateView):
         course = form.save(commit=False)
         course.owner = self.request.user
         course.save()
+        generate_variants_later(course.image, 'course')
         Rating.objects.create(count=0, total=0, average=0, object_id=course.pk, content_type_id=15)
 
         UserLog.objects.create(action=f'Created the course: {course.title}',
@@ -124,6 +151,8 @@ class CourseUpdateView(UpdateView):
         course = form.save(commit=False)
         course.status = 'pending'
         course.save()
+        if 'image' in form.changed_data:
+            generate_variants_later(course.image, 'course')
 
         UserLog.objects.create(action=f'Edited the course: {course.title}',
                                user_type='teacher',
@@ -208,9 +237,34 @@ class LessonListView(ListView):
         """Gets the lesson that the user owns through course FK."""
         return Lesson.objects.filter(course__in=self.request.user.courses.all()) \
             .exclude(course__status='deleted') \
+            .defer('content', 'content_html') \
             .order_by('-id')
 
 
+@method_decorator([login_required, teacher_required], name='dispatch')
+class QuestionBankListView(ListView):
+    model = QuestionBank
+    context_object_name = 'question_banks'
+    extra_context = {
+        'title': 'Question Banks'
+    }
+    template_name = 'classroom/teachers/question_bank_list.html'
+    paginate_by = 10
+
+    def get_context_data(self, **kwargs):
+        """enrollment_request_count is used for base.html's navbar."""
+        kwargs['enrollment_request_count'] = get_enrollment_requests_count(self.request.user)
+
+        return super().get_context_data(**kwargs)
+
+    def get_queryset(self):
+        return self.request.user.question_banks \
+            .select_related('subject') \
+            .annotate(questions_count=Count('questions', distinct=True)) \
+            .annotate(quizzes_count=Count('quizzes', distinct=True)) \
+            .order_by('name')
+
+
 @method_decorator([login_required, teacher_required], name='dispatch')
 class QuizListView(ListView):
     model = Quiz
@@ -233,7 +287,7 @@ class QuizListView(ListView):
         queryset = Quiz.objects.filter(course__owner=self.request.user) \
             .exclude(course__status='deleted') \
             .annotate(questions_count=Count('questions', distinct=True)) \
-            .annotate(taken_count=Count('taken_quizzes', distinct=True)) \
+            .annotate(taken_count=Count('taken_quizzes__student', distinct=True)) \
             .order_by('-id')
         return queryset
 
@@ -250,8 +304,9 @@ class QuizResultsView(DetailView):
     def get_context_data(self, **kwargs):
         quiz = self.get_object()
         taken_quizzes = quiz.taken_quizzes.select_related('student__user').order_by('-date')
-        total_taken_quizzes = taken_quizzes.count()
-        quiz_score = quiz.taken_quizzes.aggregate(average_score=Avg('score'))
+        total_taken_quizzes = taken_quizzes.values('student').distinct().count()
+        # The average of the students' grades, by the score policy of the quiz:
+        quiz_score = {'average_score': get_average_grade(quiz.taken_quizzes.all())}
         extra_context = {
             'taken_quizzes': taken_quizzes,
             'total_taken_quizzes': total_taken_quizzes,
@@ -323,34 +378,44 @@ def activate(request, uidb64, token):
     return render(request, 'authentication/activation.html', context)
 
 
+def save_course_files(request, course, files):
+    """Stores the uploaded files whose content matches their extension and
+    creates their MyFile rows in one query. Returns the rejected file names."""
+    my_files = []
+    rejected = []
+    for f, file_name in files:
+        if is_allowed_file_name(file_name) and matches_extension(f, get_extension(file_name)):
+            my_files.append(MyFile(file=store_course_file(f, file_name), course=course, owner=request.user))
+        else:
+            rejected.append(file_name)
+
+    if my_files:
+        MyFile.objects.bulk_create(my_files)
+        # bulk_create does not set the primary keys on every database:
+        generate_previews_later(MyFile.objects.filter(course=course, file__in=[f.file for f in my_files])
+                                .only('id', 'file'))
+        UserLog.objects.create(action='Uploaded file/s',
+                               user_type='teacher',
+                               user=request.user)
+        messages.success(request, 'The files were successfully uploaded.')
+    if rejected:
+        messages.error(request, f'{", ".join(rejected)}: only valid .pdf, .doc, .docx, .ppt, '
+                                f'and .pptx files are allowed.')
+    return rejected
+
+
 @login_required
 @teacher_required
 def add_files(request):
     if request.method == 'POST':
         form = FileAddForm(request.user, data=request.POST, files=request.FILES)
-        success = None
         if form.is_valid():
-            for file in request.FILES.getlist('file'):
-                extension = os.path.splitext(str(request.FILES['file']))[1]
-                # Check the file extensions:
-                if extension == '.pdf'or \
-                        extension == '.doc' or \
-                        extension == '.docx' or \
-                        extension == '.ppt' or \
-                        extension == '.pptx':
-
-                    # For every file selected in the upload, create a record in File table:
-                    MyFile.objects.create(file=file, course=form.cleaned_data['course'], owner=request.user)
-                    success = True
-
-            if success:
-                UserLog.objects.create(action='Uploaded file/s',
-                                       user_type='teacher',
-                                       user=request.user)
-                messages.success(request, 'The files were successfully uploaded.')
+            files = [(f, f.name) for f in request.FILES.getlist('file')]
+            rejected = save_course_files(request, form.cleaned_data['course'], files)
+
+            if len(rejected) < len(files):
                 return redirect('teachers:file_list')
             else:
-                messages.error(request, 'The only allowed file formats are .pdf, .doc, .docx, .ppt, and .pptx.')
                 return redirect('teachers:file_add')
 
         else:
@@ -364,11 +429,95 @@ def add_files(request):
     context = {
         'form': form,
         'title': 'Add Files',
+        'chunk_size': settings.CHUNKED_UPLOAD_CHUNK_SIZE,
         'enrollment_request_count': get_enrollment_requests_count(request.user)
     }
     return render(request, 'classroom/teachers/file_add_form.html', context)
 
 
+@login_required
+@teacher_required
+@require_POST
+def start_upload(request):
+    """Starts a chunked upload (used by file_add_form.html), the chunks are
+    then sent to upload_chunk."""
+    course = get_object_or_404(request.user.courses.exclude(status='deleted'), pk=request.POST.get('course'))
+    file_name = os.path.basename(request.POST.get('file_name', ''))
+    try:
+        size = int(request.POST.get('size'))
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid file size.'}, status=400)
+
+    if not is_allowed_file_name(file_name):
+        return JsonResponse({'error': f'{file_name}: the only allowed file formats are '
+                                      f'.pdf, .doc, .docx, .ppt, and .pptx.'}, status=400)
+    if len(file_name) > ChunkedUpload._meta.get_field('file_name').max_length:
+        return JsonResponse({'error': f'{file_name}: the file name is too long.'}, status=400)
+    if not 0 < size <= settings.COURSE_FILE_MAX_SIZE:
+        return JsonResponse({'error': f'{file_name}: the file is empty or too big.'}, status=400)
+
+    upload = ChunkedUpload.objects.create(file_name=file_name, size=size, course=course, owner=request.user)
+
+    return JsonResponse({'id': upload.pk, 'offset': 0})
+
+
+@login_required
+@teacher_required
+def upload_chunk(request, upload_pk):
+    """GET returns the offset to resume from. POST appends the raw request
+    body at the ?offset= position, which must be the current offset."""
+    upload = get_object_or_404(ChunkedUpload, pk=upload_pk, owner=request.user)
+
+    if request.method == 'POST':
+        try:
+            offset = int(request.GET.get('offset'))
+        except (TypeError, ValueError):
+            offset = None
+        if offset != upload.offset:
+            # e.g. the response of the previous chunk was lost, the client resumes from here:
+            return JsonResponse({'offset': upload.offset}, status=409)
+
+        new_offset = write_chunk(upload, offset, request)
+        if new_offset is None:
+            return JsonResponse({'error': 'The chunk goes past the end of the file.'}, status=400)
+
+        ChunkedUpload.objects.filter(pk=upload.pk).update(offset=new_offset)
+        upload.offset = new_offset
+
+    return JsonResponse({'offset': upload.offset, 'size': upload.size})
+
+
+@login_required
+@teacher_required
+@require_POST
+def complete_uploads(request):
+    """Moves the finished chunked uploads into MEDIA_ROOT and creates their
+    MyFile rows at once."""
+    uploads = ChunkedUpload.objects.select_related('course') \
+        .filter(pk__in=request.POST.getlist('uploads'), owner=request.user)
+
+    files_by_course = {}
+    finished = []
+    for upload in uploads:
+        if upload.offset == upload.size:
+            finished.append(upload)
+            files_by_course.setdefault(upload.course, []).append(upload)
+
+    for course, course_uploads in files_by_course.items():
+        opened = [open(get_chunk_path(upload), 'rb') for upload in course_uploads]
+        try:
+            save_course_files(request, course, zip(opened, [upload.file_name for upload in course_uploads]))
+        finally:
+            for f in opened:
+                f.close()
+
+    for upload in finished:
+        delete_chunks(upload)
+    ChunkedUpload.objects.filter(pk__in=[upload.pk for upload in finished]).delete()
+
+    return JsonResponse({'redirect': reverse('teachers:file_list')})
+
+
 @login_required
 @teacher_required
 def add_lesson(request):
@@ -424,6 +573,64 @@ def add_question(request, course_pk, quiz_pk):
     return render(request, 'classroom/teachers/question_add_form.html', context)
 
 
+@login_required
+@teacher_required
+def add_bank_question(request, bank_pk):
+    bank = get_object_or_404(QuestionBank, pk=bank_pk, owner=request.user)
+
+    if request.method == 'POST':
+        form = BankQuestionForm(request.POST)
+        if form.is_valid():
+            with transaction.atomic():
+                question = form.save(commit=False)
+                question.bank = bank
+                question.save()
+                form.save_tags(question)
+            invalidate_bank_question_ids(bank.pk)
+
+            UserLog.objects.create(action=f'Added question for the question bank: {bank.name}',
+                                   user_type='teacher',
+                                   user=request.user)
+            messages.success(request, 'You may now add answers/options to the question.')
+            return redirect('teachers:bank_question_change', bank.pk, question.pk)
+    else:
+        form = BankQuestionForm()
+
+    context = {
+        'title': 'Add question',
+        'bank': bank,
+        'form': form,
+        'enrollment_request_count': get_enrollment_requests_count(request.user)
+    }
+    return render(request, 'classroom/teachers/bank_question_add_form.html', context)
+
+
+@login_required
+@teacher_required
+def add_question_bank(request):
+    if request.method == 'POST':
+        form = QuestionBankForm(request.POST)
+        if form.is_valid():
+            bank = form.save(commit=False)
+            bank.owner = request.user
+            bank.save()
+
+            UserLog.objects.create(action=f'Created question bank: {bank.name}',
+                                   user_type='teacher',
+                                   user=request.user)
+            messages.success(request, 'The question bank was successfully created. You may now add some questions.')
+            return redirect('teachers:question_bank_change', bank.pk)
+    else:
+        form = QuestionBankForm()
+
+    context = {
+        'form': form,
+        'title': 'Add a Question Bank',
+        'enrollment_request_count': get_enrollment_requests_count(request.user)
+    }
+    return render(request, 'classroom/teachers/question_bank_add_form.html', context)
+
+
 @login_required
 @teacher_required
 def add_quiz(request):
@@ -449,6 +656,88 @@ def add_quiz(request):
     return render(request, 'classroom/teachers/quiz_add_form.html', context)
 
 
+@login_required
+@teacher_required
+def clone_course(request, pk):
+    """Copies the course, e.g. for a new term, without its students."""
+    course = get_object_or_404(Course.objects.exclude(status='deleted'), pk=pk, owner=request.user)
+
+    if request.method == 'POST':
+        form = CourseCloneForm(request.POST)
+        if form.is_valid():
+            clone = copy_course(course, form.cleaned_data['title'], form.cleaned_data['code'])
+            Rating.objects.create(count=0, total=0, average=0, object_id=clone.pk, content_type_id=15)
+
+            UserLog.objects.create(action=f'Cloned the course: {course.title}',
+                                   user_type='teacher',
+                                   user=request.user)
+            messages.success(request, 'The course was successfully cloned!')
+            return redirect('teachers:course_change', clone.pk)
+    else:
+        form = CourseCloneForm(initial={'title': course.title, 'code': f'{course.code}-COPY'[:20]})
+
+    context = {
+        'form': form,
+        'course': course,
+        'title': 'Clone Course',
+        'enrollment_request_count': get_enrollment_requests_count(request.user)
+    }
+    return render(request, 'classroom/teachers/course_clone_form.html', context)
+
+
+@login_required
+@teacher_required
+def export_course(request, pk):
+    """Streams the course package: a ZIP with course.json and the lesson
+    images, or only course.json with ?format=json."""
+    course = get_object_or_404(Course.objects.exclude(status='deleted'), pk=pk, owner=request.user)
+    if request.GET.get('format') == 'json':
+        response = StreamingHttpResponse((chunk.encode() for chunk in iter_course_json(course)),
+                                         content_type='application/json')
+        file_name = f'{course.code}.json'
+    else:
+        response = StreamingHttpResponse(iter_course_zip(course), content_type='application/zip')
+        file_name = f'{course.code}.zip'
+    response['Content-Disposition'] = get_content_disposition(file_name, as_attachment=True)
+    return response
+
+
+@login_required
+@teacher_required
+def import_course(request, pk):
+    """Adds the lessons, quizzes, questions and answers of a course package
+    to the course, all or nothing."""
+    course = get_object_or_404(Course.objects.exclude(status='deleted'), pk=pk, owner=request.user)
+
+    if request.method == 'POST':
+        form = CourseImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            try:
+                package, images = read_package(form.cleaned_data['package'])
+                validate_package(package)
+            except ValidationError as e:
+                form.add_error('package', e)
+            else:
+                lesson_count, question_count = import_package(course, package, images)
+
+                UserLog.objects.create(action=f'Imported lessons to the course: {course.title}',
+                                       user_type='teacher',
+                                       user=request.user)
+                messages.success(request, f'{lesson_count} lessons and {question_count} questions '
+                                          f'were added to the course.')
+                return redirect('course_details', course.pk)
+    else:
+        form = CourseImportForm()
+
+    context = {
+        'form': form,
+        'course': course,
+        'title': 'Import Lessons',
+        'enrollment_request_count': get_enrollment_requests_count(request.user)
+    }
+    return render(request, 'classroom/teachers/course_import_form.html', context)
+
+
 @login_required
 @teacher_required
 def delete_course(request, pk):
@@ -469,12 +758,13 @@ def delete_course(request, pk):
 @teacher_required
 def delete_file(request, file_pk):
     teacher = request.user
-    file_get = get_object_or_404(MyFile, pk=file_pk)
-    file_name = MyFile.objects.values_list('file', flat=True).get(id=file_get.pk)
+    file_get = get_object_or_404(MyFile, pk=file_pk, course__owner=teacher)
     # delete from the database
-    MyFile.objects.get(id=file_pk, course__owner=teacher).delete()
-    # remove from the folder
-    os.remove(os.path.join('media', file_name))
+    delete_preview(file_get.pk)
+    file_get.delete()
+    # remove from the folder, unless a copy of the course still uses it
+    if not MyFile.objects.filter(file=file_get.file).exists():
+        default_storage.delete(file_get.file)
 
     UserLog.objects.create(action=f'Deleted file: {str(file_get.file)[16:]}',
                            user_type='teacher',
@@ -490,6 +780,7 @@ def delete_lesson(request, course_pk, lesson_pk):
     teacher = request.user
     lesson_get = get_object_or_404(Lesson, pk=lesson_pk)
     Lesson.objects.filter(id=lesson_get.pk, course__owner=teacher).delete()
+    invalidate_lesson_ids(lesson_get.course_id)
 
     UserLog.objects.create(action=f'Deleted lesson: {lesson_get.title}',
                            user_type='teacher',
@@ -504,6 +795,7 @@ def delete_lesson(request, course_pk, lesson_pk):
 def delete_lesson_from_list(request, lesson_pk):
     lesson_get = get_object_or_404(Lesson, pk=lesson_pk)
     Lesson.objects.filter(id=lesson_pk, course__owner=request.user).delete()
+    invalidate_lesson_ids(lesson_get.course_id)
     messages.success(request, 'The lesson has been successfully deleted.')
 
     UserLog.objects.create(action=f'Deleted lesson: {lesson_get.title}',
@@ -531,6 +823,38 @@ def delete_question(request, course_pk, quiz_pk, question_pk):
     return redirect('teachers:quiz_edit', course_pk, quiz_pk)
 
 
+@login_required
+@teacher_required
+def delete_bank_question(request, bank_pk, question_pk):
+    bank = get_object_or_404(QuestionBank, pk=bank_pk, owner=request.user)
+    get_object_or_404(Question, pk=question_pk, bank=bank).delete()
+    invalidate_bank_question_ids(bank.pk)
+
+    UserLog.objects.create(action=f'Deleted question for the question bank: {bank.name}',
+                           user_type='teacher',
+                           user=request.user)
+
+    messages.success(request, 'The question has been successfully deleted.')
+
+    return redirect('teachers:question_bank_change', bank.pk)
+
+
+@login_required
+@teacher_required
+def delete_question_bank(request, bank_pk):
+    bank = get_object_or_404(QuestionBank, pk=bank_pk, owner=request.user)
+    bank.delete()
+    invalidate_bank_question_ids(bank_pk)
+
+    UserLog.objects.create(action=f'Deleted question bank: {bank.name}',
+                           user_type='teacher',
+                           user=request.user)
+
+    messages.success(request, 'The question bank has been successfully deleted.')
+
+    return redirect('teachers:question_bank_list')
+
+
 @login_required
 @teacher_required
 def delete_quiz(request, quiz_pk):
@@ -562,6 +886,44 @@ def delete_quiz_from_list(request, quiz_pk):
     return redirect('teachers:quiz_list')
 
 
+@login_required
+@teacher_required
+def edit_bank_question(request, bank_pk, question_pk):
+    bank = get_object_or_404(QuestionBank, pk=bank_pk, owner=request.user)
+    question = get_object_or_404(Question, pk=question_pk, bank=bank)
+
+    if request.method == 'POST':
+        form = BankQuestionForm(request.POST, instance=question)
+        formset = AnswerFormSet(request.POST, instance=question)
+        if form.is_valid() and formset.is_valid():
+            with transaction.atomic():
+                form.save()
+                form.save_tags(question)
+                formset.save()
+
+                UserLog.objects.create(action=f'Edited question and answers for the question bank: {bank.name}',
+                                       user_type='teacher',
+                                       user=request.user)
+            invalidate_bank_question_ids(bank.pk)
+
+            messages.success(request, 'Question and answers are successfully saved!')
+            return redirect('teachers:question_bank_change', bank.pk)
+    else:
+        form = BankQuestionForm(instance=question)
+        formset = AnswerFormSet(instance=question)
+
+    context = {
+        'title': 'Edit Question',
+        'bank': bank,
+        'question': question,
+        'form': form,
+        'formset': formset,
+        'enrollment_request_count': get_enrollment_requests_count(request.user)
+    }
+
+    return render(request, 'classroom/teachers/bank_question_change_form.html', context)
+
+
 @login_required
 @teacher_required
 def edit_lesson(request, course_pk, lesson_pk):
@@ -600,17 +962,6 @@ def edit_question(request, course_pk, quiz_pk, question_pk):
     quiz = get_object_or_404(Quiz, pk=quiz_pk, course=course)
     question = get_object_or_404(Question, pk=question_pk, quiz=quiz)
 
-    AnswerFormSet = inlineformset_factory(
-        Question,  # parent model
-        Answer,  # base model
-        formset=BaseAnswerInlineFormSet,
-        fields=('text', 'is_correct'),
-        min_num=2,
-        validate_min=True,
-        max_num=10,
-        validate_max=True
-    )
-
     if request.method == 'POST':
         form = QuestionForm(request.POST, instance=question)
         formset = AnswerFormSet(request.POST, instance=question)
@@ -641,6 +992,39 @@ def edit_question(request, course_pk, quiz_pk, question_pk):
     return render(request, 'classroom/teachers/question_change_form.html', context)
 
 
+@login_required
+@teacher_required
+def edit_question_bank(request, bank_pk):
+    bank = get_object_or_404(QuestionBank, pk=bank_pk, owner=request.user)
+    questions = bank.questions \
+        .annotate(answers_count=Count('answers', distinct=True)) \
+        .prefetch_related('tags') \
+        .order_by('id')
+
+    if request.method == 'POST':
+        form = QuestionBankForm(data=request.POST, instance=bank)
+        if form.is_valid():
+            bank = form.save()
+
+            UserLog.objects.create(action=f'Edited question bank: {bank.name}',
+                                   user_type='teacher',
+                                   user=request.user)
+
+            messages.success(request, 'The question bank was successfully changed.')
+            return redirect('teachers:question_bank_change', bank.pk)
+    else:
+        form = QuestionBankForm(instance=bank)
+
+    context = {
+        'title': 'Edit Question Bank',
+        'bank': bank,
+        'questions': questions,
+        'form': form,
+        'enrollment_request_count': get_enrollment_requests_count(request.user)
+    }
+    return render(request, 'classroom/teachers/question_bank_change_form.html', context)
+
+
 @login_required
 @teacher_required
 def edit_quiz(request, course_pk, quiz_pk):
@@ -649,7 +1033,7 @@ def edit_quiz(request, course_pk, quiz_pk):
     question = Question.objects.filter(quiz=quiz).annotate(answers_count=Count('answers'))
 
     if request.method == 'POST':
-        form = QuizEditForm(data=request.POST, instance=quiz)
+        form = QuizEditForm(request.user, data=request.POST, instance=quiz)
         if form.is_valid():
             quiz = form.save(commit=False)
             quiz.save()
@@ -661,7 +1045,7 @@ def edit_quiz(request, course_pk, quiz_pk):
             messages.success(request, 'The quiz was successfully changed.')
             return redirect('teachers:quiz_edit', quiz.course.pk, quiz.pk)
     else:
-        form = QuizEditForm(instance=quiz)
+        form = QuizEditForm(request.user, instance=quiz)
 
     context = {
         'title': 'Edit Quiz',
@@ -692,6 +1076,9 @@ def profile(request):
         if user_update_form.is_valid() and profile_form.is_valid():
             user_update_form.save()
             profile_form.save()
+            if 'image' in profile_form.changed_data:
+                generate_variants_later(request.user.teacher.image, 'avatar')
+                warm_thumbnails_later(request.user.teacher.image)
 
             UserLog.objects.create(action='Updated Teacher Profile',
                                    user_type='teacher',
@@ -717,26 +1104,14 @@ def profile(request):
 @login_required
 @teacher_required
 def quiz_result_detail(request, quiz_pk, student_pk, taken_pk):
-    quiz = get_object_or_404(Quiz, pk=quiz_pk)
-    questions = Question.objects.filter(quiz=quiz)
-    taken_quiz = get_object_or_404(TakenQuiz, pk=taken_pk, quiz=quiz, student_id=student_pk)
-
-    student_answer = StudentAnswer.objects.raw(
-            get_taken_quiz(student_pk, taken_quiz.pk))
-
-    taken_quiz = TakenQuiz.objects \
-        .select_related('quiz') \
-        .filter(student_id=student_pk, id=taken_quiz.pk, quiz=quiz) \
-        .first()
-
-    answers = Answer.objects.filter(question__in=questions)
+    taken_quiz = get_object_or_404(TakenQuiz.objects.select_related('quiz'), pk=taken_pk, quiz_id=quiz_pk,
+                                   quiz__course__owner=request.user, student_id=student_pk)
     student_name = User.objects.get(pk=student_pk)
 
     context = {
         'title': 'Quiz Result',
-        'student_answers': student_answer,
+        'questions': get_quiz_result(taken_quiz),
         'taken_quiz': taken_quiz,
-        'answers': answers,
         'student_name': student_name,
         'ownership': 'Student\'s',
         'enrollment_request_count': get_enrollment_requests_count(request.user)
@@ -745,6 +1120,17 @@ def quiz_result_detail(request, quiz_pk, student_pk, taken_pk):
     return render(request, 'classroom/students/taken_quiz_result.html', context)
 
 
+@login_required
+@teacher_required
+def quiz_statistics(request, quiz_pk):
+    """Per-question statistics of a quiz as JSON, see quizzes.get_quiz_statistics()."""
+    quiz = get_object_or_404(Quiz, pk=quiz_pk, course__owner=request.user)
+    questions = get_quiz_statistics(quiz.pk)
+
+    return JsonResponse({'quiz': quiz.pk, 'title': quiz.title, 'questions': questions})
+
+
+@throttle('register', fields=('username', 'email'))
 def register(request):
     if request.user.is_authenticated:
         return redirect('home')
@@ -768,22 +1154,13 @@ def register(request):
                 })
 
                 to_email = form.cleaned_data.get('email')
-                email = EmailMessage(mail_subject, message, to=[to_email])
-                try:
-                    email.send()
-                    context = {
-                        'title': 'Account Activation',
-                        'result': 'One more step remaining...',
-                        'message': 'Please confirm your email address to complete the registration.',
-                        'alert': 'info'
-                    }
-                except Exception:
-                    context = {
-                        'title': 'Account Activation',
-                        'result': 'Warning',
-                        'message': 'We\'re sorry, an error has occurred during activation. Please try again.',
-                        'alert': 'warning'
-                    }
+                queue_email(mail_subject, message, [to_email])
+                context = {
+                    'title': 'Account Activation',
+                    'result': 'One more step remaining...',
+                    'message': 'Please confirm your email address to complete the registration.',
+                    'alert': 'info'
+                }
 
                 return render(request, 'authentication/activation.html', context)
         else:
@@ -72,7 +72,7 @@ CKEDITOR_CONFIGS = {
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'classroom.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -110,10 +110,36 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # A file instead of the shared in-memory database, which fails the concurrent
+        # writes of the threaded tests (see classroom/tests.py) with "table is locked":
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# Use a shared cache (e.g. Memcached) in production so that every worker sees the same counters.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # sorl-thumbnail's key-value store (see classroom/thumbnails.py), kept apart so
+    # that the throttling counters and the sessions do not evict the thumbnails:
+    'thumbnails': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'thumbnails',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -127,6 +153,8 @@ AUTH_PASSWORD_VALIDATORS = [
 
 AUTH_USER_MODEL = 'classroom.User'
 
+AUTHENTICATION_BACKENDS = ['classroom.backends.ProfileModelBackend']
+
 LOGIN_URL = 'login'
 
 LOGOUT_URL = 'logout'
@@ -135,6 +163,25 @@ LOGIN_REDIRECT_URL = 'home'
 
 LOGOUT_REDIRECT_URL = 'home'
 
+# Throttling of the authentication views: (max. POST requests, per seconds).
+# The IP limits are higher since a whole classroom may share one IP address. None turns a scope off.
+
+THROTTLE_RATES = {
+    'contact_us': {'ip': (10, 60 * 60), 'email': (5, 60 * 60)},
+    'login': {'ip': (100, 5 * 60), 'username': (10, 5 * 60)},
+    'password_reset': {'ip': (20, 60 * 60), 'email': (5, 60 * 60)},
+    'register': {'ip': (50, 60 * 60), 'username': (5, 60 * 60), 'email': (5, 60 * 60)},
+}
+
+THROTTLE_TRUST_X_FORWARDED_FOR = False  # set to True only behind a trusted reverse proxy
+
+# Sessions are read from the cache and written through to the database.
+# 'django.contrib.sessions.backends.signed_cookies' avoids the database entirely,
+# but the session data is then limited by the cookie size.
+# Expired sessions are removed by the clear_expired_sessions command.
+
+SESSION_ENGINE = 'classroom.sessions'
+
 # Messages built-in framework
 
 MESSAGE_TAGS = {
@@ -163,12 +210,68 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.1/howto/static-files/
 
 STATIC_URL = '/static/'
-# STATIC_ROOT = 'static/'  # for production
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')  # collectstatic output, served by the web server
+
+# Hashed file names (far-future caching) plus precompressed .gz/.br files.
+# With DEBUG = True the original file names are used and runserver serves them.
+STATICFILES_STORAGE = 'classroom.storage.CompressedManifestStaticFilesStorage'
 
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static'),
 ]
 
+# CSS/JS bundles of base.html and staff_base.html, used through the {% bundle %} tag.
+# Run 'python manage.py build_bundles' before collectstatic.
+
+STATIC_BUNDLES = {
+    'base.css': [
+        'css/font-awesome.min.css',
+        'css/themify-icons.css',
+        'css/bootstrap.min.css',
+        'css/plugins.css',
+        'style.css',
+        'btn.css',
+        'stars.css',
+        'star-ratings/css/star-ratings.css',
+    ],
+    'base-head.js': [
+        'js/vendor/modernizr-2.8.3.min.js',
+        'js/jquery-3.4.1.js',
+        'star-ratings/js/dist/star-ratings.min.js',
+    ],
+    'base.js': [
+        'js/popper.min.js',
+        'js/bootstrap.min.js',
+        'js/plugins.js',
+        'js/main.js',
+    ],
+    'staff.css': [
+        'staff/assets/vendor/bootstrap/css/bootstrap.min.css',
+        'staff/assets/vendor/fonts/circular-std/style.css',
+        'staff/assets/libs/css/style.css',
+        'staff/assets/vendor/fonts/fontawesome/css/fontawesome-all.css',
+        'staff/assets/vendor/charts/chartist-bundle/chartist.css',
+        'staff/assets/vendor/charts/morris-bundle/morris.css',
+        'staff/assets/vendor/fonts/material-design-iconic-font/css/materialdesignicons.min.css',
+        'staff/assets/vendor/charts/c3charts/c3.css',
+        'staff/assets/vendor/fonts/flag-icon-css/flag-icon.min.css',
+    ],
+    'staff.js': [
+        'staff/assets/vendor/bootstrap/js/bootstrap.bundle.js',
+        'staff/assets/vendor/slimscroll/jquery.slimscroll.js',
+        'staff/assets/libs/js/main-js.js',
+    ],
+}
+
+# Selectors of the above-the-fold content whose rules are inlined in the page:
+CRITICAL_CSS = {
+    'base.css': ['html', 'body', '*', '.header', '#site-header', '.logo', '.menu', '#nav',
+                 '.container', '.row', '.col-', '.page-heading', '.before-bg', '.bg-image',
+                 '.hidden-', '.btn', '.breadcrumb'],
+    'staff.css': ['html', 'body', '*', '.dashboard-', '.navbar', '.nav-', '.collapse',
+                  '.container', '.row', '.col-', '.page-header', '.card', '.user-avatar'],
+}
+
 # Third party apps configuration
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
@@ -178,10 +281,101 @@ EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_HOST_USER = info.EMAIL
 EMAIL_HOST_PASSWORD = info.EMAIL_PASS
 EMAIL_PORT = 587
+# For local testing, write the emails to files instead of sending them through SMTP:
+# EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
+EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
+
+# Outgoing mail queue (see the send_queued_mail command)
+
+MAIL_QUEUE_BATCH_SIZE = 50
+MAIL_QUEUE_MAX_ATTEMPTS = 5
+MAIL_QUEUE_RETRY_DELAY = 60  # seconds, doubled after every failed attempt
+# A claimed batch is sent again by another worker if it is still not sent after this long:
+MAIL_QUEUE_CLAIM_TIMEOUT = 10 * 60  # seconds
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploads of these directories are stored once per content (SHA-256) in
+# MEDIA_ROOT/.blobs, the names are hard links to it. Run 'python manage.py
+# gc_file_blobs' periodically to delete the content no name uses anymore.
+DEFAULT_FILE_STORAGE = 'classroom.blobs.ContentAddressedStorage'
+CONTENT_ADDRESSED_DIRS = ['class_resources/', 'courses/', 'profile_pics/', 'uploads/']
+
+# How the course files are sent (see classroom/files.py): None streams them from Django,
+# 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache) lets the web server send them, and
+# 'signed-url' redirects to a short-lived URL that nginx's secure_link module checks.
+
+FILE_DELIVERY = None
+FILE_DELIVERY_ACCEL_PREFIX = '/protected-media/'  # internal nginx location aliasing MEDIA_ROOT
+FILE_SIGNED_URL_PREFIX = '/signed-media/'
+FILE_SIGNED_URL_MAX_AGE = 5 * 60  # seconds
+FILE_SIGNED_URL_SECRET = getattr(info, 'FILE_SIGNED_URL_SECRET', None)  # also in the nginx config
+
+# Course files are uploaded in chunks (see classroom/uploads.py), the parts are kept
+# outside of MEDIA_ROOT until the upload is complete.
+
+COURSE_FILE_MAX_SIZE = 200 * 1024 * 1024  # bytes
+CHUNKED_UPLOAD_CHUNK_SIZE = 2 * 1024 * 1024  # bytes per request, streamed to the disk
+CHUNKED_UPLOAD_DIR = os.path.join(BASE_DIR, 'chunked_uploads')
+CHUNKED_UPLOAD_EXPIRY = 24 * 60 * 60  # seconds, see the clear_stale_uploads command
+COURSE_PACKAGE_MAX_SIZE = 200 * 1024 * 1024  # bytes, uncompressed size of an imported course package
+
+# Page count, text and first-page image of the course files, extracted by a pool of
+# worker processes (see classroom/previews.py). 0 extracts them in the request instead.
+DOCUMENT_PREVIEW_WORKERS = 2
+DOCUMENT_PREVIEW_TEXT_LENGTH = 2000  # characters
+DOCUMENT_PREVIEW_WIDTH = 300  # pixels
+# Bytes read into memory from a file, e.g. an uncompressed part of a .docx/.pptx (zip bombs):
+DOCUMENT_PREVIEW_MAX_READ_SIZE = 50 * 1024 * 1024
+
+# The processed lesson content is cached per lesson version (see classroom/lessons.py).
+LESSON_CACHE_TIMEOUT = 24 * 60 * 60  # seconds
+
+# The question ids of the banks that the quizzes draw from (see classroom/quizzes.py).
+QUESTION_BANK_CACHE_TIMEOUT = 24 * 60 * 60  # seconds
+
+# The answers of a timed quiz are accepted until this long after the deadline (the request may
+# be on its way). The finalize_quiz_attempts command grades the attempts that were left open.
+QUIZ_DEADLINE_GRACE = 5  # seconds
+
+# Store the answers of a graded attempt as a list of ids on its TakenQuiz row instead of one
+# StudentAnswer row per question. Run the compact_quiz_answers command after enabling it.
+QUIZ_COMPACT_ANSWERS = False
+
+# The suggested courses of the course pages, computed by the recommend_courses command from the
+# enrollments, the ratings and Student.interests (see classroom/recommendations.py).
+RECOMMENDATION_COUNT = 3  # courses shown
+RECOMMENDATION_NEIGHBORS = 20  # similar courses kept per course for the scores of the students
+RECOMMENDATION_INTEREST_WEIGHT = 0.3  # share of the interests in the scores of the students, 0 to 1
+RECOMMENDATION_CACHE_TIMEOUT = 60 * 60  # seconds
+
+# Offline bundles of the courses (see classroom/offline.py), built once per course version.
+OFFLINE_BUNDLE_DIR = os.path.join(BASE_DIR, 'offline_bundles')
+OFFLINE_BUNDLE_FORMAT = 1  # increase it when the content of the bundles changes
+OFFLINE_BUNDLE_MAX_IMAGE_SIZE = 2 * 1024 * 1024  # bytes, bigger images are linked instead
+
+# Fixed (width, height) sizes generated for the uploaded images, smallest first
+# (see classroom/images.py and the generate_image_variants command)
+
+IMAGE_VARIANTS = {
+    'course': [(370, 240), (740, 480)],
+    'avatar': [(40, 40), (100, 100), (200, 200), (350, 350)],
+}
+IMAGE_VARIANT_WORKERS = 2
+IMAGE_VARIANT_CACHE_TIMEOUT = 24 * 60 * 60  # seconds, how long a variant is known to exist
+IMAGE_VARIANT_MISSING_TIMEOUT = 60  # seconds, how long a variant is known to be missing
+
+# sorl-thumbnail (see the warm_thumbnails and sweep_thumbnails commands)
+
+THUMBNAIL_KVSTORE = 'classroom.thumbnails.KVStore'
+THUMBNAIL_CACHE = 'thumbnails'
+# The profile picture thumbnails used by the templates, created at upload time:
+THUMBNAIL_WARM_UP = [
+    ('40x40', {'crop': 'center'}),
+    ('100x100', {'crop': 'center'}),
+]
+
 TEMPLATE_CONTEXT_PROCESSOR = 'django.core.context_processors.request'
 STAR_RATINGS_STAR_HEIGHT = 20
 
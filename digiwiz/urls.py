@@ -14,6 +14,7 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from ckeditor_uploader import views as uploader_views
+from classroom.throttling import throttle
 from classroom.views import classroom, students, teachers
 from django.contrib import admin
 from django.contrib.auth import views as auth_views
@@ -35,11 +36,14 @@ urlpatterns = [
     path('contact-us/', classroom.contact_us, name='contact_us'),
     path('course/details/<int:pk>/', classroom.CourseDetailView.as_view(), name='course_details'),
     path('course/details/<int:pk>/lesson', students.LessonListView.as_view(), name='lesson_list'),
+    path('course/details/<int:pk>/offline/manifest.json', students.offline_manifest, name='offline_manifest'),
+    path('course/details/<int:pk>/offline/<str:version>.json', students.offline_bundle, name='offline_bundle'),
     path('django-admin/', admin.site.urls),
     path('login/', classroom.login_view, name='login'),
     path('logout/', classroom.logout_view, name='logout'),
     path('password-reset/',
-         auth_views.PasswordResetView.as_view(template_name='authentication/password_reset.html'),
+         throttle('password_reset', fields=('email',))(
+             auth_views.PasswordResetView.as_view(template_name='authentication/password_reset.html')),
          name='password_reset'),
     path('password-reset/done/',
          auth_views.PasswordResetDoneView.as_view(template_name='authentication/password_reset_done.html'),
@@ -53,7 +57,8 @@ urlpatterns = [
     path('ratings/', include('star_ratings.urls', namespace='ratings')),
     path('register/', classroom.register_page, name='register'),
     path('register/student/', students.register, name='student_register'),
-    path('register/teacher/', teachers.register, name='teacher_register')
+    path('register/teacher/', teachers.register, name='teacher_register'),
+    path('signed-media/<path:name>', students.signed_file_view, name='signed_file')
 ]
 
 urlpatterns += staticfiles_urlpatterns()